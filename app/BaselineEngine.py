@@ -0,0 +1,134 @@
+import math
+import numpy as np
+import pandas as pd
+
+class BaselineEngine:
+    """
+    Calculates the baseline characteristics of a cohort: per column the number of values and missing values, numeric
+    summaries (mean, std, min, quartiles, max) for numeric columns, and the count per category for categorical columns.
+    Every column is reduced to its value counts in one value_counts pass per chunk, and all characteristics are derived
+    from the (merged) value counts, so the cohort can be added in chunks (e.g. pages of a SPARQL result) using add().
+    The numeric summaries are exact, and equal those of DataFrame.describe().
+    Category counts are omitted for identifier-like columns (every value unique) and for columns with more than maxCategories
+    categories, as these would disclose individual records.
+    """
+    def __init__(self, maxCategories=50):
+        self.__maxCategories = maxCategories
+        self.__rowCount = 0
+        self.__columnNames = []
+        self.__kinds = {}
+        self.__valueCounts = {}
+        self.__missingCounts = {}
+
+    def add(self, dataFrame):
+        """
+        Add a chunk of the cohort.
+        """
+        self.__rowCount = self.__rowCount + dataFrame.shape[0]
+        for columnName in dataFrame.columns:
+            column = dataFrame[columnName]
+            kind = self.__getKind(column)
+            valueCounts = column.value_counts(dropna=True, sort=False)
+            valueCounts = valueCounts[valueCounts > 0]
+            if kind == "category":
+                # plain index, so counts of chunks with different categories can be merged
+                valueCounts.index = valueCounts.index.astype(object)
+            missingCount = int(column.isna().sum())
+
+            if columnName not in self.__kinds:
+                self.__columnNames.append(columnName)
+                self.__kinds[columnName] = kind
+                self.__valueCounts[columnName] = valueCounts
+                self.__missingCounts[columnName] = missingCount
+                continue
+
+            previousCounts = self.__valueCounts[columnName]
+            if kind != self.__kinds[columnName]:
+                # inconsistent types between chunks: continue with the string representation as categories
+                self.__kinds[columnName] = "category"
+                previousCounts = previousCounts.groupby(previousCounts.index.astype(str)).sum()
+                valueCounts = valueCounts.groupby(valueCounts.index.astype(str)).sum()
+            self.__valueCounts[columnName] = previousCounts.add(valueCounts, fill_value=0)
+            self.__missingCounts[columnName] = self.__missingCounts[columnName] + missingCount
+
+    def getCharacteristics(self):
+        """
+        Return value: dictionary with the number of rows and columns, and per column a dictionary of characteristics
+            (category counts are given as dictionary in value_counts)
+        """
+        characteristics = {}
+        for columnName in self.__columnNames:
+            valueCounts = self.__valueCounts[columnName]
+            columnCharacteristics = {
+                "count": int(valueCounts.sum()),
+                "missing": self.__missingCounts[columnName]
+            }
+            kind = self.__kinds[columnName]
+            if kind == "numeric":
+                columnCharacteristics.update(self.__getNumericCharacteristics(valueCounts))
+            elif kind == "datetime":
+                columnCharacteristics.update(self.__getDatetimeCharacteristics(valueCounts))
+            else:
+                columnCharacteristics.update(self.__getCategoryCharacteristics(valueCounts))
+            characteristics[columnName] = columnCharacteristics
+
+        return {
+            "rows": self.__rowCount,
+            "columns": len(self.__columnNames),
+            "characteristics": characteristics
+        }
+
+    def __getKind(self, column):
+        if pd.api.types.is_bool_dtype(column.dtype):
+            return "category"
+        if pd.api.types.is_numeric_dtype(column.dtype):
+            return "numeric"
+        if pd.api.types.is_datetime64_any_dtype(column.dtype):
+            return "datetime"
+        return "category"
+
+    def __getNumericCharacteristics(self, valueCounts):
+        if valueCounts.shape[0] == 0:
+            return {}
+        valueCounts = valueCounts.sort_index()
+        values = valueCounts.index.to_numpy(dtype=np.float64)
+        weights = valueCounts.to_numpy(dtype=np.float64)
+        count = weights.sum()
+        mean = (values * weights).sum() / count
+        characteristics = {
+            "mean": float(mean),
+            "std": float(math.sqrt((weights * (values - mean) ** 2).sum() / (count - 1))) if count > 1 else np.nan,
+            "min": float(values[0])
+        }
+
+        # quantiles using linear interpolation between the closest ranks (as numpy.percentile and DataFrame.describe)
+        cumulativeCounts = np.cumsum(weights)
+        for quantile, name in [(0.25, "25%"), (0.5, "50%"), (0.75, "75%")]:
+            position = (count - 1) * quantile
+            lowerRank = math.floor(position)
+            lower = values[np.searchsorted(cumulativeCounts, lowerRank, side="right")]
+            upper = values[np.searchsorted(cumulativeCounts, min(lowerRank + 1, count - 1), side="right")]
+            characteristics[name] = float(lower + (position - lowerRank) * (upper - lower))
+
+        characteristics["max"] = float(values[-1])
+        return characteristics
+
+    def __getDatetimeCharacteristics(self, valueCounts):
+        if valueCounts.shape[0] == 0:
+            return {}
+        return {
+            "min": valueCounts.index.min().to_pydatetime(),
+            "max": valueCounts.index.max().to_pydatetime()
+        }
+
+    def __getCategoryCharacteristics(self, valueCounts):
+        characteristics = {
+            "unique": valueCounts.shape[0]
+        }
+        if valueCounts.shape[0] == 0 or valueCounts.shape[0] == valueCounts.sum():
+            return characteristics
+        characteristics["top"] = str(valueCounts.idxmax())
+        characteristics["freq"] = int(valueCounts.max())
+        if valueCounts.shape[0] <= self.__maxCategories:
+            characteristics["value_counts"] = {str(value): int(count) for value, count in valueCounts.items()}
+        return characteristics
@@ -0,0 +1,111 @@
+import os
+import time
+import hashlib
+import threading
+from JsonIndex import JsonIndex
+try:
+    import pyarrow
+    import pyarrow.feather
+except ImportError:
+    pyarrow = None
+
+class CohortCache:
+    """
+    Persistent on-disk cache of decoded cohort data frames (results of data endpoint queries).
+    Entries are keyed by a hash of the endpoint URL and the (normalized) query text, and stored as uncompressed Feather (Arrow IPC)
+    files, which are memory-mapped when read. Entries expire ttl seconds after they were stored, and the least-recently-used
+    entries are evicted when the total size of the cache exceeds maxBytes. Updates of the index are serialized between threads
+    and processes sharing the cache directory (see JsonIndex). Requires pyarrow.
+    """
+    def __init__(self, cacheDirectory, ttl=86400, maxBytes=10 * 2 ** 30):
+        """
+        ttl: number of seconds a cached cohort is used; None keeps entries until they are evicted
+        maxBytes: maximum total size of the cached files
+        """
+        if pyarrow is None:
+            raise ImportError("The cohort cache requires pyarrow")
+        self.__cacheDirectory = cacheDirectory
+        self.__ttl = ttl
+        self.__maxBytes = maxBytes
+        os.makedirs(cacheDirectory, exist_ok=True)
+        self.__index = JsonIndex(cacheDirectory)
+
+    def getDataFrame(self, endpointUrl, query):
+        """
+        Fetch the cached cohort for the given endpoint URL and query. Numeric columns without missing values are not copied:
+        they are read-only views of the memory-mapped file, so the data frame should not be modified in place (as for
+        SharedCohort; assigning new columns is fine). Other columns (e.g. strings and categories) are converted, one column
+        at a time.
+        Return value: Pandas data frame, or None when not cached (or expired)
+        """
+        entryKey = self.__getEntryKey(endpointUrl, query)
+        with self.__index.lock():
+            index = self.__index.read()
+            if entryKey not in index:
+                return None
+            if self.__ttl is not None and time.time() - index[entryKey]["created"] > self.__ttl:
+                self.__removeEntry(index, entryKey)
+                self.__index.write(index)
+                return None
+            try:
+                table = pyarrow.feather.read_table(self.__getEntryPath(entryKey), memory_map=True)
+            except (OSError, pyarrow.ArrowInvalid):
+                self.__removeEntry(index, entryKey)
+                self.__index.write(index)
+                return None
+            index[entryKey]["lastAccess"] = time.time()
+            self.__index.write(index)
+        # self_destruct releases every Arrow column after its conversion, so the table and the data frame are never both in memory
+        return table.to_pandas(split_blocks=True, self_destruct=True)
+
+    def storeDataFrame(self, endpointUrl, query, dataFrame):
+        """
+        Store a decoded cohort, and evict the least-recently-used entries when the cache exceeds its maximum size.
+        """
+        entryKey = self.__getEntryKey(endpointUrl, query)
+        entryPath = self.__getEntryPath(entryKey)
+        # write to a temporary file first, so concurrent readers never see a partially written file
+        temporaryPath = "%s.%d.%d.tmp" % (entryPath, os.getpid(), threading.get_ident())
+        try:
+            pyarrow.feather.write_feather(dataFrame.reset_index(drop=True), temporaryPath, compression="uncompressed")
+        except Exception:
+            if os.path.exists(temporaryPath):
+                os.remove(temporaryPath)
+            raise
+
+        with self.__index.lock():
+            os.replace(temporaryPath, entryPath)
+            index = self.__index.read()
+            index[entryKey] = {
+                "endpointUrl": endpointUrl,
+                "created": time.time(),
+                "lastAccess": time.time(),
+                "size": os.path.getsize(entryPath)
+            }
+            while len(index) > 1 and sum(entry["size"] for entry in index.values()) > self.__maxBytes:
+                leastRecentKey = min(index, key=lambda key: index[key]["lastAccess"])
+                self.__removeEntry(index, leastRecentKey)
+            self.__index.write(index)
+
+    def invalidate(self, endpointUrl=None):
+        """
+        Remove all cached cohorts for the given endpoint URL. When no endpoint URL is given, the complete cache is cleared.
+        """
+        with self.__index.lock():
+            index = self.__index.read()
+            for entryKey in [key for key, entry in index.items() if endpointUrl is None or entry["endpointUrl"] == endpointUrl]:
+                self.__removeEntry(index, entryKey)
+            self.__index.write(index)
+
+    def __getEntryKey(self, endpointUrl, query):
+        return hashlib.sha256((endpointUrl + "\n" + query).encode("utf8")).hexdigest()
+
+    def __getEntryPath(self, entryKey):
+        return os.path.join(self.__cacheDirectory, entryKey + ".feather")
+
+    def __removeEntry(self, index, entryKey):
+        del index[entryKey]
+        try:
+            os.remove(self.__getEntryPath(entryKey))
+        except FileNotFoundError:
+            pass
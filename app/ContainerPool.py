@@ -0,0 +1,231 @@
+import time
+import atexit
+import threading
+import collections
+import contextlib
+import docker
+import requests
+
+class PooledContainer:
+    """
+    Running model container, reachable at baseUrl (http://127.0.0.1:<host port>).
+    """
+    def __init__(self, container, baseUrl):
+        self.container = container
+        self.baseUrl = baseUrl
+        self.lastUsed = time.time()
+
+class ContainerPool:
+    """
+    Process-wide pool of warm model containers, shared by all DockerExecutor instances.
+    Containers are started on demand (at most maxContainersPerImage per image), each bound to a free host port chosen by Docker,
+    and only handed out after the model service responds to HTTP requests. A container is used by one invocation at a time,
+    and returned to the pool afterwards; containers which have been idle for longer than idleTtl seconds are stopped and removed.
+    All started containers (idle, in use or starting up) are stopped when the pool is shut down (at exit of the process).
+    Settings are configured process-wide using ContainerPool.configure().
+    """
+    idleTtl = 600
+    startupTimeout = 60
+    maxContainersPerImage = 2
+    __instance = None
+    __instanceLock = threading.Lock()
+
+    def __init__(self):
+        self.__client = None
+        self.__lock = threading.Condition()
+        self.__idleContainers = collections.defaultdict(list)
+        self.__containerCounts = collections.defaultdict(int)
+        self.__pulledImages = set()
+        # one lock per image, so concurrent startups pull an image only once without blocking the pool
+        self.__pullLocks = collections.defaultdict(threading.Lock)
+        # all started containers which have not been stopped yet, by container id
+        self.__runningContainers = {}
+        self.__reaper = None
+        self.__stopEvent = threading.Event()
+
+    @classmethod
+    def configure(cls, idleTtl=600, startupTimeout=60, maxContainersPerImage=2):
+        """
+        idleTtl: number of seconds an unused container is kept running
+        startupTimeout: maximum number of seconds to wait for a new container to respond
+        maxContainersPerImage: maximum number of concurrently running containers per image (and container port)
+        """
+        cls.idleTtl = idleTtl
+        cls.startupTimeout = startupTimeout
+        cls.maxContainersPerImage = maxContainersPerImage
+
+    @classmethod
+    def getPool(cls):
+        with cls.__instanceLock:
+            if cls.__instance is None:
+                cls.__instance = ContainerPool()
+                atexit.register(cls.__instance.shutdown)
+            return cls.__instance
+
+    @contextlib.contextmanager
+    def container(self, imageUrl, containerPort):
+        """
+        Context manager to use a warm container for the given image: yields the base URL of the model service.
+        A container which failed during use is removed instead of being returned to the pool.
+        """
+        pooledContainer = self.acquire(imageUrl, containerPort)
+        removed = False
+        try:
+            yield pooledContainer.baseUrl
+        except requests.exceptions.ConnectionError:
+            removed = True
+            self.__removeContainer((imageUrl, str(containerPort)), pooledContainer)
+            raise
+        finally:
+            if not removed:
+                self.release(imageUrl, containerPort, pooledContainer)
+
+    def acquire(self, imageUrl, containerPort):
+        """
+        Take an idle container for the given image from the pool, or start a new one when the pool limit allows.
+        Waits for a container to be released when maxContainersPerImage containers are in use.
+        """
+        poolKey = (imageUrl, str(containerPort))
+        with self.__lock:
+            while True:
+                if self.__stopEvent.is_set():
+                    raise RuntimeError("Container pool has been shut down")
+                if len(self.__idleContainers[poolKey]) > 0:
+                    return self.__idleContainers[poolKey].pop()
+                if self.__containerCounts[poolKey] < self.maxContainersPerImage:
+                    self.__containerCounts[poolKey] += 1
+                    break
+                self.__lock.wait()
+
+        try:
+            return self.__startContainer(imageUrl, str(containerPort))
+        except Exception:
+            with self.__lock:
+                self.__containerCounts[poolKey] -= 1
+                self.__lock.notify()
+            raise
+
+    def release(self, imageUrl, containerPort, pooledContainer):
+        """
+        Return a container to the pool.
+        """
+        pooledContainer.lastUsed = time.time()
+        with self.__lock:
+            self.__idleContainers[(imageUrl, str(containerPort))].append(pooledContainer)
+            self.__lock.notify()
+        self.__startReaper()
+
+    def reapIdleContainers(self):
+        """
+        Stop and remove the containers which have been idle for longer than idleTtl seconds.
+        """
+        expiredContainers = []
+        with self.__lock:
+            now = time.time()
+            for poolKey, idleContainers in self.__idleContainers.items():
+                for pooledContainer in [idle for idle in idleContainers if now - idle.lastUsed > self.idleTtl]:
+                    idleContainers.remove(pooledContainer)
+                    self.__containerCounts[poolKey] -= 1
+                    expiredContainers.append(pooledContainer)
+            self.__lock.notify_all()
+        for pooledContainer in expiredContainers:
+            self.__stopContainer(pooledContainer.container)
+
+    def shutdown(self):
+        """
+        Stop and remove all containers started by the pool, including containers which are in use or still starting up,
+        and stop the reaper thread. Invocations using a stopped container fail with a connection error.
+        """
+        self.__stopEvent.set()
+        with self.__lock:
+            runningContainers = list(self.__runningContainers.values())
+            self.__idleContainers.clear()
+            self.__containerCounts.clear()
+            self.__lock.notify_all()
+        for container in runningContainers:
+            self.__stopContainer(container)
+
+    def __startContainer(self, imageUrl, containerPort):
+        client = self.__getClient()
+        with self.__lock:
+            pullLock = self.__pullLocks[imageUrl]
+        with pullLock:
+            if imageUrl not in self.__pulledImages:
+                try:
+                    client.images.pull(imageUrl)
+                except Exception:
+                    print("Could not fetch image " + imageUrl)
+                self.__pulledImages.add(imageUrl)
+
+        # host port None lets Docker assign a free port
+        container = client.containers.run(imageUrl, detach=True, ports={containerPort + '/tcp': ('127.0.0.1', None)})
+        with self.__lock:
+            self.__runningContainers[container.id] = container
+        try:
+            if self.__stopEvent.is_set():
+                # shutdown() started while this container was being created, and did not see it
+                raise RuntimeError("Container pool has been shut down")
+            container.reload()
+            hostPort = container.ports[containerPort + '/tcp'][0]["HostPort"]
+            pooledContainer = PooledContainer(container, "http://127.0.0.1:" + hostPort)
+            self.__waitUntilReady(pooledContainer)
+        except Exception:
+            self.__stopContainer(container)
+            raise
+        print("Started container for %s at %s" % (imageUrl, pooledContainer.baseUrl))
+        return pooledContainer
+
+    def __waitUntilReady(self, pooledContainer):
+        """
+        Poll the model service until it responds to HTTP requests (any response means the service is listening).
+        """
+        deadline = time.time() + self.startupTimeout
+        delay = 0.05
+        while True:
+            try:
+                requests.get(pooledContainer.baseUrl + "/", timeout=2)
+                return
+            except requests.exceptions.RequestException:
+                pass
+            pooledContainer.container.reload()
+            if pooledContainer.container.status not in ("created", "running"):
+                raise RuntimeError("Container %s stopped during startup: %s" % (pooledContainer.container.short_id,
+                    pooledContainer.container.logs(tail=20).decode("utf8", errors="replace")))
+            if time.time() > deadline:
+                raise TimeoutError("Container %s did not respond within %d seconds" % (pooledContainer.container.short_id, self.startupTimeout))
+            time.sleep(delay)
+            delay = min(delay * 2, 1)
+
+    def __removeContainer(self, poolKey, pooledContainer):
+        with self.__lock:
+            self.__containerCounts[poolKey] -= 1
+            self.__lock.notify()
+        self.__stopContainer(pooledContainer.container)
+
+    def __stopContainer(self, container):
+        with self.__lock:
+            # the container may already have been stopped (e.g. by shutdown() while it was in use)
+            if self.__runningContainers.pop(container.id, None) is None:
+                return
+        try:
+            print("Stopping container " + container.short_id)
+            container.stop()
+            container.remove()
+        except Exception as error:
+            print("Could not remove container: " + str(error))
+
+    def __startReaper(self):
+        with self.__lock:
+            if self.__reaper is not None:
+                return
+            def reapPeriodically():
+                while not self.__stopEvent.wait(min(self.idleTtl, 60)):
+                    self.reapIdleContainers()
+            self.__reaper = threading.Thread(target=reapPeriodically, daemon=True)
+            self.__reaper.start()
+
+    def __getClient(self):
+        with self.__lock:
+            if self.__client is None:
+                self.__client = docker.from_env()
+            return self.__client
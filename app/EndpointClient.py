@@ -0,0 +1,308 @@
+import json
+import threading
+import warnings
+import contextlib
+import rdflib
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+class SparqlEndpointClient:
+    """
+    Client for a SPARQL 1.1 endpoint (GraphDB/RDF4J repository).
+    All clients share one HTTP session with a keep-alive connection pool, so repeated queries reuse open (TLS) connections.
+    Pool size, timeouts and retries are configured process-wide using SparqlEndpointClient.configure().
+    """
+    poolSize = 10
+    connectTimeout = 10
+    timeout = 300
+    retries = 3
+    __sessions = {}
+    __sessionLock = threading.Lock()
+
+    def __init__(self, endpointUrl, updateUrl=None):
+        """
+        endpointUrl: URL of the query endpoint
+        updateUrl: URL of the update endpoint, defaults to the RDF4J convention of endpointUrl + "/statements"
+        """
+        self.endpointUrl = endpointUrl
+        self.updateUrl = updateUrl
+        if updateUrl is None:
+            self.updateUrl = endpointUrl + "/statements"
+
+    @classmethod
+    def configure(cls, poolSize=10, timeout=300, connectTimeout=10, retries=3):
+        """
+        Configure the shared connection pool. Clients created before calling this function will also use the new settings.
+        poolSize: maximum number of (keep-alive) connections per host
+        timeout: read timeout in seconds
+        connectTimeout: connect timeout in seconds
+        retries: number of retries on connection errors, and for queries also on 502/503/504 responses
+        """
+        with cls.__sessionLock:
+            cls.poolSize = poolSize
+            cls.timeout = timeout
+            cls.connectTimeout = connectTimeout
+            cls.retries = retries
+            for session in cls.__sessions.values():
+                session.close()
+            cls.__sessions = {}
+
+    @classmethod
+    def getSession(cls, update=False):
+        """
+        Get the shared session for queries, or for updates (update=True).
+        Read errors are never retried. Queries are also retried on 502/503/504 responses; updates (and transactions) are
+        only retried on connection errors, as the endpoint may already have applied an update when it responds with an
+        error, and SPARQL updates are not guaranteed to be idempotent.
+        """
+        with cls.__sessionLock:
+            if update not in cls.__sessions:
+                if update:
+                    retry = Retry(total=cls.retries, connect=cls.retries, read=0, status=0, backoff_factor=0.5)
+                else:
+                    retry = Retry(total=cls.retries, connect=cls.retries, read=0, status=cls.retries,
+                        status_forcelist=[502, 503, 504], allowed_methods=frozenset(["GET", "POST"]), backoff_factor=0.5)
+                adapter = HTTPAdapter(pool_connections=cls.poolSize, pool_maxsize=cls.poolSize, max_retries=retry)
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                cls.__sessions[update] = session
+            return cls.__sessions[update]
+
+    def query(self, queryString, accept="application/sparql-results+json", stream=False):
+        """
+        Perform a SPARQL query (SELECT/ASK/CONSTRUCT/DESCRIBE), and return the (successful) requests.Response object.
+        """
+        response = self.getSession().post(self.endpointUrl,
+            data={"query": queryString},
+            headers={"Accept": accept},
+            timeout=(self.connectTimeout, self.timeout),
+            stream=stream)
+        response.raise_for_status()
+        return response
+
+    def select(self, queryString):
+        """
+        Perform a SPARQL SELECT query.
+        Return value: the parsed SPARQL JSON results
+        """
+        return self.query(queryString).json()
+
+    def construct(self, queryString, accept="application/rdf+xml"):
+        """
+        Perform a SPARQL CONSTRUCT query.
+        Return value: bytes of the RDF serialization given in accept
+        """
+        return self.query(queryString, accept=accept).content
+
+    def update(self, updateStrings):
+        """
+        Perform one or more SPARQL UPDATE operations. A list of operations is sent as one request
+        (operations separated by ';'), which the endpoint executes in a single transaction.
+        """
+        if not isinstance(updateStrings, str):
+            updateStrings = " ;\n".join(updateStrings)
+        response = self.getSession(update=True).post(self.updateUrl,
+            data={"update": updateStrings},
+            timeout=(self.connectTimeout, self.timeout))
+        response.raise_for_status()
+        return response
+
+    def transaction(self):
+        """
+        Start a transaction using the RDF4J transaction protocol (POST <repository>/transactions).
+        Use as context manager: the transaction is committed when the block completes, and rolled back on an exception.
+        """
+        response = self.getSession(update=True).post(self.endpointUrl + "/transactions", timeout=(self.connectTimeout, self.timeout))
+        response.raise_for_status()
+        return SparqlTransaction(self, response.headers["Location"])
+
+class SparqlTransaction:
+    """
+    Open RDF4J transaction, created by SparqlEndpointClient.transaction().
+    """
+    def __init__(self, client, transactionUrl):
+        self.__client = client
+        self.__transactionUrl = transactionUrl
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exceptionType, exceptionValue, traceback):
+        if exceptionType is None:
+            try:
+                self.commit()
+            except Exception:
+                self.__rollbackQuietly()
+                raise
+        else:
+            self.__rollbackQuietly()
+        # returning False re-raises the original exception of the block
+        return False
+
+    def add(self, data, contentType="application/n-triples", graphUri=None):
+        """
+        Add the serialized RDF data (bytes, or an iterator of bytes to stream the request body) to the given named graph.
+        """
+        params = {"action": "ADD"}
+        if graphUri is not None:
+            params["context"] = "<%s>" % graphUri
+        self.__perform(params, data, contentType)
+
+    def update(self, updateStrings):
+        """
+        Perform one or more SPARQL UPDATE operations within the transaction.
+        """
+        if not isinstance(updateStrings, str):
+            updateStrings = " ;\n".join(updateStrings)
+        self.__perform({"action": "UPDATE"}, updateStrings.encode("utf8"), "application/sparql-update")
+
+    def commit(self):
+        self.__perform({"action": "COMMIT"})
+
+    def __rollbackQuietly(self):
+        # a failing rollback must not replace the error that caused it; abandoned transactions eventually time out on the endpoint
+        try:
+            self.rollback()
+        except Exception as e:
+            print("Rollback of transaction %s failed: %s" % (self.__transactionUrl, str(e)))
+
+    def rollback(self):
+        response = self.__client.getSession(update=True).delete(self.__transactionUrl, timeout=(self.__client.connectTimeout, self.__client.timeout))
+        response.raise_for_status()
+
+    def __perform(self, params, data=None, contentType=None):
+        headers = {}
+        if contentType is not None:
+            headers["Content-Type"] = contentType
+        response = self.__client.getSession(update=True).put(self.__transactionUrl, params=params, data=data, headers=headers,
+            timeout=(self.__client.connectTimeout, self.__client.timeout))
+        response.raise_for_status()
+        return response
+
+class LocalEndpointClient:
+    """
+    In-memory stand-in for SparqlEndpointClient, backed by an rdflib Dataset. Intended for testing and benchmarking
+    without a running triple store. Queries are evaluated over the union of all graphs; updates without GRAPH clause
+    operate on the default graph. Transactions are buffered and applied at commit, under a lock.
+    """
+    rdfExtensions = {
+        "application/rdf+xml": "rdf",
+        "application/n-triples": "nt",
+        "text/turtle": "ttl",
+        "application/ld+json": "jsonld"
+    }
+
+    def __init__(self, dataset=None):
+        self.dataset = dataset
+        if dataset is None:
+            self.dataset = rdflib.Dataset(default_union=True)
+        self.__lock = threading.RLock()
+
+    @staticmethod
+    @contextlib.contextmanager
+    def rdflibInternals():
+        """
+        Suppress the deprecation warnings which rdflib (7.x) raises from its own use of Dataset.default_context when
+        evaluating queries and updates on a Dataset. Warnings attributed to other modules are kept.
+        """
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", message="Dataset.default_context is deprecated", category=DeprecationWarning, module="rdflib")
+            yield
+
+    def query(self, queryString, accept="application/sparql-results+json", stream=False):
+        """
+        Perform a query, and return a response object with the serialized results (content attribute and json() function).
+        """
+        with self.__lock, self.rdflibInternals():
+            results = self.dataset.query(queryString)
+            if results.type in ("CONSTRUCT", "DESCRIBE"):
+                content = results.serialize(format=rdflib.util.guess_format("results." + LocalEndpointClient.rdfExtensions.get(accept, "nt")))
+            else:
+                content = results.serialize(format="json")
+        return LocalResponse(content)
+
+    def select(self, queryString):
+        return self.query(queryString).json()
+
+    def construct(self, queryString, accept="application/rdf+xml"):
+        return self.query(queryString, accept=accept).content
+
+    def update(self, updateStrings):
+        if not isinstance(updateStrings, str):
+            updateStrings = " ;\n".join(updateStrings)
+        with self.__lock, self.rdflibInternals():
+            self.dataset.update(updateStrings)
+        return LocalResponse(b"")
+
+    def transaction(self):
+        return LocalTransaction(self, self.__lock)
+
+class LocalResponse:
+    def __init__(self, content):
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content)
+
+class LocalTransaction:
+    def __init__(self, client, lock):
+        self.__client = client
+        self.__lock = lock
+        self.__operations = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exceptionType, exceptionValue, traceback):
+        if exceptionType is None:
+            try:
+                self.commit()
+            except Exception:
+                self.__rollbackQuietly()
+                raise
+        else:
+            self.__rollbackQuietly()
+        # returning False re-raises the original exception of the block
+        return False
+
+    def add(self, data, contentType="application/n-triples", graphUri=None):
+        if not isinstance(data, bytes):
+            data = b"".join(data)
+        self.__operations.append(("add", data, contentType, graphUri))
+
+    def update(self, updateStrings):
+        if not isinstance(updateStrings, str):
+            updateStrings = " ;\n".join(updateStrings)
+        self.__operations.append(("update", updateStrings))
+
+    def commit(self):
+        dataset = self.__client.dataset
+        with self.__lock, LocalEndpointClient.rdflibInternals():
+            # apply on a copy first, so that a failing operation leaves the store untouched
+            workingCopy = rdflib.Dataset(default_union=True)
+            for quad in dataset.quads((None, None, None, None)):
+                workingCopy.add(quad)
+            for operation in self.__operations:
+                if operation[0] == "add":
+                    target = workingCopy.default_graph
+                    if operation[3] is not None:
+                        target = workingCopy.graph(rdflib.URIRef(operation[3]))
+                    target.parse(data=operation[1], format=rdflib.util.guess_format("data." + LocalEndpointClient.rdfExtensions.get(operation[2], "nt")))
+                else:
+                    workingCopy.update(operation[1])
+            for quad in list(dataset.quads((None, None, None, None))):
+                dataset.remove(quad)
+            for quad in workingCopy.quads((None, None, None, None)):
+                dataset.add(quad)
+        self.__operations = []
+
+    def __rollbackQuietly(self):
+        try:
+            self.rollback()
+        except Exception as e:
+            print("Rollback of local transaction failed: " + str(e))
+
+    def rollback(self):
+        self.__operations = []
@@ -0,0 +1,144 @@
+import functools
+import numpy
+import rdflib
+
+FML = "https://fairmodels.org/ontology.owl#"
+
+class Constant:
+    def __init__(self, value):
+        self.value = float(value)
+
+    def evaluate(self, columns, rowCount):
+        return numpy.full(rowCount, self.value)
+
+    def getParameterIds(self):
+        return set()
+
+    def toDict(self):
+        return {"constant": self.value}
+
+class ParameterReference:
+    def __init__(self, parameterId):
+        self.parameterId = parameterId
+
+    def evaluate(self, columns, rowCount):
+        return columns[self.parameterId]
+
+    def getParameterIds(self):
+        return set([self.parameterId])
+
+    def toDict(self):
+        return {"parameter": self.parameterId}
+
+class Operation:
+    """
+    Operation over one or more operand expressions, evaluated element-wise over arrays.
+    """
+    operators = {
+        FML + "Addition": lambda operands: functools.reduce(numpy.add, operands),
+        FML + "Subtraction": lambda operands: functools.reduce(numpy.subtract, operands),
+        FML + "Multiplication": lambda operands: functools.reduce(numpy.multiply, operands),
+        FML + "Division": lambda operands: functools.reduce(numpy.divide, operands),
+        FML + "Power": lambda operands: functools.reduce(numpy.power, operands),
+        FML + "Exponential": lambda operands: numpy.exp(operands[0]),
+        FML + "Logarithm": lambda operands: numpy.log(operands[0]),
+        FML + "Square_root": lambda operands: numpy.sqrt(operands[0])
+    }
+
+    def __init__(self, operationType, operands):
+        if operationType not in self.operators:
+            raise ValueError("Unsupported operation type " + operationType)
+        if len(operands) == 0:
+            raise ValueError("Operation %s has no operands" % operationType)
+        self.operationType = operationType
+        self.operands = operands
+
+    def evaluate(self, columns, rowCount):
+        # invalid values (e.g. the logarithm of a negative value) result in NaN for the affected rows
+        with numpy.errstate(invalid="ignore", divide="ignore", over="ignore"):
+            return self.operators[self.operationType]([operand.evaluate(columns, rowCount) for operand in self.operands])
+
+    def getParameterIds(self):
+        return set().union(*[operand.getParameterIds() for operand in self.operands])
+
+    def toDict(self):
+        return {"operation": self.operationType, "operands": [operand.toDict() for operand in self.operands]}
+
+class ExpressionCompiler:
+    """
+    Compiles the operation structure of an algorithm description (fml:contains_operation, with fml:Primary_operation_value_reference,
+    fml:secondary_operation_value and fml:has_operation_value as operands) into an expression tree, which is evaluated over
+    whole columns at once. The operands of an operation are ordered as primary value, secondary value, and the remaining
+    operation values. Intercepts (and other value nodes) become constants, input parameters become parameter references,
+    and the operations of the linear predictor are added up.
+    """
+    operandRoles = [FML + "Primary_operation_value_reference", FML + "secondary_operation_value", FML + "has_operation_value"]
+
+    @staticmethod
+    def compileAlgorithm(queryResults):
+        """
+        Compile the results of the operations query (all nodes reachable from the linear predictor, with their types, operands
+        and values) into an expression tree.
+        """
+        nodes = {}
+        rootNode = None
+        for row in queryResults:
+            node = nodes.setdefault(row["node"], {"types": set(), "operands": {}, "value": None})
+            if row["nodeType"] is not None:
+                node["types"].add(str(row["nodeType"]))
+            if row["role"] is not None:
+                node["operands"].setdefault(str(row["role"]), set()).add(row["operand"])
+            if row["value"] is not None:
+                node["value"] = row["value"]
+            if row["node"] == row["linearPredictor"]:
+                rootNode = row["node"]
+
+        if rootNode is None:
+            raise ValueError("No linear predictor found for the algorithm")
+        return ExpressionCompiler.__compileNode(nodes, rootNode, set())
+
+    @staticmethod
+    def __compileNode(nodes, nodeId, visitedNodes):
+        if isinstance(nodeId, rdflib.Literal):
+            return Constant(nodeId.toPython())
+        if nodeId in visitedNodes:
+            raise ValueError("Cyclic operation structure at " + str(nodeId))
+        node = nodes.get(nodeId, {"types": set(), "operands": {}, "value": None})
+        if FML + "Algorithm_Input_Parameter" in node["types"]:
+            return ParameterReference(str(nodeId))
+
+        visitedNodes = visitedNodes | set([nodeId])
+        if FML + "contains_operation" in node["operands"]:
+            # the linear predictor itself: the sum of its operations
+            operands = [ExpressionCompiler.__compileNode(nodes, operand, visitedNodes) for operand in ExpressionCompiler.__sortNodes(node["operands"][FML + "contains_operation"])]
+            return Operation(FML + "Addition", operands)
+
+        operationTypes = [nodeType for nodeType in node["types"] if nodeType in Operation.operators]
+        if len(operationTypes) == 0:
+            if node["value"] is not None:
+                return Constant(node["value"].toPython())
+            raise ValueError("Unsupported operation %s (types: %s)" % (str(nodeId), ", ".join(sorted(node["types"]))))
+        if len(operationTypes) > 1:
+            raise ValueError("Ambiguous operation %s (types: %s)" % (str(nodeId), ", ".join(sorted(operationTypes))))
+
+        operands = []
+        for role in ExpressionCompiler.operandRoles:
+            for operand in ExpressionCompiler.__sortNodes(node["operands"].get(role, set())):
+                operands.append(ExpressionCompiler.__compileNode(nodes, operand, visitedNodes))
+        return Operation(operationTypes[0], operands)
+
+    @staticmethod
+    def __sortNodes(nodeIds):
+        # operation values are unordered in RDF, hence sorted for a reproducible evaluation order
+        return sorted(nodeIds, key=lambda nodeId: (isinstance(nodeId, rdflib.BNode), str(nodeId)))
+
+    @staticmethod
+    def fromDict(expression):
+        """
+        Restore an expression tree from its toDict() representation (e.g. from a compiled specification in the ModelCache).
+        """
+        if "constant" in expression:
+            return Constant(expression["constant"])
+        if "parameter" in expression:
+            return ParameterReference(expression["parameter"])
+        return Operation(expression["operation"], [ExpressionCompiler.fromDict(operand) for operand in expression["operands"]])
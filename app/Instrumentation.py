@@ -0,0 +1,287 @@
+import os
+import json
+import time
+import resource
+import threading
+import contextlib
+import contextvars
+from datetime import datetime, timezone
+
+class RequestMetrics:
+    """
+    Per-stage durations (self time, see Instrumentation.stage), row counts and transferred bytes of one validation request,
+    and the peak resident set size (RSS) of the process during the request. As the peak RSS is measured for the process,
+    it also includes requests processed concurrently in other threads. On Linux, the peak is measured from the start of
+    the request (or of the oldest concurrently running request); on other systems, the peak RSS since process start is reported.
+    """
+    def __init__(self, requestId):
+        self.requestId = requestId
+        self.startTime = datetime.now(timezone.utc)
+        self.endTime = None
+        self.status = None
+        self.stages = {}
+        self.peakRssBytes = None
+        self.__startCounter = time.perf_counter()
+        self.__lock = threading.Lock()
+
+    def addStage(self, stageName, duration):
+        with self.__lock:
+            stage = self.__getStage(stageName)
+            stage["count"] += 1
+            stage["seconds"] += duration
+
+    def addCounts(self, stageName, rows=0, transferredBytes=0):
+        with self.__lock:
+            stage = self.__getStage(stageName)
+            stage["rows"] += rows
+            stage["bytes"] += transferredBytes
+
+    def finish(self, status):
+        with self.__lock:
+            self.status = status
+            self.endTime = datetime.now(timezone.utc)
+            self.peakRssBytes = Instrumentation.getPeakRssBytes()
+
+    def getDuration(self):
+        return time.perf_counter() - self.__startCounter
+
+    def toDict(self):
+        """
+        Return value: JSON-serializable dictionary of the request metrics (as used for the structured log records)
+        """
+        with self.__lock:
+            return {
+                "request": self.requestId,
+                "status": self.status,
+                "start": self.startTime.isoformat(),
+                "duration": self.getDuration(),
+                "peak_rss_bytes": Instrumentation.getPeakRssBytes() if self.endTime is None else self.peakRssBytes,
+                "stages": {stageName: dict(stage) for stageName, stage in self.stages.items()}
+            }
+
+    def __getStage(self, stageName):
+        if stageName not in self.stages:
+            self.stages[stageName] = {"count": 0, "seconds": 0.0, "rows": 0, "bytes": 0}
+        return self.stages[stageName]
+
+class Instrumentation:
+    """
+    Process-wide instrumentation of the validation pipeline. Code paths are wrapped in stage() blocks, which measure the duration
+    and collect the row counts and transferred bytes reported with addRows() and addBytes(). Stages are attributed to the request
+    opened with request() in the current context (contextvars, so the request follows the code into asyncio tasks, and into
+    worker threads started with contextvars.copy_context()), and aggregated over all requests for the Prometheus text exposition.
+    When structuredLogs is enabled, one JSON record per request is printed when the request completes.
+    """
+    structuredLogs = False
+    prometheusFile = None
+    __currentRequest = contextvars.ContextVar("currentRequest", default=None)
+    __currentStages = contextvars.ContextVar("currentStages", default=())
+    __lock = threading.Lock()
+    __stageTotals = {}
+    __requestTotals = {}
+    __activeRequests = 0
+    __processPeakRssBytes = 0
+
+    @classmethod
+    def configure(cls, structuredLogs=False, prometheusFile=None):
+        """
+        structuredLogs: print one JSON record per request with the per-stage durations, rows, bytes and peak RSS
+        prometheusFile: file to write the Prometheus text exposition to after every run (e.g. for the node exporter
+            textfile collector), None disables the file
+        """
+        cls.structuredLogs = structuredLogs
+        cls.prometheusFile = prometheusFile
+
+    @classmethod
+    @contextlib.contextmanager
+    def request(cls, requestId):
+        """
+        Context manager to collect the metrics of one validation request; yields the RequestMetrics object.
+        """
+        with cls.__lock:
+            cls.__activeRequests += 1
+            # the peak RSS is only reset when no other request is running, so the peak of those requests is kept
+            if cls.__activeRequests == 1:
+                cls.__resetPeakRss()
+        requestMetrics = RequestMetrics(requestId)
+        requestToken = cls.__currentRequest.set(requestMetrics)
+        stagesToken = cls.__currentStages.set(())
+        status = "failed"
+        try:
+            yield requestMetrics
+            status = "succeeded"
+        finally:
+            cls.__currentStages.reset(stagesToken)
+            cls.__currentRequest.reset(requestToken)
+            requestMetrics.finish(requestMetrics.status or status)
+            with cls.__lock:
+                cls.__activeRequests -= 1
+                cls.__requestTotals[requestMetrics.status] = cls.__requestTotals.get(requestMetrics.status, 0) + 1
+            if cls.structuredLogs:
+                print(json.dumps(dict(event="validation_request", **requestMetrics.toDict())))
+
+    @classmethod
+    def getCurrentRequest(cls):
+        return cls.__currentRequest.get()
+
+    @classmethod
+    @contextlib.contextmanager
+    def stage(cls, stageName):
+        """
+        Context manager to measure a stage of the pipeline. Stages can be nested; the duration of a stage is recorded as self time
+        (excluding the time of the stages nested in it), so the stage durations do not overlap and add up to the measured time.
+        Rows and bytes are attributed to the innermost stage.
+        """
+        # [stage name, seconds spent in nested stages]
+        stageFrame = [stageName, 0.0]
+        parentStages = cls.__currentStages.get()
+        stagesToken = cls.__currentStages.set(parentStages + (stageFrame,))
+        startTime = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - startTime
+            cls.__currentStages.reset(stagesToken)
+            with cls.__lock:
+                if len(parentStages) > 0:
+                    parentStages[-1][1] += elapsed
+                # nested stages running concurrently (e.g. in asyncio tasks) can add up to more than the elapsed time
+                duration = max(elapsed - stageFrame[1], 0.0)
+            requestMetrics = cls.__currentRequest.get()
+            if requestMetrics is not None:
+                requestMetrics.addStage(stageName, duration)
+            with cls.__lock:
+                stageTotals = cls.__getStageTotals(stageName)
+                stageTotals["count"] += 1
+                stageTotals["seconds"] += duration
+
+    @classmethod
+    def addRows(cls, rows):
+        cls.__addCounts(rows=int(rows))
+
+    @classmethod
+    def addBytes(cls, transferredBytes):
+        cls.__addCounts(transferredBytes=int(transferredBytes))
+
+    @classmethod
+    def __addCounts(cls, rows=0, transferredBytes=0):
+        stages = cls.__currentStages.get()
+        if len(stages) == 0:
+            return
+        requestMetrics = cls.__currentRequest.get()
+        if requestMetrics is not None:
+            requestMetrics.addCounts(stages[-1][0], rows=rows, transferredBytes=transferredBytes)
+        with cls.__lock:
+            stageTotals = cls.__getStageTotals(stages[-1][0])
+            stageTotals["rows"] += rows
+            stageTotals["bytes"] += transferredBytes
+
+    @classmethod
+    def __getStageTotals(cls, stageName):
+        if stageName not in cls.__stageTotals:
+            cls.__stageTotals[stageName] = {"count": 0, "seconds": 0.0, "rows": 0, "bytes": 0}
+        return cls.__stageTotals[stageName]
+
+    @classmethod
+    def getPeakRssBytes(cls):
+        """
+        Return value: peak resident set size of the process in bytes since the last reset of the peak (at the start of a request),
+            or since process start where the peak cannot be reset
+        """
+        peakRss = cls.__readStatusBytes("VmHWM")
+        if peakRss is not None:
+            return peakRss
+        return cls.__getMaxRssBytes()
+
+    @classmethod
+    def getProcessPeakRssBytes(cls):
+        """
+        Return value: peak resident set size of the process in bytes since process start
+        """
+        with cls.__lock:
+            processPeakRss = cls.__processPeakRssBytes
+        return max(processPeakRss, cls.getPeakRssBytes(), cls.__getMaxRssBytes())
+
+    @classmethod
+    def __resetPeakRss(cls):
+        """
+        Reset the peak RSS of the process (VmHWM) to the current RSS, by writing 5 to /proc/self/clear_refs (Linux 4.0 and later).
+        The peak until now is kept for getProcessPeakRssBytes(), as the kernel also lowers ru_maxrss for the running process.
+        """
+        peakRss = cls.__readStatusBytes("VmHWM")
+        if peakRss is None:
+            return
+        cls.__processPeakRssBytes = max(cls.__processPeakRssBytes, peakRss)
+        try:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+        except OSError:
+            pass
+
+    @staticmethod
+    def __readStatusBytes(fieldName):
+        """
+        Return value: the given memory field of /proc/self/status in bytes, or None when not available (e.g. on macOS)
+        """
+        try:
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith(fieldName + ":"):
+                        return int(line.split()[1]) * 1024
+        except (OSError, ValueError, IndexError):
+            pass
+        return None
+
+    @staticmethod
+    def __getMaxRssBytes():
+        # ru_maxrss is given in kilobytes on Linux, and in bytes on macOS
+        peakRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if os.uname().sysname == "Darwin":
+            return peakRss
+        return peakRss * 1024
+
+    @classmethod
+    def getPrometheusText(cls):
+        """
+        Return value: Prometheus text exposition (version 0.0.4) of the stage and request totals since process start
+        """
+        with cls.__lock:
+            stageTotals = {stageName: dict(totals) for stageName, totals in cls.__stageTotals.items()}
+            requestTotals = dict(cls.__requestTotals)
+
+        lines = []
+        for metricName, field, metricHelp in [
+                ("validation_stage_duration_seconds_total", "seconds", "Total time spent per pipeline stage, excluding nested stages."),
+                ("validation_stage_calls_total", "count", "Number of executions per pipeline stage."),
+                ("validation_stage_rows_total", "rows", "Number of rows processed per pipeline stage."),
+                ("validation_stage_bytes_total", "bytes", "Number of bytes transferred per pipeline stage.")]:
+            lines.append("# HELP %s %s" % (metricName, metricHelp))
+            lines.append("# TYPE %s counter" % metricName)
+            for stageName in sorted(stageTotals):
+                lines.append('%s{stage="%s"} %s' % (metricName, cls.__escapeLabel(stageName), repr(stageTotals[stageName][field])))
+
+        lines.append("# HELP validation_requests_total Number of processed validation requests per status.")
+        lines.append("# TYPE validation_requests_total counter")
+        for status in sorted(requestTotals):
+            lines.append('validation_requests_total{status="%s"} %d' % (cls.__escapeLabel(status), requestTotals[status]))
+
+        lines.append("# HELP process_peak_resident_memory_bytes Peak resident set size of the process.")
+        lines.append("# TYPE process_peak_resident_memory_bytes gauge")
+        lines.append("process_peak_resident_memory_bytes %d" % cls.getProcessPeakRssBytes())
+        return "\n".join(lines) + "\n"
+
+    @classmethod
+    def writePrometheusFile(cls):
+        """
+        Write the Prometheus text exposition to the configured prometheusFile (atomically, by renaming a temporary file).
+        """
+        if cls.prometheusFile is None:
+            return
+        temporaryFile = "%s.%d.tmp" % (cls.prometheusFile, os.getpid())
+        with open(temporaryFile, "w") as f:
+            f.write(cls.getPrometheusText())
+        os.replace(temporaryFile, cls.prometheusFile)
+
+    @staticmethod
+    def __escapeLabel(value):
+        return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
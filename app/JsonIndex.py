@@ -0,0 +1,57 @@
+import os
+import json
+import threading
+import contextlib
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+class JsonIndex:
+    """
+    Index file (index.json) of an on-disk cache directory, used by ModelCache and CohortCache: a dictionary of entry key
+    to entry properties. Read-modify-write cycles of the index are serialized between threads, and between processes sharing
+    the cache directory using a lock file (fcntl.flock, where available). The index is replaced atomically on every write.
+    """
+    def __init__(self, cacheDirectory):
+        self.__indexPath = os.path.join(cacheDirectory, "index.json")
+        self.__lockPath = os.path.join(cacheDirectory, "index.lock")
+        self.__lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def lock(self):
+        """
+        Hold the lock for a read-modify-write of the index. The lock is taken on a separate lock file, as the index
+        itself is replaced on every write.
+        """
+        with self.__lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.__lockPath, "a") as lockFile:
+                fcntl.flock(lockFile, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lockFile, fcntl.LOCK_UN)
+
+    def read(self):
+        """
+        Return value: the index, or an empty dictionary when the index does not exist (or cannot be read)
+        """
+        try:
+            with open(self.__indexPath) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def write(self, index):
+        self.writeJson(self.__indexPath, index)
+
+    @staticmethod
+    def writeJson(path, content):
+        # write to a temporary file first, so concurrent readers never see a partially written file
+        temporaryPath = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+        with open(temporaryPath, "w") as f:
+            json.dump(content, f)
+        os.replace(temporaryPath, path)
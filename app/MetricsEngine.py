@@ -0,0 +1,392 @@
+import math
+import numpy as np
+
+class MetricsEngine:
+    """
+    Calculates the validation metrics of a binary outcome (AUC, ROC curve, precision/recall curve, Brier score and
+    calibration curve). The predictions are sorted once, and all threshold-based metrics are derived from the cumulative
+    true/false positive counts of that single sort (instead of one sort per sklearn function).
+    The results are identical to sklearn's roc_auc_score, roc_curve, precision_recall_curve, brier_score_loss and
+    calibration_curve (with default arguments).
+    """
+    @staticmethod
+    def calculateMetrics(observed, predicted, calibrationBins=5):
+        """
+        Calculate the validation metrics for the given observed outcomes (0/1, or -1/1) and predicted probabilities.
+        Return value: dictionary with count, auc, brier, precision_recall_curve, roc_curve and calibration_curve
+        """
+        positive, predicted = MetricsEngine.prepareInput(observed, predicted)
+        if predicted.shape[0] == 0:
+            raise ValueError("No observations available to calculate validation metrics")
+
+        # descending order of the predictions; the order within ties does not matter, as counts are only taken
+        # at the last position of every distinct prediction value
+        order = np.argsort(predicted, kind="mergesort")[::-1]
+        sortedPredicted = predicted[order]
+        sortedPositive = positive[order].astype(np.float64)
+        thresholdIndices = np.r_[np.where(np.diff(sortedPredicted))[0], sortedPredicted.shape[0] - 1]
+        tps = np.cumsum(sortedPositive)[thresholdIndices]
+        fps = 1 + thresholdIndices.astype(np.float64) - tps
+
+        metrics = MetricsEngine.calculateCurves(tps, fps)
+        metrics["count"] = predicted.shape[0]
+        metrics["brier"] = MetricsEngine.calculateBrier(positive, predicted)
+        metrics["calibration_curve"] = MetricsEngine.calculateCalibrationCurve(positive, predicted, calibrationBins)
+        metrics["calibration_intercept"], metrics["calibration_slope"] = MetricsEngine.calculateCalibrationLine(positive, predicted)
+        return metrics
+
+    @staticmethod
+    def prepareInput(observed, predicted):
+        """
+        Convert the observed outcomes to a boolean array (True for the positive class 1), and the predictions to float64.
+        """
+        observed = np.asarray(observed)
+        predicted = np.asarray(predicted, dtype=np.float64)
+        if observed.shape != predicted.shape:
+            raise ValueError("Observed outcomes (%d) and predictions (%d) differ in length" % (observed.shape[0], predicted.shape[0]))
+        isPositive = observed == 1
+        isNegative = (observed == 0) | (observed == -1)
+        if not np.all(isPositive | isNegative) or (np.any(observed == 0) and np.any(observed == -1)):
+            raise ValueError("Observed outcome should be binary (0/1 or -1/1)")
+        return (isPositive, predicted)
+
+    @staticmethod
+    def calculateCurves(tps, fps):
+        """
+        Derive the ROC curve, AUC and precision/recall curve from the cumulative true and false positive counts
+        at every distinct threshold (in order of descending threshold).
+        """
+        # ROC curve: drop the points which are collinear with their neighbours, and start at (0, 0)
+        rocTps = tps
+        rocFps = fps
+        if fps.shape[0] > 2:
+            optimalIndices = np.where(np.r_[True, np.logical_or(np.diff(fps, 2), np.diff(tps, 2)), True])[0]
+            rocTps = tps[optimalIndices]
+            rocFps = fps[optimalIndices]
+        rocTps = np.r_[0.0, rocTps]
+        rocFps = np.r_[0.0, rocFps]
+        fpr = np.full(rocFps.shape, np.nan) if rocFps[-1] <= 0 else rocFps / rocFps[-1]
+        tpr = np.full(rocTps.shape, np.nan) if rocTps[-1] <= 0 else rocTps / rocTps[-1]
+
+        auc = np.nan
+        if rocFps[-1] > 0 and rocTps[-1] > 0:
+            # trapezoidal rule, as numpy.trapezoid
+            auc = float((np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2.0).sum())
+
+        predictedPositives = tps + fps
+        precision = np.zeros_like(tps)
+        np.divide(tps, predictedPositives, out=precision, where=predictedPositives != 0)
+        recall = np.full(tps.shape, 1.0) if tps[-1] == 0 else tps / tps[-1]
+
+        return {
+            "auc": auc,
+            "precision_recall_curve": {
+                "precision": np.r_[precision[::-1], 1.0],
+                "recall": np.r_[recall[::-1], 0.0]
+            },
+            "roc_curve": {
+                "fpr": fpr,
+                "tpr": tpr
+            }
+        }
+
+    @staticmethod
+    def calculateBrier(positive, predicted):
+        """
+        Brier score; calculated as sklearn does (mean over both one-hot encoded classes, scaled by half).
+        """
+        observed = positive.astype(np.float64)
+        squaredErrors = ((1 - observed) - (1 - predicted)) ** 2 + (observed - predicted) ** 2
+        return float(np.average(squaredErrors) * 0.5)
+
+    @staticmethod
+    def calculateCalibrationCurve(positive, predicted, calibrationBins=5):
+        """
+        Calibration curve over uniform bins of the predicted probability.
+        Return value: dictionary with prob_true and prob_pred, or None when the predictions are not within [0, 1]
+        """
+        if predicted.min() < 0 or predicted.max() > 1:
+            print("Could not calculate calibration curve (predictions outside [0, 1])")
+            return None
+        binEdges = np.linspace(0.0, 1.0, calibrationBins + 1)
+        binIds = np.searchsorted(binEdges[1:-1], predicted)
+        binSums = np.bincount(binIds, weights=predicted, minlength=calibrationBins)
+        binTrue = np.bincount(binIds, weights=positive, minlength=calibrationBins)
+        binTotal = np.bincount(binIds, minlength=calibrationBins)
+        return MetricsEngine.calibrationFromBins(binSums, binTrue, binTotal)
+
+    @staticmethod
+    def calculateCalibrationLine(positive, predicted):
+        """
+        Calibration intercept (calibration-in-the-large) and calibration slope of the predictions.
+        Return value: tuple (intercept, slope), NaN when the predictions are not within [0, 1] or the fit does not converge
+        """
+        if predicted.min() < 0 or predicted.max() > 1:
+            return (np.nan, np.nan)
+        with np.errstate(over="ignore", invalid="ignore"):
+            intercept, a, slope = MetricsEngine.fitCalibrationLines(MetricsEngine.logit(predicted),
+                positive.astype(np.float64)[np.newaxis, :], np.ones((1, predicted.shape[0])))
+        return (float(intercept[0]), float(slope[0]))
+
+    @staticmethod
+    def logit(predicted):
+        predicted = np.clip(predicted, 1e-15, 1 - 1e-15)
+        return np.log(predicted / (1 - predicted))
+
+    @staticmethod
+    def fitCalibrationLines(logits, positiveCounts, totalCounts, start=(0.0, 0.0, 1.0), maxIterations=50, tolerance=1e-8):
+        """
+        Fit the logistic recalibration models for several (weighted) samples at once, using Newton-Raphson.
+        logits: logit of the predictions, shape (n,)
+        positiveCounts, totalCounts: number of positive outcomes and number of observations per prediction and sample, shape (samples, n)
+        start: initial values (intercept, a, b); starting from the estimates of the complete sample, bootstrap samples converge in a few iterations
+        Return value: tuple of arrays (intercept, a, b); the calibration intercept is fitted with the logits as offset (slope fixed to 1),
+            a and b (calibration slope) in the model logit(p) = a + b * logit(prediction)
+        """
+        sampleCount = totalCounts.shape[0]
+        intercept = np.full(sampleCount, start[0])
+        for iteration in range(maxIterations):
+            expected = totalCounts / (1 + np.exp(-(intercept[:, np.newaxis] + logits)))
+            gradient = (positiveCounts - expected).sum(axis=1)
+            information = (expected * (1 - expected / np.maximum(totalCounts, 1))).sum(axis=1)
+            step = np.divide(gradient, information, out=np.full(sampleCount, np.nan), where=information > 0)
+            intercept = intercept + step
+            if not np.any(np.abs(step) > tolerance):
+                break
+
+        a = np.full(sampleCount, start[1])
+        b = np.full(sampleCount, start[2])
+        for iteration in range(maxIterations):
+            expected = totalCounts / (1 + np.exp(-(a[:, np.newaxis] + b[:, np.newaxis] * logits)))
+            residuals = positiveCounts - expected
+            variance = expected * (1 - expected / np.maximum(totalCounts, 1))
+            gradientA = residuals.sum(axis=1)
+            gradientB = residuals @ logits
+            informationAA = variance.sum(axis=1)
+            informationAB = variance @ logits
+            informationBB = variance @ (logits * logits)
+            determinant = informationAA * informationBB - informationAB * informationAB
+            valid = determinant > 0
+            determinant = np.where(valid, determinant, 1.0)
+            stepA = np.where(valid, (informationBB * gradientA - informationAB * gradientB) / determinant, np.nan)
+            stepB = np.where(valid, (informationAA * gradientB - informationAB * gradientA) / determinant, np.nan)
+            a = a + stepA
+            b = b + stepB
+            if not np.any(np.abs(stepA) > tolerance) and not np.any(np.abs(stepB) > tolerance):
+                break
+
+        # samples which did not converge (e.g. complete separation) have no estimate
+        intercept[~(np.abs(step) <= tolerance)] = np.nan
+        b[~((np.abs(stepA) <= tolerance) & (np.abs(stepB) <= tolerance))] = np.nan
+        a[np.isnan(b)] = np.nan
+        return (intercept, a, b)
+
+    @staticmethod
+    def calibrationFromBins(binSums, binTrue, binTotal):
+        nonzero = binTotal != 0
+        return {
+            "prob_true": binTrue[nonzero] / binTotal[nonzero],
+            "prob_pred": binSums[nonzero] / binTotal[nonzero]
+        }
+
+class MetricsBootstrap:
+    """
+    Bootstrap confidence intervals (percentile method) for AUC, Brier score, calibration intercept and calibration slope.
+    The cohort is sorted once; every bootstrap replicate is represented as a row of a count matrix (how often each observation
+    was drawn, derived from a matrix of resampled indices), so the metrics of a block of replicates are calculated using
+    matrix operations: weighted cumulative sums for AUC, a matrix product for the Brier score, and a batched Newton-Raphson fit
+    for the calibration line. Blocks of replicates can be spread over a process pool (concurrent.futures executor).
+    Every block has its own random stream (derived from the seed), so results only depend on the seed, not on the number of processes.
+    """
+    maxBlockElements = 4000000
+
+    def __init__(self, replicates=1000, seed=None, confidenceLevel=0.95, executor=None):
+        self.__replicates = replicates
+        self.__seed = seed
+        self.__confidenceLevel = confidenceLevel
+        self.__executor = executor
+
+    def calculateIntervals(self, observed, predicted):
+        """
+        Calculate the bootstrap confidence intervals for the given observed outcomes and predicted probabilities.
+        Return value: dictionary with the settings (replicates, confidence_level, seed) and the lower/upper bound per metric
+        """
+        positive, predicted = MetricsEngine.prepareInput(observed, predicted)
+        if predicted.shape[0] == 0:
+            raise ValueError("No observations available to calculate validation metrics")
+        order = np.argsort(predicted, kind="mergesort")[::-1]
+        sortedPositive = positive[order]
+        sortedPredicted = predicted[order]
+
+        observationCount = predicted.shape[0]
+        blockSize = max(1, min(math.ceil(self.__replicates / 16), self.maxBlockElements // observationCount))
+        blockSizes = [min(blockSize, self.__replicates - start) for start in range(0, self.__replicates, blockSize)]
+        seeds = np.random.SeedSequence(self.__seed).spawn(len(blockSizes))
+
+        if self.__executor is None:
+            blocks = [MetricsBootstrap.calculateReplicates(sortedPositive, sortedPredicted, size, seed) for size, seed in zip(blockSizes, seeds)]
+        else:
+            futures = [self.__executor.submit(MetricsBootstrap.calculateReplicates, sortedPositive, sortedPredicted, size, seed)
+                for size, seed in zip(blockSizes, seeds)]
+            blocks = [future.result() for future in futures]
+        replicateMetrics = np.concatenate(blocks)
+
+        tail = (1 - self.__confidenceLevel) / 2 * 100
+        intervals = {
+            "replicates": self.__replicates,
+            "confidence_level": self.__confidenceLevel
+        }
+        if self.__seed is not None:
+            intervals["seed"] = self.__seed
+        for column, metricName in enumerate(["auc", "brier", "calibration_intercept", "calibration_slope"]):
+            values = replicateMetrics[:, column]
+            values = values[~np.isnan(values)]
+            lower, upper = (np.nan, np.nan)
+            if values.shape[0] > 0:
+                lower, upper = np.percentile(values, [tail, 100 - tail])
+            intervals[metricName] = {
+                "lower": float(lower),
+                "upper": float(upper)
+            }
+        return intervals
+
+    @staticmethod
+    def calculateReplicates(sortedPositive, sortedPredicted, replicates, seed):
+        """
+        Calculate the metrics for one block of bootstrap replicates, on the cohort sorted by descending prediction.
+        Defined as static method, so it can be executed in a worker process.
+        Return value: array of shape (replicates, 4) with AUC, Brier score, calibration intercept and calibration slope
+        """
+        observationCount = sortedPredicted.shape[0]
+        generator = np.random.default_rng(seed)
+        indices = generator.integers(0, observationCount, size=(replicates, observationCount))
+        indices += (np.arange(replicates) * observationCount)[:, np.newaxis]
+        counts = np.bincount(indices.ravel(), minlength=replicates * observationCount).reshape(replicates, observationCount).astype(np.float64)
+        del indices
+        positiveCounts = counts * sortedPositive
+
+        # AUC from the weighted true/false positive counts at every distinct threshold
+        thresholdIndices = np.r_[np.where(np.diff(sortedPredicted))[0], observationCount - 1]
+        tps = np.cumsum(positiveCounts, axis=1)[:, thresholdIndices]
+        fps = np.cumsum(counts - positiveCounts, axis=1)[:, thresholdIndices]
+        tps = np.hstack([np.zeros((replicates, 1)), tps])
+        fps = np.hstack([np.zeros((replicates, 1)), fps])
+        with np.errstate(invalid="ignore", divide="ignore"):
+            tpr = tps / tps[:, -1:]
+            fpr = fps / fps[:, -1:]
+        auc = (np.diff(fpr, axis=1) * (tpr[:, 1:] + tpr[:, :-1]) / 2.0).sum(axis=1)
+
+        observed = sortedPositive.astype(np.float64)
+        squaredErrors = (((1 - observed) - (1 - sortedPredicted)) ** 2 + (observed - sortedPredicted) ** 2) * 0.5
+        brier = counts @ squaredErrors / observationCount
+
+        intercept = np.full(replicates, np.nan)
+        slope = np.full(replicates, np.nan)
+        if sortedPredicted.min() >= 0 and sortedPredicted.max() <= 1:
+            logits = MetricsEngine.logit(sortedPredicted)
+            with np.errstate(over="ignore", invalid="ignore"):
+                # the estimates of the complete cohort are used as starting point
+                start = [estimate[0] for estimate in MetricsEngine.fitCalibrationLines(logits, observed[np.newaxis, :], np.ones((1, observationCount)))]
+                if not np.any(np.isnan(start)):
+                    intercept, a, slope = MetricsEngine.fitCalibrationLines(logits, positiveCounts, counts, start=start)
+
+        return np.column_stack([auc, brier, intercept, slope])
+
+class MetricsAccumulator:
+    """
+    Accumulates the validation metrics over chunks of a cohort (e.g. pages of a SPARQL result), using add() per chunk
+    and getMetrics() at the end.
+    mode "exact": the outcomes and predictions of all chunks are kept (as compact arrays), and the metrics are calculated
+        at the end using a single sort; the results are identical to MetricsEngine.calculateMetrics on the complete cohort.
+    mode "histogram": only counts per bin of the predicted probability are kept, so memory does not depend on the cohort size,
+        and no sort is needed. Curves are evaluated at the bin edges; AUC is exact up to ties introduced by the binning
+        (error at most 1/histogramBins for well-spread predictions). Brier score and calibration curve are calculated from
+        running sums, and equal the exact values up to floating point rounding.
+    """
+    def __init__(self, mode="exact", histogramBins=10000, calibrationBins=5):
+        if mode not in ("exact", "histogram"):
+            raise ValueError("Unknown metrics mode: " + str(mode))
+        if mode == "histogram" and histogramBins % calibrationBins != 0:
+            raise ValueError("histogramBins should be a multiple of calibrationBins")
+        self.__mode = mode
+        self.__histogramBins = histogramBins
+        self.__calibrationBins = calibrationBins
+        self.__binEdges = np.linspace(0.0, 1.0, histogramBins + 1)
+        self.__positiveChunks = []
+        self.__predictedChunks = []
+        self.__binPositives = np.zeros(histogramBins)
+        self.__binTotal = np.zeros(histogramBins, dtype=np.int64)
+        self.__binSums = np.zeros(histogramBins)
+        self.__squaredErrorSum = 0.0
+        self.__outOfRange = False
+        self.__count = 0
+
+    def add(self, observed, predicted):
+        """
+        Add a chunk of observed outcomes and predicted probabilities (without missing values).
+        """
+        positive, predicted = MetricsEngine.prepareInput(observed, predicted)
+        self.__count = self.__count + predicted.shape[0]
+        if self.__mode == "exact":
+            self.__positiveChunks.append(positive)
+            self.__predictedChunks.append(predicted)
+            return
+        if predicted.shape[0] == 0:
+            return
+
+        if predicted.min() < 0 or predicted.max() > 1:
+            self.__outOfRange = True
+        binIds = np.searchsorted(self.__binEdges[1:-1], np.clip(predicted, 0.0, 1.0))
+        self.__binPositives += np.bincount(binIds, weights=positive, minlength=self.__histogramBins)
+        self.__binTotal += np.bincount(binIds, minlength=self.__histogramBins)
+        self.__binSums += np.bincount(binIds, weights=predicted, minlength=self.__histogramBins)
+        self.__squaredErrorSum += MetricsEngine.calculateBrier(positive, predicted) * 2 * predicted.shape[0]
+
+    def getSample(self):
+        """
+        Return value: tuple (positive outcomes, predictions) of all chunks added so far (e.g. for bootstrapping),
+            or None in histogram mode
+        """
+        if self.__mode != "exact" or len(self.__predictedChunks) == 0:
+            return None
+        return (np.concatenate(self.__positiveChunks).astype(np.int8), np.concatenate(self.__predictedChunks))
+
+    def getMetrics(self):
+        """
+        Calculate the validation metrics over all chunks added so far.
+        """
+        if self.__mode == "exact":
+            sample = self.getSample()
+            if sample is None:
+                raise ValueError("No observations available to calculate validation metrics")
+            return MetricsEngine.calculateMetrics(sample[0], sample[1], calibrationBins=self.__calibrationBins)
+
+        if self.__count == 0:
+            raise ValueError("No observations available to calculate validation metrics")
+        # bins in order of descending prediction, skipping empty bins
+        occupied = np.where(self.__binTotal[::-1] > 0)[0]
+        tps = np.cumsum(self.__binPositives[::-1])[occupied]
+        fps = np.cumsum(self.__binTotal[::-1] - self.__binPositives[::-1])[occupied]
+
+        metrics = MetricsEngine.calculateCurves(tps, fps)
+        metrics["count"] = self.__count
+        metrics["brier"] = float(self.__squaredErrorSum / self.__count * 0.5)
+        metrics["calibration_curve"] = None
+        metrics["calibration_intercept"], metrics["calibration_slope"] = (np.nan, np.nan)
+        if self.__outOfRange:
+            print("Could not calculate calibration curve (predictions outside [0, 1])")
+        else:
+            # calibration line fitted on the binned predictions (binomial counts per bin, at the mean prediction of the bin)
+            occupiedBins = self.__binTotal > 0
+            with np.errstate(over="ignore", invalid="ignore"):
+                intercept, a, slope = MetricsEngine.fitCalibrationLines(
+                    MetricsEngine.logit(self.__binSums[occupiedBins] / self.__binTotal[occupiedBins]),
+                    self.__binPositives[occupiedBins][np.newaxis, :], self.__binTotal[occupiedBins][np.newaxis, :].astype(np.float64))
+            metrics["calibration_intercept"], metrics["calibration_slope"] = (float(intercept[0]), float(slope[0]))
+            # histogram bins are nested within the calibration bins, so these can be summed exactly
+            binsPerCalibrationBin = self.__histogramBins // self.__calibrationBins
+            metrics["calibration_curve"] = MetricsEngine.calibrationFromBins(
+                self.__binSums.reshape(self.__calibrationBins, binsPerCalibrationBin).sum(axis=1),
+                self.__binPositives.reshape(self.__calibrationBins, binsPerCalibrationBin).sum(axis=1),
+                self.__binTotal.reshape(self.__calibrationBins, binsPerCalibrationBin).sum(axis=1))
+        return metrics
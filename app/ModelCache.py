@@ -0,0 +1,106 @@
+import os
+import re
+import json
+import time
+import hashlib
+from JsonIndex import JsonIndex
+
+class ModelCache:
+    """
+    Persistent on-disk cache of compiled model specifications.
+    A compiled specification is a JSON-serializable dictionary (intercept, betas, feature names, term translations,
+    output parameter, docker parameters), which is sufficient to build a ModelExecutor without parsing the model graph.
+    Entries are keyed by model URI and a hash of the model content (or ETag), and evicted in least-recently-used order.
+    Updates of the index are serialized between threads and processes sharing the cache directory (see JsonIndex).
+    """
+    def __init__(self, cacheDirectory, maxEntries=64):
+        self.__cacheDirectory = cacheDirectory
+        self.__maxEntries = maxEntries
+        os.makedirs(cacheDirectory, exist_ok=True)
+        self.__index = JsonIndex(cacheDirectory)
+
+    @staticmethod
+    def hashContent(content):
+        """
+        Create the content hash for a model description, given as bytes or string.
+        """
+        if isinstance(content, str):
+            content = content.encode("utf8")
+        return hashlib.sha256(content).hexdigest()
+
+    @staticmethod
+    def hashNTriples(content):
+        """
+        Create the content hash for an N-Triples serialization (bytes), independent of the order of the triples and of the
+        blank node labels, which SPARQL endpoints do not keep stable between requests. Blank node labels are all replaced
+        by the same label, so (unlikely) changes which only move triples between blank nodes are not detected.
+        """
+        lines = re.sub(rb'_:[A-Za-z0-9_\-.]*[A-Za-z0-9_\-]', b'_:', content).splitlines()
+        return ModelCache.hashContent(b"\n".join(sorted(line.strip() for line in lines if line.strip() != b"")))
+
+    def getSpecification(self, modelUri, contentHash):
+        """
+        Fetch the compiled specification for the given model URI and content hash.
+        Return value: dictionary with the compiled specification, or None when not cached
+        """
+        entryKey = self.__getEntryKey(modelUri, contentHash)
+        with self.__index.lock():
+            index = self.__index.read()
+            if entryKey not in index:
+                return None
+            try:
+                with open(self.__getEntryPath(entryKey)) as f:
+                    specification = json.load(f)
+            except (OSError, ValueError):
+                del index[entryKey]
+                self.__index.write(index)
+                return None
+            index[entryKey]["lastAccess"] = time.time()
+            self.__index.write(index)
+        return specification
+
+    def storeSpecification(self, modelUri, contentHash, specification):
+        """
+        Store a compiled specification. Older entries for the same model URI (with a different content hash) are removed,
+        and the least-recently-used entries are evicted when the cache exceeds its maximum number of entries.
+        """
+        entryKey = self.__getEntryKey(modelUri, contentHash)
+        with self.__index.lock():
+            index = self.__index.read()
+            for staleKey in [key for key, entry in index.items() if entry["modelUri"] == modelUri and key != entryKey]:
+                self.__removeEntry(index, staleKey)
+
+            JsonIndex.writeJson(self.__getEntryPath(entryKey), specification)
+            index[entryKey] = {
+                "modelUri": modelUri,
+                "contentHash": contentHash,
+                "lastAccess": time.time()
+            }
+
+            while len(index) > self.__maxEntries:
+                leastRecentKey = min(index, key=lambda key: index[key]["lastAccess"])
+                self.__removeEntry(index, leastRecentKey)
+            self.__index.write(index)
+
+    def invalidate(self, modelUri=None):
+        """
+        Remove all cached specifications for the given model URI. When no model URI is given, the complete cache is cleared.
+        """
+        with self.__index.lock():
+            index = self.__index.read()
+            for entryKey in [key for key, entry in index.items() if modelUri is None or entry["modelUri"] == modelUri]:
+                self.__removeEntry(index, entryKey)
+            self.__index.write(index)
+
+    def __getEntryKey(self, modelUri, contentHash):
+        return hashlib.sha256((modelUri + "\n" + contentHash).encode("utf8")).hexdigest()
+
+    def __getEntryPath(self, entryKey):
+        return os.path.join(self.__cacheDirectory, entryKey + ".json")
+
+    def __removeEntry(self, index, entryKey):
+        del index[entryKey]
+        try:
+            os.remove(self.__getEntryPath(entryKey))
+        except FileNotFoundError:
+            pass
@@ -1,12 +1,48 @@
 import json, logging
 import os
+import io
+import re
+import csv
+import numpy as np
 import pandas as pd
-from SPARQLWrapper import SPARQLWrapper, JSON
+from EndpointClient import SparqlEndpointClient
+from Instrumentation import Instrumentation
+try:
+    import pyarrow
+    import pyarrow.csv
+except ImportError:
+    pyarrow = None
 
 class QueryEngine:
-    def __init__(self, serviceLocation):
+    prologuePattern = re.compile(r'^\s*(PREFIX\s+[^\s:]*:\s*<[^>]*>|BASE\s*<[^>]*>)', re.IGNORECASE)
+    # string literals and IRIs are kept as-is by normalize_query, comments are removed, and other whitespace is collapsed
+    queryTokenPattern = re.compile(r'("""(?:[^"\\]|\\.|"(?!""))*"""|\'\'\'(?:[^\'\\]|\\.|\'(?!\'\'))*\'\'\'|"(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\'|<[^<>\s]*>)|(?:\s|#[^\n]*)+')
+
+    def __init__(self, serviceLocation, result_format="json", cohort_cache=None, client=None):
+        """
+        result_format: "json" (default) or "tsv" (text/tab-separated-values, a smaller response for large result sets)
+        cohort_cache: CohortCache to store the decoded results of get_sparql_dataframe, so repeated queries are loaded from disk
+        client: endpoint client to perform the queries, defaults to a SparqlEndpointClient for serviceLocation
+        """
         self.__serviceLocation = serviceLocation
-    
+        self.__cohort_cache = cohort_cache
+        self.__client = client
+        if client is None:
+            self.__client = SparqlEndpointClient(serviceLocation)
+        self.__result_format = result_format
+        self.__decoder = SparqlResultDecoder()
+
+    @staticmethod
+    def normalize_query(query):
+        """
+        Normalize the text of a SPARQL query, so that queries which only differ in whitespace and comments are equal.
+        """
+        def normalize_token(match):
+            if match.group(1) is not None:
+                return match.group(1)
+            return " "
+        return QueryEngine.queryTokenPattern.sub(normalize_token, query).strip()
+
     def query_from_file(self, fileName):
         with open(fileName, 'r') as file:
             query = file.read().replace('\n', ' ')
@@ -15,39 +51,298 @@ class QueryEngine:
     def get_sparql_dataframe(self, query):
         """
         Helper function to convert SPARQL results into a Pandas data frame.
+        When a cohort cache is configured, the cached result is returned if available.
+        """
+        if self.__cohort_cache is None:
+            return self.__query_dataframe(query)
+
+        normalized_query = self.normalize_query(query)
+        with Instrumentation.stage("cohort cache"):
+            dataframe = self.__cohort_cache.getDataFrame(self.__serviceLocation, normalized_query)
+            if dataframe is not None:
+                Instrumentation.addRows(dataframe.shape[0])
+                return dataframe
+
+        dataframe = self.__query_dataframe(query)
+        try:
+            self.__cohort_cache.storeDataFrame(self.__serviceLocation, normalized_query, dataframe)
+        except Exception as error:
+            print("Could not store cohort in cache: " + str(error))
+        return dataframe
+
+    def iter_sparql_dataframe(self, query, page_size=10000, order_by=None):
+        """
+        Generator to page through the results of a SPARQL SELECT query, yielding one Pandas data frame per page.
+        The original query is wrapped as sub-select (on a new line, as the query may end with a comment), and paged using LIMIT/OFFSET. As SPARQL endpoints only guarantee
+        a stable result order when sorted, the variable(s) given in order_by (e.g. the patient identifier) are used as ordering key.
+        When order_by is None, all projected variables are used.
+        All pages are decoded with the same column types and (growing) categories, see SparqlResultDecoder(stable_schema=True).
         """
-        sparql = SPARQLWrapper(self.__serviceLocation)
-        sparql.setQuery(query)
-        sparql.setReturnFormat(JSON)
-        result = sparql.query()
+        decoder = SparqlResultDecoder(stable_schema=True)
+        prologue, body = self.__split_prologue(query)
+        if order_by is None:
+            # fetch an empty page to determine the projected variables
+            order_by = list(self.__query_dataframe("%s SELECT * WHERE { %s\n} LIMIT 0" % (prologue, body), decoder).columns)
+        elif isinstance(order_by, str):
+            order_by = [order_by]
+        order_clause = "ORDER BY " + " ".join("?" + var for var in order_by)
+
+        offset = 0
+        while True:
+            paged_query = "%s SELECT * WHERE { %s\n} %s LIMIT %d OFFSET %d" % (prologue, body, order_clause, page_size, offset)
+            page = self.__query_dataframe(paged_query, decoder)
+            page.index = pd.RangeIndex(offset, offset + page.shape[0])
+            if page.shape[0] > 0:
+                yield page
+            if page.shape[0] < page_size:
+                break
+            offset = offset + page_size
+
+    def __split_prologue(self, query):
+        """
+        Split the PREFIX/BASE declarations from the query body, as these cannot be part of a sub-select.
+        """
+        prologue = []
+        match = self.prologuePattern.match(query)
+        while match is not None:
+            prologue.append(match.group(1))
+            query = query[match.end():]
+            match = self.prologuePattern.match(query)
+        return (" ".join(prologue), query)
+
+    def __query_dataframe(self, query, decoder=None):
+        """
+        Perform the query, and decode the results in the configured result format into a Pandas data frame.
+        """
+        if decoder is None:
+            decoder = self.__decoder
+        accept = "application/sparql-results+json"
+        if self.__result_format == "tsv":
+            accept = "text/tab-separated-values"
+        with Instrumentation.stage("sparql request"):
+            response = self.__client.query(query, accept=accept)
+            Instrumentation.addBytes(len(response.content))
+
+        with Instrumentation.stage("sparql decoding"):
+            if self.__result_format == "tsv":
+                dataFrame = decoder.decode_tsv(response.content.decode("utf8"))
+            else:
+                dataFrame = decoder.decode_json(json.loads(response.content))
+            Instrumentation.addRows(dataFrame.shape[0])
+        return dataFrame
+
+XSD = "http://www.w3.org/2001/XMLSchema#"
+
+class SparqlResultDecoder:
+    """
+    Decoder for SPARQL SELECT results (JSON or TSV) into a Pandas data frame.
+    Every column is converted in a single pass into one typed array, based on the datatype of the first bound value
+    in that column (instead of the first row, which may be unbound). Values which cannot be parsed become missing values.
+    With stable_schema, the decoder keeps the column types over subsequent results (e.g. the pages of a paged query), so all
+    results have the same dtypes: the type of a column is fixed by its first bound value in any result, integer columns are
+    decoded as float64 (as a later result may have unbound values), and categorical columns use the union of the categories
+    seen so far (new categories are appended, so the codes of earlier results remain valid).
+    """
+    integerTypes = set(XSD + name for name in ["int", "integer", "long", "short", "byte",
+        "nonNegativeInteger", "positiveInteger", "nonPositiveInteger", "negativeInteger",
+        "unsignedInt", "unsignedLong", "unsignedShort", "unsignedByte"])
+    floatTypes = set(XSD + name for name in ["double", "float", "decimal"])
+    booleanTypes = set([XSD + "boolean"])
+    dateTimeTypes = set(XSD + name for name in ["dateTime", "date"])
+    categoryTypes = set([XSD + "string"])
+
+    tsvIntegerPattern = re.compile(r'^[+-]?[0-9]+$')
+    tsvDecimalPattern = re.compile(r'^[+-]?[0-9]*\.[0-9]+$')
+    tsvDoublePattern = re.compile(r'^[+-]?([0-9]+\.?[0-9]*|\.[0-9]+)[eE][+-]?[0-9]+$')
+    tsvLiteralPattern = r'^"(.*)"(?:\^\^<[^>]*>|@[-A-Za-z0-9]+)?$'
+    tsvEscapes = {"t": "\t", "n": "\n", "r": "\r", "b": "\b", "f": "\f", '"': '"', "'": "'", "\\": "\\"}
 
-        processed_results = json.load(result.response)
+    def __init__(self, stable_schema=False):
+        self.__stable_schema = stable_schema
+        self.__kinds = {}
+        self.__categories = {}
+
+    def decode_json(self, processed_results):
+        """
+        Decode a parsed SPARQL JSON result (application/sparql-results+json) into a Pandas data frame.
+        """
         cols = processed_results['head']['vars']
+        bindings = processed_results['results']['bindings']
+
+        columns = {}
+        for c in cols:
+            terms = [row.get(c) for row in bindings]
+            kind = self.__kinds.get(c)
+            if kind is None:
+                for term in terms:
+                    if term is not None:
+                        kind = self.__store_kind(c, self.__get_kind(term.get("type"), term.get("datatype")))
+                        break
+            values = [None if term is None else term["value"] for term in terms]
+            columns[c] = self.__to_array(c, kind, values)
+
+        return pd.DataFrame(columns, columns=cols)
+
+    def decode_tsv(self, text):
+        """
+        Decode a SPARQL TSV result (text/tab-separated-values) into a Pandas data frame.
+        The rows are split by the pyarrow CSV parser (or the Pandas CSV parser when pyarrow is not available), and the RDF
+        term syntax (IRI brackets, quotes, datatypes and language tags) is removed per column using vectorized string operations.
+        """
+        header, separator, body = text.partition("\n")
+        cols = [var.lstrip("?$") for var in header.rstrip("\r").split("\t")]
+        terms = self.__read_tsv_terms(body, len(cols))
+
+        columns = {}
+        for columnIndex, c in enumerate(cols):
+            column = terms[columnIndex]
+            kind = self.__kinds.get(c)
+            if kind is None:
+                boundTerms = column[column != ""]
+                if boundTerms.shape[0] > 0:
+                    kind = self.__store_kind(c, self.__get_tsv_kind(boundTerms.iloc[0]))
+            values = self.__get_tsv_values(column)
+            if kind == "integer" or kind == "float":
+                numbers = pd.to_numeric(values, errors="coerce")
+                if kind == "integer" and numbers.dtype.kind in "iu":
+                    columns[c] = numbers.to_numpy(dtype=np.int64)
+                else:
+                    columns[c] = numbers.to_numpy(dtype=float)
+            elif kind == "category":
+                columns[c] = self.__to_array(c, kind, values)
+            else:
+                columns[c] = self.__to_array(c, kind, values.to_numpy(dtype=object, na_value=None))
+
+        return pd.DataFrame(columns, columns=cols)
+
+    def __read_tsv_terms(self, body, columnCount):
+        """
+        Split the rows of a TSV result into a list of string Series (one per column) of RDF terms, with "" for unbound values.
+        """
+        if body.strip("\r\n") == "":
+            return [pd.Series([], dtype=object) for columnIndex in range(columnCount)]
+        columnNames = [str(columnIndex) for columnIndex in range(columnCount)]
+        if pyarrow is not None:
+            try:
+                # quotes are part of the RDF terms, hence not interpreted by the parser
+                table = pyarrow.csv.read_csv(pyarrow.py_buffer(body.encode("utf8")),
+                    read_options=pyarrow.csv.ReadOptions(column_names=columnNames),
+                    parse_options=pyarrow.csv.ParseOptions(delimiter="\t", quote_char=False, escape_char=False),
+                    convert_options=pyarrow.csv.ConvertOptions(column_types={name: pyarrow.string() for name in columnNames},
+                        strings_can_be_null=False, quoted_strings_can_be_null=False))
+                return [table.column(columnIndex).to_pandas() for columnIndex in range(columnCount)]
+            except pyarrow.ArrowInvalid:
+                # e.g. rows with a missing trailing field, which the Pandas parser accepts
+                pass
+        terms = pd.read_csv(io.StringIO(body), sep="\t", header=None, names=columnNames, quoting=csv.QUOTE_NONE,
+            dtype=str, na_filter=False, engine="c").fillna("")
+        return [terms[name] for name in columnNames]
+
+    def __store_kind(self, column, kind):
+        """
+        Keep the kind of a column for subsequent results (with stable_schema).
+        Return value: the kind used to decode the column
+        """
+        if self.__stable_schema:
+            if kind == "integer":
+                kind = "float"
+            elif kind is None:
+                kind = "object"
+            self.__kinds[column] = kind
+        return kind
+
+    def __get_kind(self, termType, dataType):
+        if termType == "uri":
+            return "category"
+        if termType == "literal" or termType == "typed-literal":
+            if dataType in self.integerTypes:
+                return "integer"
+            if dataType in self.floatTypes:
+                return "float"
+            if dataType in self.booleanTypes:
+                return "boolean"
+            if dataType in self.dateTimeTypes:
+                return "datetime"
+            if dataType in self.categoryTypes:
+                return "category"
+        return None
+
+    def __get_tsv_kind(self, term):
+        if term.startswith("<"):
+            return self.__get_kind("uri", None)
+        if term.startswith('"'):
+            if '"^^<' in term:
+                return self.__get_kind("literal", term[term.rindex("^^<") + 3:-1])
+            return None
+        if term.startswith("_:"):
+            return None
+        if self.tsvIntegerPattern.match(term):
+            return "integer"
+        if self.tsvDecimalPattern.match(term) or self.tsvDoublePattern.match(term):
+            return "float"
+        if term == "true" or term == "false":
+            return "boolean"
+        return None
+
+    def __get_tsv_values(self, column):
+        """
+        Convert a column of TSV encoded RDF terms into their lexical values (missing when unbound).
+        The literals of a column usually share one datatype (or language tag); literals ending with the datatype of the first
+        literal are sliced, and only the remaining literals are matched with a regular expression.
+        """
+        values = column.where(column != "")
+        isIri = column.str.startswith("<")
+        if isIri.any():
+            values = values.mask(isIri, column.str.slice(1, -1))
+        isLiteral = column.str.startswith('"')
+        if isLiteral.any():
+            firstLiteral = column[isLiteral].iloc[0]
+            suffix = firstLiteral[firstLiteral.rindex('"'):]
+            hasSuffix = isLiteral & column.str.endswith(suffix)
+            values = values.mask(hasSuffix, column.str.slice(1, -len(suffix)))
+            otherLiterals = isLiteral & ~hasSuffix
+            if otherLiterals.any():
+                values[otherLiterals] = column[otherLiterals].str.replace(self.tsvLiteralPattern, r"\1", regex=True)
+            isEscaped = isLiteral & column.str.contains("\\", regex=False)
+            if isEscaped.any():
+                values[isEscaped] = values[isEscaped].str.replace(r'\\(.)',
+                    lambda match: self.tsvEscapes.get(match.group(1), match.group(0)), regex=True)
+        return values
+
+    def __to_array(self, column, kind, values):
+        if kind == "integer":
+            if None not in values:
+                try:
+                    return np.fromiter(map(int, values), dtype=np.int64, count=len(values))
+                except (ValueError, OverflowError):
+                    pass
+            return np.fromiter(map(self.__to_float, values), dtype=float, count=len(values))
+        if kind == "float":
+            return np.fromiter(map(self.__to_float, values), dtype=float, count=len(values))
+        if kind == "boolean":
+            mask = np.fromiter((value is None for value in values), dtype=bool, count=len(values))
+            booleans = np.fromiter((value == "true" or value == "1" for value in values), dtype=bool, count=len(values))
+            return pd.arrays.BooleanArray(booleans, mask)
+        if kind == "datetime":
+            return pd.to_datetime(pd.Series(values, dtype=object), errors='coerce', format='ISO8601', utc=True)
+        if kind == "category":
+            categorical = pd.Categorical(values)
+            if not self.__stable_schema:
+                return categorical
+            categories = self.__categories.get(column)
+            if categories is None:
+                categories = categorical.categories
+            else:
+                categories = categories.append(categorical.categories.difference(categories, sort=False))
+            self.__categories[column] = categories
+            return categorical.set_categories(categories)
+        return np.array(values, dtype=object)
 
-        out = []
-        for row in processed_results['results']['bindings']:
-            item = []
-            for c in cols:
-                item.append(row.get(c, {}).get('value'))
-            out.append(item)
-
-        df = pd.DataFrame(out, columns=cols)
-
-        if len(processed_results['results']['bindings']) > 0:
-            firstRow = processed_results['results']['bindings'][0]
-            for c in cols:
-                varType = firstRow.get(c,{}).get("type")
-                if varType == "uri":
-                    df[c] = df[c].astype("category")
-                if varType == "literal" or varType == "typed-literal":
-                    dataType = firstRow.get(c,{}).get("datatype")
-                    if dataType=="http://www.w3.org/2001/XMLSchema#int":
-                        df[c] = pd.to_numeric(df[c], errors='coerce')
-                    if dataType=="http://www.w3.org/2001/XMLSchema#integer":
-                        df[c] = pd.to_numeric(df[c], errors='coerce')
-                    if dataType=="http://www.w3.org/2001/XMLSchema#double":
-                        df[c] = pd.to_numeric(df[c], errors='coerce')
-                    if dataType=="http://www.w3.org/2001/XMLSchema#string":
-                        df[c] = df[c].astype("category")
-        
-        return df
\ No newline at end of file
+    @staticmethod
+    def __to_float(value):
+        if value is None:
+            return np.nan
+        try:
+            return float(value)
+        except ValueError:
+            return np.nan
@@ -0,0 +1,77 @@
+import rdflib
+
+XSD = "http://www.w3.org/2001/XMLSchema#"
+
+class TermTranslationIndex:
+    """
+    Translation tables of all input parameters of a model: parameter (input feature) URI -> term URI -> local value.
+    The index is built once per model from the results of the valueForTermList query, and can be serialized using toDict()
+    (e.g. as part of a compiled model specification in the ModelCache) and restored using the constructor.
+    """
+    integerTypes = set(XSD + name for name in ["integer", "int", "long", "short", "byte",
+        "nonNegativeInteger", "positiveInteger", "nonPositiveInteger", "negativeInteger",
+        "unsignedLong", "unsignedInt", "unsignedShort", "unsignedByte"])
+    floatTypes = set(XSD + name for name in ["double", "float", "decimal"])
+
+    def __init__(self, translations=None):
+        """
+        translations: dictionary of parameter URI to a dictionary of term URI to local value (as returned by toDict())
+        """
+        self.__translations = {}
+        self.__localValues = {}
+        if translations is not None:
+            for parameterId, translation in translations.items():
+                self.__translations[parameterId] = dict(translation)
+
+    @classmethod
+    def fromQueryResults(cls, queryResults):
+        """
+        Build the index from the rows of the valueForTermList query (variables inputFeature, term and value).
+        """
+        translations = {}
+        for row in queryResults:
+            parameterId = str(row["inputFeature"])
+            if parameterId not in translations:
+                translations[parameterId] = {}
+            translations[parameterId][str(row["term"])] = cls.convertLiteral(row["value"])
+        return cls(translations)
+
+    @classmethod
+    def convertLiteral(cls, literal):
+        """
+        Convert an RDF literal into the local value sent to the model: int for the XSD integer types, float for
+        xsd:decimal, xsd:float and xsd:double, and the lexical value (string) for all other literals.
+        Numeric literals with an invalid lexical value are kept as string.
+        """
+        dataType = str(literal.datatype) if isinstance(literal, rdflib.Literal) else None
+        try:
+            if dataType in cls.integerTypes:
+                return int(str(literal))
+            if dataType in cls.floatTypes:
+                return float(str(literal))
+        except ValueError:
+            pass
+        return str(literal)
+
+    def getTranslation(self, parameterId):
+        """
+        Return value: dictionary of term URI to local value for the given parameter, or None when the parameter has no translations
+        """
+        return self.__translations.get(parameterId)
+
+    def getLocalValues(self, parameterId):
+        """
+        Return value: set of the local values of the given parameter (empty when the parameter has no translations)
+        """
+        if parameterId not in self.__localValues:
+            self.__localValues[parameterId] = set(self.__translations.get(parameterId, {}).values())
+        return self.__localValues[parameterId]
+
+    def getParameterIds(self):
+        return list(self.__translations.keys())
+
+    def toDict(self):
+        """
+        Return value: JSON-serializable dictionary of parameter URI to term URI to local value
+        """
+        return {parameterId: dict(translation) for parameterId, translation in self.__translations.items()}
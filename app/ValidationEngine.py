@@ -1,101 +1,470 @@
 import base64
-from SPARQLWrapper import SPARQLWrapper, JSON, POST
+from EndpointClient import SparqlEndpointClient
 from QueryEngine import QueryEngine
-from rdflib import RDFS
+from rdflib import RDF, RDFS
 import rdflib
 import urllib
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import uuid
 import socket
+import time
+import threading
+import contextlib
+import collections
+import concurrent.futures
 import pandas as pd
 import numpy as np
 from ModelEngine import ModelEngine
-import sklearn.metrics
-import sklearn.calibration
+from MetricsEngine import MetricsEngine, MetricsBootstrap, MetricsAccumulator
+from BaselineEngine import BaselineEngine
+from Instrumentation import Instrumentation
 
 fml = rdflib.Namespace("https://fairmodels.org/ontology.owl#")
+prov = rdflib.Namespace("http://www.w3.org/ns/prov#")
 
 class ValidationEngine:
-    def __init__(self, validationEndpointUrl, dataQueryEngine, modelCacheEndpoint=None):
-        self.__validationEndpoint = ValidationEndpoint(validationEndpointUrl)
+    maxModelEngines = 16
+
+    def __init__(self, validationEndpointUrl, dataQueryEngine, modelCacheEndpoint=None, modelCache=None, maxWorkers=1, metricsProcesses=0, endpointConcurrency=None,
+            workerId=None, leaseSeconds=900, modelEngineTtl=0, publishMode="update", validationEndpointClient=None, curvePointBudget=None,
+            bootstrapReplicates=0, bootstrapSeed=None, confidenceLevel=0.95, dataPageSize=None, metricsMode="exact", storeProvenance=False):
+        """
+        maxWorkers: number of validation requests processed concurrently (threads)
+        metricsProcesses: number of worker processes to calculate validation metrics; 0 calculates metrics in the request thread
+        endpointConcurrency: dictionary with the maximum number of concurrent calls per endpoint ("validation", "data" and "model"),
+            defaults to maxWorkers for every endpoint
+        workerId: when given, every request is claimed (with a lease of leaseSeconds) before processing, and skipped when
+            another worker holds the claim
+        modelEngineTtl: number of seconds a loaded ModelEngine is kept in memory and reused; 0 disables reuse
+        publishMode: "update" stores the results using SPARQL UPDATE requests, "transaction" stores the results and marks
+            the request as done in one RDF4J transaction
+        validationEndpointClient: client for the validation endpoint (e.g. a LocalEndpointClient for testing)
+        curvePointBudget: maximum number of points stored per curve; None stores all points
+        bootstrapReplicates: number of bootstrap replicates for the confidence intervals of AUC, Brier score and calibration
+            intercept/slope (spread over the metrics processes); 0 disables the confidence intervals
+        bootstrapSeed: seed for the bootstrap resampling, making the confidence intervals reproducible
+        confidenceLevel: level of the bootstrap confidence intervals
+        dataPageSize: when given, the cohort is fetched in pages of this number of rows, and baseline characteristics, scoring
+            and metrics are calculated per page; None fetches the cohort at once
+        metricsMode: "exact" or "histogram" (bounded memory) accumulation of the metrics over pages, see MetricsAccumulator
+        storeProvenance: store the per-stage durations, row counts, transferred bytes and peak RSS of the request (see Instrumentation)
+            as provenance in the result graph
+        """
+        self.__validationEndpoint = ValidationEndpoint(validationEndpointUrl, client=validationEndpointClient)
+        self.__publishMode = publishMode
+        self.__curvePointBudget = curvePointBudget
+        self.__bootstrapReplicates = bootstrapReplicates
+        self.__bootstrapSeed = bootstrapSeed
+        self.__confidenceLevel = confidenceLevel
+        self.__dataPageSize = dataPageSize
+        self.__metricsMode = metricsMode
+        self.__storeProvenance = storeProvenance
         self.__dataQueryEngine = dataQueryEngine
         self.__modelCacheEndpoint = modelCacheEndpoint
+        self.__modelCache = modelCache
+        self.__maxWorkers = maxWorkers
+        self.__metricsProcesses = metricsProcesses
+        self.__metricsPool = None
+        self.__workerId = workerId
+        self.__leaseSeconds = leaseSeconds
+        self.__modelEngineTtl = modelEngineTtl
+        self.__modelEngines = collections.OrderedDict()
+        self.__modelEnginesLock = threading.Lock()
+
+        if endpointConcurrency is None:
+            endpointConcurrency = {}
+        self.__endpointLimits = {}
+        for endpointName in ["validation", "data", "model"]:
+            self.__endpointLimits[endpointName] = threading.BoundedSemaphore(endpointConcurrency.get(endpointName, maxWorkers))
     
     def processValidationRequests(self):
+        """
+        Fetch all open validation requests, and process them using the configured number of workers.
+        A failure in one request does not affect the other requests. When the cohort is fetched at once (no dataPageSize),
+        requests with the same (normalized) data query share one cohort: it is fetched once, and all models are scored on
+        the same data frame.
+        Return value: dictionary with the run summary (succeeded/failed requests, throughput and per-stage latency)
+        """
         print("Start processing")
-        validationRequests = self.__validationEndpoint.getOpenValidationRequests()
+        statistics = ValidationRunStatistics()
+        with self.__endpointLimits["validation"]:
+            validationRequests = self.__validationEndpoint.getOpenValidationRequests()
+
+        if self.__metricsProcesses > 0:
+            self.__metricsPool = concurrent.futures.ProcessPoolExecutor(max_workers=self.__metricsProcesses)
+        try:
+            sharedCohorts = self.__getSharedCohorts(validationRequests)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.__maxWorkers) as requestPool:
+                for validationRequestRow in validationRequests:
+                    requestPool.submit(self.__processValidationRequest, validationRequestRow, statistics,
+                        sharedCohorts.get(validationRequestRow["id"]["value"]))
+        finally:
+            if self.__metricsPool is not None:
+                self.__metricsPool.shutdown()
+                self.__metricsPool = None
+
+        report = statistics.getReport()
+        print("Processed %d request(s) in %.1f seconds (%d failed, %d skipped)" % (report["requests"], report["duration"], len(report["failed"]), len(report["skipped"])))
+        for stageName, stageStatistics in report["stages"].items():
+            print("  %s: mean %.3fs, max %.3fs (n=%d)" % (stageName, stageStatistics["mean"], stageStatistics["max"], stageStatistics["count"]))
+        try:
+            Instrumentation.writePrometheusFile()
+        except OSError as error:
+            print("Could not write Prometheus metrics: " + str(error))
+        return report
+
+    def __getSharedCohorts(self, validationRequests):
+        """
+        Group the open requests by their normalized data query.
+        Return value: dictionary of request ID to SharedCohort, for the requests sharing their query with other requests
+        """
+        if self.__dataPageSize is not None:
+            return {}
+        requestGroups = collections.OrderedDict()
         for validationRequestRow in validationRequests:
-            print("Process request: " + validationRequestRow["id"]["value"])
-            validationRequest = self.__validationEndpoint.getRequestSpecs(validationRequestRow["id"]["value"])
-            validationTriples = ValidationTriples(validationRequest)
+            if "query" in validationRequestRow:
+                normalizedQuery = QueryEngine.normalize_query(validationRequestRow["query"]["value"])
+                requestGroups.setdefault(normalizedQuery, []).append(validationRequestRow["id"]["value"])
+
+        sharedCohorts = {}
+        for normalizedQuery, requestIds in requestGroups.items():
+            if len(requestIds) < 2:
+                continue
+            sharedCohort = SharedCohort(normalizedQuery, len(requestIds))
+            for requestId in requestIds:
+                sharedCohorts[requestId] = sharedCohort
+        if len(sharedCohorts) > 0:
+            print("%d request(s) share %d data queries" % (len(sharedCohorts), len(set(sharedCohorts.values()))))
+        return sharedCohorts
+
+    def __processValidationRequest(self, validationRequestRow, statistics, sharedCohort=None):
+        requestId = validationRequestRow["id"]["value"]
+        try:
+            with Instrumentation.request(requestId) as requestMetrics:
+                requestMetrics.status = self.__processInstrumentedRequest(validationRequestRow, statistics, requestMetrics, sharedCohort)
+        finally:
+            if sharedCohort is not None:
+                sharedCohort.release()
+
+    def __processInstrumentedRequest(self, validationRequestRow, statistics, requestMetrics, sharedCohort):
+        """
+        Process one validation request. When a SharedCohort is given (and the query of the request still matches),
+        the cohort is taken from it instead of being fetched for this request only.
+        Return value: status of the request ("succeeded", "failed" or "skipped")
+        """
+        requestId = validationRequestRow["id"]["value"]
+        leaseRenewal = None
+        try:
+            if self.__workerId is not None:
+                with statistics.measure("claim"), self.__endpointLimits["validation"]:
+                    claimed = self.__validationEndpoint.claimRequest(requestId, self.__workerId, self.__leaseSeconds)
+                if not claimed:
+                    print("Request %s is claimed by another worker" % requestId)
+                    statistics.recordSkipped(requestId)
+                    return "skipped"
+                leaseRenewal = self.__startLeaseRenewal(requestId)
+
+            print("Process request: " + requestId)
+            with statistics.measure("request specs"), self.__endpointLimits["validation"]:
+                validationRequest = self.__validationEndpoint.getRequestSpecs(requestId)
+            validationTriples = ValidationTriples(validationRequest, curvePointBudget=self.__curvePointBudget)
             if "query" in validationRequest:
-                targetDataFrame = self.__dataQueryEngine.get_sparql_dataframe(validationRequest["query"]["value"])
+                if self.__dataPageSize is None:
+                    query = validationRequest["query"]["value"]
+                    if sharedCohort is not None and sharedCohort.matches(query):
+                        targetDataFrame, baselineCharacteristics = sharedCohort.get(lambda: self.__fetchCohort(query, statistics))
+                    else:
+                        targetDataFrame, baselineCharacteristics = self.__fetchCohort(query, statistics)
+
+                    validationMetrics = self.processModelValidation(targetDataFrame, validationRequestRow["model"]["value"], statistics=statistics)
+                else:
+                    baselineCharacteristics, validationMetrics = self.processPagedValidation(validationRequest["query"]["value"],
+                        validationRequestRow["model"]["value"], statistics=statistics)
+
+                with statistics.measure("store baseline characteristics"):
+                    validationTriples.storeBaselineCharacteristics(baselineCharacteristics)
+                with statistics.measure("store metrics"):
+                    validationTriples.storeValidationMetrics(validationMetrics)
+                if self.__storeProvenance:
+                    validationTriples.storeProvenance(requestMetrics)
+
+                with statistics.measure("post results"), self.__endpointLimits["validation"]:
+                    if self.__publishMode == "transaction":
+                        validationTriples.publishTriples(self.__validationEndpoint)
+                    else:
+                        validationTriples.postTriples(self.__validationEndpoint)
+                        self.__validationEndpoint.markRequestAsDone(requestId)
+            statistics.recordSuccess(requestId)
+            return "succeeded"
+        except Exception as error:
+            print("Could not process request %s: %s" % (requestId, str(error)))
+            statistics.recordFailure(requestId, error)
+            return "failed"
+        finally:
+            if leaseRenewal is not None:
+                leaseRenewal.set()
+
+    def __fetchCohort(self, query, statistics):
+        """
+        Fetch the cohort for the given data query, and calculate its baseline characteristics.
+        Return value: tuple (data frame, baseline characteristics)
+        """
+        with statistics.measure("data query"), self.__endpointLimits["data"]:
+            targetDataFrame = self.__dataQueryEngine.get_sparql_dataframe(query)
 
-                baselineCharacteristics = self.processBaselineCharacteristics(targetDataFrame)
-                validationTriples.storeBaselineCharacteristics(baselineCharacteristics)
+        with statistics.measure("baseline characteristics"):
+            baselineCharacteristics = self.processBaselineCharacteristics(targetDataFrame)
+        return (targetDataFrame, baselineCharacteristics)
 
-                validationMetrics = self.processModelValidation(targetDataFrame, validationRequestRow["model"]["value"])
-                validationTriples.storeValidationMetrics(validationMetrics)
+    def __startLeaseRenewal(self, requestId):
+        """
+        Renew the lease of a claimed request periodically, until the returned event is set, or until the request turns out
+        to be claimed by another worker.
+        A failed request is not released explicitly: its lease expires and it is recovered by recoverExpiredLeases().
+        """
+        stopEvent = threading.Event()
+        def renewLease():
+            while not stopEvent.wait(self.__leaseSeconds / 3):
+                try:
+                    with self.__endpointLimits["validation"]:
+                        claimed = self.__validationEndpoint.renewLease(requestId, self.__workerId, self.__leaseSeconds)
+                    if not claimed:
+                        print("Lease for request %s is lost to another worker, stop renewing" % requestId)
+                        return
+                except Exception as error:
+                    print("Could not renew lease for request %s: %s" % (requestId, str(error)))
+        threading.Thread(target=renewLease, daemon=True).start()
+        return stopEvent
+
+    def recoverExpiredLeases(self):
+        with self.__endpointLimits["validation"]:
+            self.__validationEndpoint.recoverExpiredLeases()
+
+    def __getModelEngine(self, modelUri):
+        """
+        Create the ModelEngine for the given model, or reuse a loaded instance when modelEngineTtl is set.
+        """
+        if self.__modelEngineTtl > 0:
+            with self.__modelEnginesLock:
+                if modelUri in self.__modelEngines:
+                    modelEngine, loadTime = self.__modelEngines[modelUri]
+                    if time.time() - loadTime < self.__modelEngineTtl:
+                        self.__modelEngines.move_to_end(modelUri)
+                        return modelEngine
+                    del self.__modelEngines[modelUri]
 
-                validationTriples.postTriples(self.__validationEndpoint)
+        if self.__modelCacheEndpoint is not None:
+            with self.__endpointLimits["model"]:
+                modelEngine = ModelEngine(modelUri, sparqlEndpoint=self.__modelCacheEndpoint, modelCache=self.__modelCache)
+        else:
+            modelEngine = ModelEngine(modelUri, modelCache=self.__modelCache)
 
-                self.__validationEndpoint.markRequestAsDone(validationRequestRow["id"]["value"])
+        if self.__modelEngineTtl > 0:
+            with self.__modelEnginesLock:
+                self.__modelEngines[modelUri] = (modelEngine, time.time())
+                while len(self.__modelEngines) > self.maxModelEngines:
+                    self.__modelEngines.popitem(last=False)
+        return modelEngine
 
     def processBaselineCharacteristics(self, targetDataFrame):
-        describeStats = targetDataFrame.describe(include='all')
-        uniqueRows = describeStats.T[describeStats.T['unique'] == describeStats.T['count']].index.values
-        describeStats[uniqueRows] = np.nan
+        baselineEngine = BaselineEngine()
+        baselineEngine.add(targetDataFrame)
+        return baselineEngine.getCharacteristics()
+    
+    def processModelValidation(self, targetDataFrame, modelUri, statistics=None):
+        if statistics is None:
+            statistics = ValidationRunStatistics()
 
-        ##TODO: the above relies on df.describe(), which omits the unique categories.
-        # Needs to be added that for every category all unique values and counts are given.
+        with statistics.measure("model loading"):
+            modelEngine = self.__getModelEngine(modelUri)
+            # Get ModelExecutor object for FAIR model description
+            modelExecutor = modelEngine.getModelExecutor()
 
-        return (targetDataFrame.shape, describeStats)
-    
-    def processModelValidation(self, targetDataFrame, modelUri):
-        if self.__modelCacheEndpoint is not None:
-            modelEngine = ModelEngine(modelUri, sparqlEndpoint=self.__modelCacheEndpoint)
-        else:
-            modelEngine = ModelEngine(modelUri)
-        # Get ModelExecutor object for FAIR model description
-        modelExecutor = modelEngine.getModelExecutor()
+        with statistics.measure("scoring"):
+            observed, predicted = self.__scoreDataFrame(modelEngine, modelExecutor, targetDataFrame)
+
+        with statistics.measure("metrics"):
+            if self.__metricsPool is not None:
+                metrics = self.__metricsPool.submit(ValidationEngine.calculateValidationMetrics, observed, predicted).result()
+            else:
+                metrics = ValidationEngine.calculateValidationMetrics(observed, predicted)
+        return self.__addConfidenceIntervals(metrics, observed, predicted, statistics)
+
+    def processPagedValidation(self, query, modelUri, statistics=None):
+        """
+        Fetch the cohort for the given query page by page, and accumulate the baseline characteristics and validation
+        metrics per page, so the complete cohort is never held in memory.
+        Return value: tuple (baseline characteristics, validation metrics)
+        """
+        if statistics is None:
+            statistics = ValidationRunStatistics()
+
+        with statistics.measure("model loading"):
+            modelEngine = self.__getModelEngine(modelUri)
+            modelExecutor = modelEngine.getModelExecutor()
+
+        baselineEngine = BaselineEngine()
+        metricsAccumulator = MetricsAccumulator(mode=self.__metricsMode)
+        pages = self.__dataQueryEngine.iter_sparql_dataframe(query, page_size=self.__dataPageSize)
+        while True:
+            with statistics.measure("data query"), self.__endpointLimits["data"]:
+                page = next(pages, None)
+            if page is None:
+                break
+            with statistics.measure("baseline characteristics"):
+                baselineEngine.add(page)
+            with statistics.measure("scoring"):
+                observed, predicted = self.__scoreDataFrame(modelEngine, modelExecutor, page)
+            with statistics.measure("metrics"):
+                metricsAccumulator.add(observed, predicted)
+
+        with statistics.measure("metrics"):
+            metrics = metricsAccumulator.getMetrics()
+        sample = metricsAccumulator.getSample()
+        if sample is not None:
+            metrics = self.__addConfidenceIntervals(metrics, sample[0], sample[1], statistics)
+        return (baselineEngine.getCharacteristics(), metrics)
+
+    def __scoreDataFrame(self, modelEngine, modelExecutor, targetDataFrame):
+        """
+        Execute the model on the given data frame.
+        Return value: tuple (observed outcomes, predicted probabilities) of the rows where both are available
+        """
         targetDataFrame = modelExecutor.executeModelOnDataFrame(targetDataFrame)
+        Instrumentation.addRows(targetDataFrame.shape[0])
         
         observedLabel = modelEngine.getModelOutputParameterName()
         outcomeData = targetDataFrame[['probability', observedLabel]].dropna()
         
-        observed = outcomeData[observedLabel]
-        predicted = outcomeData['probability']
+        observed = outcomeData[observedLabel].to_numpy()
+        predicted = outcomeData['probability'].to_numpy(dtype=float)
+        return (observed, predicted)
+
+    def __addConfidenceIntervals(self, metrics, observed, predicted, statistics):
+        if self.__bootstrapReplicates > 0:
+            with statistics.measure("bootstrap"):
+                bootstrap = MetricsBootstrap(self.__bootstrapReplicates, seed=self.__bootstrapSeed,
+                    confidenceLevel=self.__confidenceLevel, executor=self.__metricsPool)
+                metrics['confidence_intervals'] = bootstrap.calculateIntervals(observed, predicted)
+        return metrics
 
-        calibration_curve = None
+    @staticmethod
+    def calculateValidationMetrics(observed, predicted):
+        """
+        Calculate the validation metrics for the given observed outcomes and predicted probabilities.
+        Defined as static method, so it can be executed in a worker process.
+        """
+        return MetricsEngine.calculateMetrics(observed, predicted)
+
+class ValidationRunStatistics:
+    """
+    Thread-safe collection of per-stage durations and request outcomes for one processing run.
+    Stages are also measured using Instrumentation, so they are included in the per-request metrics (as self time, excluding
+    nested stages); the durations in this report include nested stages.
+    """
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__startTime = time.perf_counter()
+        self.__stageDurations = {}
+        self.__succeeded = []
+        self.__failed = []
+        self.__skipped = []
+
+    @contextlib.contextmanager
+    def measure(self, stageName):
+        startTime = time.perf_counter()
         try:
-            calibration_curve = sklearn.calibration.calibration_curve(observed, predicted)
-        except:
-            print("Could not calculate calibration curve (too little number of bins?)")
-        
-        precision, recall, prerec_thresholds = sklearn.metrics.precision_recall_curve(observed, predicted)
-        fpr, tpr, roc_thresholds = sklearn.metrics.roc_curve(observed, predicted)
-
-        metrics = {
-            'count': outcomeData.shape[0],
-            'auc': sklearn.metrics.roc_auc_score(observed, predicted),
-            'brier': sklearn.metrics.brier_score_loss(observed, predicted),
-            'precision_recall_curve': {
-                'precision': precision,
-                'recall': recall
-            },
-            'roc_curve': {
-                'fpr': fpr,
-                'tpr': tpr
-            },
-            'calibration_curve': calibration_curve
-        }
+            with Instrumentation.stage(stageName):
+                yield
+        finally:
+            duration = time.perf_counter() - startTime
+            with self.__lock:
+                self.__stageDurations.setdefault(stageName, []).append(duration)
+
+    def recordSuccess(self, requestId):
+        with self.__lock:
+            self.__succeeded.append(requestId)
+
+    def recordSkipped(self, requestId):
+        with self.__lock:
+            self.__skipped.append(requestId)
+
+    def recordFailure(self, requestId, error):
+        with self.__lock:
+            self.__failed.append({"id": requestId, "error": str(error)})
+
+    def getReport(self):
+        with self.__lock:
+            duration = time.perf_counter() - self.__startTime
+            requestCount = len(self.__succeeded) + len(self.__failed)
+            stages = {}
+            for stageName, durations in self.__stageDurations.items():
+                stages[stageName] = {
+                    "count": len(durations),
+                    "total": sum(durations),
+                    "mean": sum(durations) / len(durations),
+                    "max": max(durations)
+                }
+            return {
+                "requests": requestCount,
+                "succeeded": list(self.__succeeded),
+                "failed": list(self.__failed),
+                "skipped": list(self.__skipped),
+                "duration": duration,
+                "throughput": requestCount / duration if duration > 0 else 0.0,
+                "stages": stages
+            }
 
-        return metrics
+class SharedCohort:
+    """
+    Cohort (data frame and baseline characteristics) of one data query, shared by the validation requests with this query.
+    The cohort is fetched by the first request which needs it (other requests wait for it), and released when all requests
+    have been processed. When fetching fails, the waiting and later requests fail with the same error, instead of fetching
+    again one after the other. The data frame is shared between the models, and is not modified during scoring.
+    """
+    def __init__(self, normalizedQuery, requestCount):
+        self.__normalizedQuery = normalizedQuery
+        self.__pendingRequests = requestCount
+        self.__cohort = None
+        self.__lock = threading.Lock()
+
+    def matches(self, query):
+        return QueryEngine.normalize_query(query) == self.__normalizedQuery
+
+    def get(self, fetchFunction):
+        """
+        Return the cohort, calling fetchFunction to fetch it when this is the first request.
+        The lock is only held to decide which request fetches; the other requests wait for the result of that fetch.
+        """
+        with self.__lock:
+            cohort = self.__cohort
+            fetching = cohort is None
+            if fetching:
+                cohort = concurrent.futures.Future()
+                self.__cohort = cohort
+        if fetching:
+            try:
+                cohort.set_result(fetchFunction())
+            except BaseException as error:
+                cohort.set_exception(error)
+        return cohort.result()
+
+    def release(self):
+        """
+        Called by every request when it has been processed; the cohort is released after the last request.
+        """
+        with self.__lock:
+            self.__pendingRequests -= 1
+            if self.__pendingRequests <= 0:
+                self.__cohort = None
 
 class ValidationTriples:
-    def __init__(self, requestSpecs):
-        """Initialize class to generate RDF triples for given validation results"""
+    def __init__(self, requestSpecs, curvePointBudget=None):
+        """Initialize class to generate RDF triples for given validation results.
+        curvePointBudget: maximum number of points stored per curve (e.g. ROC), None stores all points"""
         self.__graph = rdflib.Graph()
+        self.__curvePointBudget = curvePointBudget
+        self.__requestId = requestSpecs["id"]["value"]
         self.__resultsObject = self.__createUri("http://" + socket.getfqdn() + "/validation/" + str(uuid.uuid4()))
         self.__graph.add((self.__createUri(requestSpecs["id"]["value"]),
             fml.contains_results,
@@ -122,31 +491,63 @@ class ValidationTriples:
         return rdflib.term.URIRef(targetUri)
 
     def storeBaselineCharacteristics(self, baselineCharacteristics):
-        """Loop over Pandas describe() function, and store information in RDF"""
+        """Store the baseline characteristics (as calculated by BaselineEngine) in RDF. All triples are collected first,
+        and added to the graph at once."""
 
         baselineResultsObject = self.__createUri(self.__resultsObject, "baselineResults")
-        self.__graph.add((self.__resultsObject, fml.has_baseline_results, baselineResultsObject))
+        triples = [
+            (self.__resultsObject, fml.has_baseline_results, baselineResultsObject),
+            (baselineResultsObject, fml.has_row_size, rdflib.Literal(baselineCharacteristics["rows"])),
+            (baselineResultsObject, fml.has_column_size, rdflib.Literal(baselineCharacteristics["columns"]))
+        ]
 
-        shapeDataSet = baselineCharacteristics[0]
-        self.__graph.add((baselineResultsObject, fml.has_row_size, rdflib.Literal(shapeDataSet[0])))
-        self.__graph.add((baselineResultsObject, fml.has_column_size, rdflib.Literal(shapeDataSet[1])))
-
-        descriptionDataSet = baselineCharacteristics[1]
-
-        for colName in descriptionDataSet.columns:
+        for colName, characteristics in baselineCharacteristics["characteristics"].items():
             columnUriBaseline = self.__createUri(baselineResultsObject, colName)
-            self.__graph.add((baselineResultsObject, fml.input_feature_characteristics, columnUriBaseline))
-            self.__graph.add((columnUriBaseline, fml.model_parameter_name, rdflib.Literal(colName)))
-            self.__graph.add((columnUriBaseline, RDFS.label, rdflib.Literal(colName + " Characteristics")))
-            print(colName)
-
-            for index, value in descriptionDataSet[colName].items():
-                if not pd.isna(value):
-                    columnCharacteristicUriBaseline = self.__createUri(columnUriBaseline, index)
-                    self.__graph.add((columnUriBaseline, fml.has_characteristic, columnCharacteristicUriBaseline))
-                    self.__graph.add((columnCharacteristicUriBaseline, fml.has_name, rdflib.Literal(index)))
-                    self.__graph.add((columnCharacteristicUriBaseline, RDFS.label, rdflib.Literal(index)))
-                    self.__graph.add((columnCharacteristicUriBaseline, fml.has_value, rdflib.Literal(value)))
+            triples.append((baselineResultsObject, fml.input_feature_characteristics, columnUriBaseline))
+            triples.append((columnUriBaseline, fml.model_parameter_name, rdflib.Literal(colName)))
+            triples.append((columnUriBaseline, RDFS.label, rdflib.Literal(colName + " Characteristics")))
+
+            for index, value in characteristics.items():
+                if "dict" in str(type(value)):
+                    # category counts: one characteristic per category, nested within the value_counts characteristic
+                    columnCharacteristicUriBaseline = self.__addCharacteristicTriples(triples, columnUriBaseline, index, None)
+                    for category, count in value.items():
+                        self.__addCharacteristicTriples(triples, columnCharacteristicUriBaseline, category, count)
+                elif not pd.isna(value):
+                    self.__addCharacteristicTriples(triples, columnUriBaseline, index, value)
+
+        self.__graph.addN(triple + (self.__graph,) for triple in triples)
+
+    def storeProvenance(self, requestMetrics):
+        """Store the per-stage durations, row counts and transferred bytes, and the peak RSS of the validation run
+        (a RequestMetrics object, see Instrumentation) as prov:Activity which generated the results."""
+        metrics = requestMetrics.toDict()
+        runUri = self.__createUri(self.__resultsObject, "run")
+        triples = [
+            (self.__resultsObject, prov.wasGeneratedBy, runUri),
+            (runUri, RDF.type, prov.Activity),
+            (runUri, prov.startedAtTime, rdflib.Literal(requestMetrics.startTime)),
+            (runUri, fml.has_duration, rdflib.Literal(metrics["duration"])),
+            (runUri, fml.peak_rss_bytes, rdflib.Literal(metrics["peak_rss_bytes"]))
+        ]
+        for stageName, stage in metrics["stages"].items():
+            stageUri = self.__createUri(runUri, stageName)
+            triples.append((runUri, fml.has_stage, stageUri))
+            triples.append((stageUri, fml.has_name, rdflib.Literal(stageName)))
+            triples.append((stageUri, fml.has_execution_count, rdflib.Literal(stage["count"])))
+            triples.append((stageUri, fml.has_duration, rdflib.Literal(stage["seconds"])))
+            triples.append((stageUri, fml.has_row_count, rdflib.Literal(stage["rows"])))
+            triples.append((stageUri, fml.has_byte_count, rdflib.Literal(stage["bytes"])))
+        self.__graph.addN(triple + (self.__graph,) for triple in triples)
+
+    def __addCharacteristicTriples(self, triples, baseUri, name, value):
+        characteristicUri = self.__createUri(baseUri, name)
+        triples.append((baseUri, fml.has_characteristic, characteristicUri))
+        triples.append((characteristicUri, fml.has_name, rdflib.Literal(name)))
+        triples.append((characteristicUri, RDFS.label, rdflib.Literal(name)))
+        if value is not None:
+            triples.append((characteristicUri, fml.has_value, rdflib.Literal(value)))
+        return characteristicUri
     
     def storeValidationMetrics(self, validationMetrics):
         """Loop over validationMetrics dictionary and store information in RDF"""
@@ -164,11 +565,49 @@ class ValidationTriples:
             self.__graph.add((myMetricUri, RDFS.label, rdflib.Literal(key)))
 
             if "dict" in str(type(value)):
-                self.storeValidationMetric(value, myMetricUri)
+                self.storeValidationMetric(self.__downsampleCurve(value), myMetricUri)
+            elif isinstance(value, np.ndarray):
+                self.__graph.add((myMetricUri, fml.has_value, ValidationTriples.encodeArray(value)))
             else:
-                print(key + " | " + str(type(value)))
                 self.__graph.add((myMetricUri, fml.has_value, rdflib.Literal(value)))
 
+    def __downsampleCurve(self, curve):
+        """
+        Reduce curve data (a dictionary of equally sized arrays, e.g. fpr/tpr) to at most curvePointBudget points.
+        The same indices are taken from every array (including the first and last point), so the points stay paired.
+        """
+        arrays = [value for value in curve.values() if isinstance(value, np.ndarray)]
+        if self.__curvePointBudget is None or len(arrays) != len(curve) or len(arrays) == 0:
+            return curve
+        curveLength = arrays[0].shape[0]
+        if curveLength <= self.__curvePointBudget or any(array.shape[0] != curveLength for array in arrays):
+            return curve
+        indices = np.unique(np.round(np.linspace(0, curveLength - 1, self.__curvePointBudget)).astype(int))
+        return {key: value[indices] for key, value in curve.items()}
+
+    @staticmethod
+    def encodeArray(values):
+        """
+        Encode a NumPy array as compact, lossless literal: base64 of the little-endian float64 values.
+        The datatype is not registered with rdflib (Literal.toPython() returns the literal itself); use decodeArray to
+        restore the array.
+        """
+        return rdflib.Literal(ValidationTriples.arrayToBase64(values), datatype=fml.base64_float64_array)
+
+    @staticmethod
+    def arrayToBase64(values):
+        """
+        Lexical form of an array literal.
+        """
+        values = np.ascontiguousarray(values, dtype="<f8").ravel()
+        return base64.b64encode(values.tobytes()).decode("ascii")
+
+    @staticmethod
+    def decodeArray(literal):
+        """
+        Restore a NumPy array from a literal created by encodeArray (or from its lexical form).
+        """
+        return np.frombuffer(base64.b64decode(str(literal)), dtype="<f8").copy()
 
     def retrieveTriples(self):
         """Fetch triples from in-memory graph and export as raw nt-based string of triples"""
@@ -180,21 +619,34 @@ class ValidationTriples:
         triples = self.retrieveTriples()
         validationEndpoint.storeValidationTriples(str(self.__resultsObject), triples)
 
+    def publishTriples(self, validationEndpoint):
+        """Store triples and mark the request as done in one transaction, based on ValidationEndpoint instance given"""
+        triples = self.__graph.serialize(format="nt", encoding="utf-8")
+        validationEndpoint.publishValidationResults(self.__requestId, str(self.__resultsObject), triples)
+
 class ValidationEndpoint:
-    def __init__(self, endpointUrl):
+    def __init__(self, endpointUrl, client=None):
         self.__endpointUrl = endpointUrl
+        self.__client = client
+        if client is None:
+            self.__client = SparqlEndpointClient(endpointUrl)
     def __defaultQueryAssignment(self, queryString):
-        sparql = SPARQLWrapper(self.__endpointUrl)
-        sparql.setQuery(queryString)
-        sparql.setReturnFormat(JSON)
-        results = sparql.query().convert()
+        with Instrumentation.stage("validation endpoint"):
+            response = self.__client.query(queryString)
+            Instrumentation.addBytes(len(response.content))
+            results = response.json()
+            Instrumentation.addRows(len(results["results"]["bindings"]))
         return results["results"]["bindings"]
-    def __postQuery(self, queryString):
-        sparql = SPARQLWrapper(self.__endpointUrl + "/statements")
-        sparql.setQuery(queryString)
-        sparql.method = "POST"
-        results = sparql.query()
-        print(results.response.read())
+    def __postQuery(self, queryStrings):
+        """
+        Perform one SPARQL UPDATE, or a list of updates in a single request.
+        """
+        with Instrumentation.stage("validation endpoint"):
+            if isinstance(queryStrings, str):
+                Instrumentation.addBytes(len(queryStrings.encode("utf8")))
+            else:
+                Instrumentation.addBytes(sum(len(queryString.encode("utf8")) for queryString in queryStrings))
+            return self.__client.update(queryStrings)
     def getOpenValidationRequests(self):
         queryString = """
         PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
@@ -206,27 +658,33 @@ class ValidationEndpoint:
             ?id fml:has_status [ rdf:type fml:Requested ].
             ?id fml:at_time ?dateTime.
             ?id fml:about_model ?model.
+            OPTIONAL { ?id fml:has_query ?query }.
         }
         """
-        return self.__defaultQueryAssignment(queryString)
+        validationRequests = self.__defaultQueryAssignment(queryString)
+        for validationRequest in validationRequests:
+            if "query" in validationRequest:
+                validationRequest["query"]["value"] = self.__b64DecodeString(validationRequest["query"]["value"])
+        return validationRequests
     def markRequestAsDone(self, requestId):
+        return self.__postQuery(self.__getMarkRequestAsDoneQueries(requestId))
+    def __getMarkRequestAsDoneQueries(self, requestId):
         queryString = """
         PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
         PREFIX fml: <https://fairmodels.org/ontology.owl#>
 
         DELETE {
             ?id fml:has_status ?statusObj.
-            ?statusObj rdf:type ?statusClass.
+            ?statusObj ?statusProperty ?statusValue.
         }
         WHERE {
             BIND(<%s> AS ?id).
             ?id fml:has_status ?statusObj.
-            ?statusObj rdf:type ?statusClass.
+            ?statusObj ?statusProperty ?statusValue.
         }
         """ % requestId
-        self.__postQuery(queryString)
 
-        queryString = """
+        insertString = """
         PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
         PREFIX fml: <https://fairmodels.org/ontology.owl#>
 
@@ -237,7 +695,104 @@ class ValidationEndpoint:
             BIND(<%s> AS ?id).
         }
         """ % requestId
-        return self.__postQuery(queryString)
+        return [queryString, insertString]
+    def claimRequest(self, requestId, workerId, leaseSeconds):
+        """
+        Atomically claim an open validation request, by replacing its Requested status with an InProgress status
+        holding the worker identifier and lease expiry time. The update only matches requests which are still open;
+        the claim is verified afterwards, as SPARQL UPDATE does not report whether it matched.
+        Return value: True when this worker holds the claim
+        """
+        leaseUri = "%s_lease_%s" % (requestId, uuid.uuid4())
+        queryString = """
+        PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
+        PREFIX fml: <https://fairmodels.org/ontology.owl#>
+        PREFIX xsd: <http://www.w3.org/2001/XMLSchema#>
+
+        DELETE {
+            ?id fml:has_status ?statusObj.
+            ?statusObj ?statusProperty ?statusValue.
+        }
+        INSERT {
+            ?id fml:has_status <%s>.
+            <%s> rdf:type fml:InProgress;
+                fml:claimed_by %s;
+                fml:lease_expiry "%s"^^xsd:dateTime.
+        }
+        WHERE {
+            BIND(<%s> AS ?id).
+            ?id fml:has_status ?statusObj.
+            ?statusObj rdf:type fml:Requested.
+            ?statusObj ?statusProperty ?statusValue.
+        }
+        """ % (leaseUri, leaseUri, rdflib.Literal(workerId).n3(), self.__getLeaseExpiry(leaseSeconds), requestId)
+        self.__postQuery(queryString)
+        return self.__getClaims(requestId) == [workerId]
+    def __getClaims(self, requestId):
+        """
+        Return value: list of the worker identifiers which claimed the given request
+        """
+        queryString = """
+        PREFIX fml: <https://fairmodels.org/ontology.owl#>
+
+        SELECT ?workerId
+        WHERE {
+            <%s> fml:has_status [ fml:claimed_by ?workerId ].
+        }
+        """ % requestId
+        return [row["workerId"]["value"] for row in self.__defaultQueryAssignment(queryString)]
+    def renewLease(self, requestId, workerId, leaseSeconds):
+        """
+        Extend the lease of a request claimed by the given worker.
+        Return value: False when the request is no longer claimed by this worker (e.g. its lease expired and the request
+            was recovered and claimed by another worker), True otherwise
+        """
+        queryString = """
+        PREFIX fml: <https://fairmodels.org/ontology.owl#>
+        PREFIX xsd: <http://www.w3.org/2001/XMLSchema#>
+
+        DELETE {
+            ?statusObj fml:lease_expiry ?expiry.
+        }
+        INSERT {
+            ?statusObj fml:lease_expiry "%s"^^xsd:dateTime.
+        }
+        WHERE {
+            <%s> fml:has_status ?statusObj.
+            ?statusObj fml:claimed_by %s;
+                fml:lease_expiry ?expiry.
+        }
+        """ % (self.__getLeaseExpiry(leaseSeconds), requestId, rdflib.Literal(workerId).n3())
+        self.__postQuery(queryString)
+        return self.__getClaims(requestId) == [workerId]
+    def recoverExpiredLeases(self):
+        """
+        Return all InProgress requests with an expired lease (e.g. of a crashed worker) to the Requested status.
+        """
+        queryString = """
+        PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
+        PREFIX fml: <https://fairmodels.org/ontology.owl#>
+
+        DELETE {
+            ?id fml:has_status ?statusObj.
+            ?statusObj ?statusProperty ?statusValue.
+        }
+        INSERT {
+            ?id fml:has_status ?requestedStatus.
+            ?requestedStatus rdf:type fml:Requested.
+        }
+        WHERE {
+            ?id fml:has_status ?statusObj.
+            ?statusObj rdf:type fml:InProgress;
+                fml:lease_expiry ?expiry.
+            FILTER(?expiry < NOW()).
+            ?statusObj ?statusProperty ?statusValue.
+            BIND(IRI(CONCAT(STR(?statusObj), "_recovered")) AS ?requestedStatus).
+        }
+        """
+        self.__postQuery(queryString)
+    def __getLeaseExpiry(self, leaseSeconds):
+        return (datetime.now(timezone.utc) + timedelta(seconds=leaseSeconds)).strftime("%Y-%m-%dT%H:%M:%SZ")
     def getRequestSpecs(self, requestId):
         queryString = """
         PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
@@ -247,7 +802,8 @@ class ValidationEndpoint:
         WHERE {
             BIND(<%s> AS ?id).
             ?id rdf:type fml:ValidationRequest.
-            ?id fml:has_status [ rdf:type fml:Requested ].
+            ?id fml:has_status [ rdf:type ?status ].
+            FILTER(?status IN (fml:Requested, fml:InProgress)).
             ?id fml:at_time ?dateTime.
             ?id fml:about_model ?model.
             OPTIONAL { ?id fml:has_query ?query }.
@@ -276,6 +832,16 @@ class ValidationEndpoint:
         } WHERE { }
         """ % (requestId, triplesString)
         self.__postQuery(insertQuery)
+    def publishValidationResults(self, requestId, graphUri, triples):
+        """
+        Store the validation triples (N-Triples bytes) in the given named graph, and mark the request as done,
+        in one transaction. The triples are sent as request body instead of being embedded in a SPARQL UPDATE.
+        """
+        with Instrumentation.stage("validation endpoint"):
+            Instrumentation.addBytes(len(triples))
+            with self.__client.transaction() as transaction:
+                transaction.add(triples, contentType="application/n-triples", graphUri=graphUri)
+                transaction.update(self.__getMarkRequestAsDoneQueries(requestId))
     def storeQuery(self, requestId, query):
         queryDeleteString = """
         PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
@@ -288,7 +854,6 @@ class ValidationEndpoint:
             ?id fml:has_query ?query.
         }
         """ % requestId
-        self.__postQuery(queryDeleteString)
 
         query = self.__b64EncodeString(query)
         queryString = """
@@ -301,4 +866,4 @@ class ValidationEndpoint:
             BIND(<%s> AS ?id).
          }
         """ % (query, requestId)
-        self.__postQuery(queryString)
+        self.__postQuery([queryDeleteString, queryString])
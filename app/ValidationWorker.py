@@ -0,0 +1,56 @@
+import os
+import uuid
+import socket
+import signal
+import threading
+
+class ValidationWorker:
+    """
+    Resident worker which polls the validation endpoint for open requests, and processes them using a ValidationEngine.
+    The ValidationEngine should be created with a workerId, so that requests are claimed before processing and several workers
+    (on different nodes) never process the same request. Between requests the ValidationEngine (and its model caches) stays loaded.
+    When no requests were processed, the polling interval is doubled, up to maxPollInterval.
+    """
+    def __init__(self, validationEngine, pollInterval=10, maxPollInterval=300):
+        self.__validationEngine = validationEngine
+        self.__pollInterval = pollInterval
+        self.__maxPollInterval = maxPollInterval
+        self.__stopEvent = threading.Event()
+
+    @staticmethod
+    def createWorkerId():
+        """
+        Create a unique identifier for this worker process.
+        """
+        return "%s:%d:%s" % (socket.getfqdn(), os.getpid(), uuid.uuid4().hex[:8])
+
+    def stop(self, *args):
+        """
+        Stop the worker after the current poll has been processed. Can be used as signal handler.
+        """
+        print("Stopping worker")
+        self.__stopEvent.set()
+
+    def run(self):
+        """
+        Poll and process validation requests until stop() is called (or SIGINT/SIGTERM is received).
+        """
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGINT, self.stop)
+            signal.signal(signal.SIGTERM, self.stop)
+
+        currentInterval = self.__pollInterval
+        while not self.__stopEvent.is_set():
+            processedCount = 0
+            try:
+                self.__validationEngine.recoverExpiredLeases()
+                report = self.__validationEngine.processValidationRequests()
+                processedCount = report["requests"]
+            except Exception as error:
+                print("Could not poll validation requests: " + str(error))
+
+            if processedCount > 0:
+                currentInterval = self.__pollInterval
+            self.__stopEvent.wait(currentInterval)
+            if processedCount == 0:
+                currentInterval = min(currentInterval * 2, self.__maxPollInterval)
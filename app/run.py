@@ -1,5 +1,5 @@
 from flask import Flask, render_template, request
-from SPARQLWrapper import SPARQLWrapper, JSON, POST
+from EndpointClient import SparqlEndpointClient
 import json
 from QueryEngine import QueryEngine
 from ValidationEngine import ValidationEndpoint
@@ -7,12 +7,19 @@ from ValidationEngine import ValidationEndpoint
 with open("config.json") as f:
     config = json.load(f)
 
+if "http" in config:
+    SparqlEndpointClient.configure(
+        poolSize=config["http"].get("pool_size", 10),
+        timeout=config["http"].get("timeout", 300),
+        connectTimeout=config["http"].get("connect_timeout", 10),
+        retries=config["http"].get("retries", 3))
+
 app = Flask(__name__)
 
 class ModelEndpoint:
     def __init__(self, endpointUrl):
         self.__endpointUrl = endpointUrl
-        self.__sparql = SPARQLWrapper(self.__endpointUrl)
+        self.__client = SparqlEndpointClient(self.__endpointUrl)
     def getModelInputParameters(self, modelUri):
         queryString = """
         PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
@@ -32,9 +39,7 @@ class ModelEndpoint:
                 fml:is_variable_type [ rdf:type ?input_feature_category ].
         }
         """ % modelUri
-        self.__sparql.setQuery(queryString)
-        self.__sparql.setReturnFormat(JSON)
-        results = self.__sparql.query().convert()
+        results = self.__client.select(queryString)
         return results["results"]["bindings"]
 
 validationEndpoint = ValidationEndpoint(config["validation_endpoint"]["url"])
@@ -1,15 +1,87 @@
-from ModelEngine import ModelEngine
+from ModelEngine import ModelEngine, DockerExecutor
 from QueryEngine import QueryEngine
 from ValidationEngine import ValidationEngine
+from ModelCache import ModelCache
+from CohortCache import CohortCache
+from ValidationWorker import ValidationWorker
+from EndpointClient import SparqlEndpointClient
+from ContainerPool import ContainerPool
+from Instrumentation import Instrumentation
+import argparse
 import json
 import pandas as pd
 
+parser = argparse.ArgumentParser(description="Process open validation requests")
+parser.add_argument("--daemon", action="store_true", help="keep running, and poll for new validation requests")
+args = parser.parse_args()
+
 config = { }
 with open("config.json") as f:
     config = json.load(f)
 
+if "http" in config:
+    SparqlEndpointClient.configure(
+        poolSize=config["http"].get("pool_size", 10),
+        timeout=config["http"].get("timeout", 300),
+        connectTimeout=config["http"].get("connect_timeout", 10),
+        retries=config["http"].get("retries", 3))
+
+if "docker" in config:
+    ContainerPool.configure(
+        idleTtl=config["docker"].get("idle_ttl", 600),
+        startupTimeout=config["docker"].get("startup_timeout", 60),
+        maxContainersPerImage=config["docker"].get("max_containers_per_image", 2))
+    DockerExecutor.configure(
+        bulkChunkSize=config["docker"].get("bulk_chunk_size", 10000),
+        maxConcurrentRequests=config["docker"].get("max_concurrent_requests", 2),
+        requestTimeout=config["docker"].get("request_timeout", 300),
+        maxConcurrentRowRequests=config["docker"].get("max_concurrent_row_requests", 64),
+        rowRetries=config["docker"].get("row_retries", 2))
+
+if "model_cache_endpoint" in config:
+    ModelEngine.configure(fetchSubgraphOnly=config["model_cache_endpoint"].get("subgraph_only", False))
+
+if "instrumentation" in config:
+    Instrumentation.configure(
+        structuredLogs=config["instrumentation"].get("structured_logs", False),
+        prometheusFile=config["instrumentation"].get("prometheus_file"))
+
+modelCache = None
+if "model_spec_cache" in config:
+    modelCache = ModelCache(config["model_spec_cache"]["directory"], maxEntries=config["model_spec_cache"].get("max_entries", 64))
+
+cohortCache = None
+if config.get("cohort_cache") is not None:
+    cohortCache = CohortCache(config["cohort_cache"]["directory"],
+        ttl=config["cohort_cache"].get("ttl", 86400),
+        maxBytes=config["cohort_cache"].get("max_bytes", 10 * 2 ** 30))
+
 validationEngine = ValidationEngine(
     config["validation_endpoint"]["url"],
-    QueryEngine(config["data_endpoint"]["url"]),
-    modelCacheEndpoint=config["model_cache_endpoint"]["url"])
-validationEngine.processValidationRequests()
+    QueryEngine(config["data_endpoint"]["url"], cohort_cache=cohortCache),
+    modelCacheEndpoint=config["model_cache_endpoint"]["url"],
+    modelCache=modelCache,
+    maxWorkers=config.get("processing", {}).get("max_workers", 1),
+    metricsProcesses=config.get("processing", {}).get("metrics_processes", 0),
+    endpointConcurrency=config.get("processing", {}).get("endpoint_concurrency"),
+    # only the daemon claims requests; one-shot runs process requests without claims, as before
+    workerId=ValidationWorker.createWorkerId() if args.daemon else None,
+    leaseSeconds=config.get("worker", {}).get("lease_seconds", 900),
+    modelEngineTtl=config.get("worker", {}).get("model_engine_ttl", 0) if args.daemon else 0,
+    publishMode=config["validation_endpoint"].get("publish_mode", "update"),
+    curvePointBudget=config.get("processing", {}).get("curve_point_budget"),
+    bootstrapReplicates=config.get("bootstrap", {}).get("replicates", 0),
+    bootstrapSeed=config.get("bootstrap", {}).get("seed"),
+    confidenceLevel=config.get("bootstrap", {}).get("confidence_level", 0.95),
+    dataPageSize=config.get("processing", {}).get("data_page_size"),
+    metricsMode=config.get("processing", {}).get("metrics_mode", "exact"),
+    storeProvenance=config.get("instrumentation", {}).get("provenance", False))
+
+if args.daemon:
+    validationWorker = ValidationWorker(validationEngine,
+        pollInterval=config.get("worker", {}).get("poll_interval", 10),
+        maxPollInterval=config.get("worker", {}).get("max_poll_interval", 300))
+    validationWorker.run()
+else:
+    validationEngine.recoverExpiredLeases()
+    validationEngine.processValidationRequests()
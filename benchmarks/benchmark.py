@@ -0,0 +1,292 @@
+"""
+Benchmark suite for the scoring, query decoding, metrics and publishing hot paths.
+
+Synthetic cohorts of the given size are generated for the logistic regression model in fixtures/stiphout_2011_logistic.ttl,
+and SPARQL results are generated by resampling fixtures/synthetic_cohort_results.json. That fixture is a synthetic
+SPARQL JSON result (200 randomly generated patients, no real patient data) in the shape returned by the data endpoint.
+Every benchmark is timed without memory tracing (best of --repeat runs), and executed once more under tracemalloc to
+determine its peak memory.
+
+Throughput is also reported relative to a reference decode (plain json.loads and a loop over the bindings, which does
+not use any code of the library) timed on the same SPARQL result in the same run, so that results of different machines
+can be compared. With --compare, the relative throughput and peak memory are compared against baseline.json, which must
+have been measured with the same --rows and --per-row-rows (fixed costs and cache effects make the relative throughput
+depend on the cohort size); the script exits with status 2 when the cohort sizes differ, and with status 1 when the
+relative throughput of a benchmark dropped, or its peak memory grew, by more than --tolerance (relative).
+
+Usage (from the repository root):
+    python benchmarks/benchmark.py [--rows 100000] [--repeat 5] [--compare] [--tolerance 0.3] [--update-baseline] [--output results.json]
+"""
+import os
+import sys
+import gc
+import json
+import time
+import argparse
+import resource
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+benchmarkDirectory = os.path.dirname(os.path.abspath(__file__))
+appDirectory = os.path.join(os.path.dirname(benchmarkDirectory), "app")
+sys.path.insert(0, appDirectory)
+
+from ModelEngine import ModelEngine, ModelExecutor
+from QueryEngine import SparqlResultDecoder
+from MetricsEngine import MetricsEngine, MetricsBootstrap
+from BaselineEngine import BaselineEngine
+from ValidationEngine import ValidationTriples
+
+modelPath = os.path.join(benchmarkDirectory, "fixtures", "stiphout_2011_logistic.ttl")
+resultsPath = os.path.join(benchmarkDirectory, "fixtures", "synthetic_cohort_results.json")
+baselinePath = os.path.join(benchmarkDirectory, "baseline.json")
+
+NCIT = "http://ncicb.nci.nih.gov/xml/owl/EVS/Thesaurus.owl#"
+cTStages = [NCIT + code for code in ["C48719", "C48720", "C48724", "C48728", "C48732"]]
+cNStages = [NCIT + code for code in ["C48705", "C48706", "C48786", "C48714"]]
+
+class BenchmarkContext:
+    """
+    Inputs shared by all benchmarks, generated once per run (outside of the measurements).
+    """
+    def __init__(self, rows, perRowRows, seed=2011):
+        rng = np.random.default_rng(seed)
+        self.rows = rows
+        self.modelEngine = ModelEngine(modelPath, libraryLocation=appDirectory)
+        self.modelExecutor = self.modelEngine.getModelExecutor()
+
+        self.cohort = pd.DataFrame({
+            "cT": pd.Categorical(np.array(cTStages, dtype=object)[rng.integers(0, len(cTStages), rows)]),
+            "cN": pd.Categorical(np.array(cNStages, dtype=object)[rng.integers(0, len(cNStages), rows)]),
+            "tLength": np.round(rng.uniform(1, 15, rows), 1)
+        })
+        # draw the outcomes from the model itself, so the metrics are calculated on a calibrated model
+        probabilities = self.modelExecutor.executeModelOnDataFrame(self.cohort)["probability"].to_numpy()
+        self.cohort["ypT0N0"] = (rng.random(rows) < probabilities).astype(np.int64)
+        self.perRowCohort = self.cohort.iloc[:perRowRows]
+        self.observed = self.cohort["ypT0N0"].to_numpy()
+        self.predicted = probabilities
+
+        with open(resultsPath) as f:
+            syntheticResults = json.load(f)
+        self.sparqlJson = self.__resampleResults(syntheticResults, rows, rng)
+        self.sparqlJsonText = json.dumps(self.sparqlJson)
+        self.sparqlTsv = self.__toTsv(self.sparqlJson)
+        self.metrics = MetricsEngine.calculateMetrics(self.observed, self.predicted)
+        baselineEngine = BaselineEngine()
+        baselineEngine.add(self.cohort)
+        self.baselineCharacteristics = baselineEngine.getCharacteristics()
+
+    def __resampleResults(self, syntheticResults, rows, rng):
+        """
+        Draw rows bindings from the synthetic result, and give every row a unique patient URI.
+        """
+        bindings = syntheticResults["results"]["bindings"]
+        resampled = []
+        for rowNumber, bindingIndex in enumerate(rng.integers(0, len(bindings), rows)):
+            binding = dict(bindings[bindingIndex])
+            binding["patient"] = {"type": "uri", "value": "http://localhost/cohort/patient%d" % rowNumber}
+            resampled.append(binding)
+        return {"head": syntheticResults["head"], "results": {"bindings": resampled}}
+
+    def __toTsv(self, sparqlJson):
+        """
+        Encode a SPARQL JSON result as SPARQL TSV result.
+        """
+        variables = sparqlJson["head"]["vars"]
+        lines = ["\t".join("?" + variable for variable in variables)]
+        for binding in sparqlJson["results"]["bindings"]:
+            terms = []
+            for variable in variables:
+                term = binding.get(variable)
+                if term is None:
+                    terms.append("")
+                elif term["type"] == "uri":
+                    terms.append("<%s>" % term["value"])
+                elif "datatype" in term:
+                    terms.append('"%s"^^<%s>' % (term["value"], term["datatype"]))
+                else:
+                    terms.append('"%s"' % term["value"])
+            lines.append("\t".join(terms))
+        return "\n".join(lines) + "\n"
+
+def referenceDecode(context):
+    """
+    Reference workload for the relative throughput: parse the SPARQL JSON result, and collect the values per column.
+    """
+    results = json.loads(context.sparqlJsonText)
+    columns = {variable: [] for variable in results["head"]["vars"]}
+    for binding in results["results"]["bindings"]:
+        for variable, values in columns.items():
+            term = binding.get(variable)
+            values.append(None if term is None else term["value"])
+    return context.rows
+
+def benchmarkModelEngine(context):
+    for repetition in range(20):
+        ModelEngine(modelPath, libraryLocation=appDirectory).getModelExecutor().getSpecification()
+    return 20
+
+def benchmarkScorePerRow(context):
+    ModelExecutor.executeModelOnDataFrame(context.modelExecutor, context.perRowCohort)
+    return context.perRowCohort.shape[0]
+
+def benchmarkScoreBulk(context):
+    context.modelExecutor.executeModelOnDataFrame(context.cohort)
+    return context.rows
+
+def benchmarkDecodeJson(context):
+    # parsed from the response text, as the TSV decoder is
+    SparqlResultDecoder().decode_json(json.loads(context.sparqlJsonText))
+    return context.rows
+
+def benchmarkDecodeTsv(context):
+    SparqlResultDecoder().decode_tsv(context.sparqlTsv)
+    return context.rows
+
+def benchmarkMetrics(context):
+    MetricsEngine.calculateMetrics(context.observed, context.predicted)
+    return context.rows
+
+def benchmarkBootstrap(context):
+    MetricsBootstrap(replicates=100, seed=2011).calculateIntervals(context.observed, context.predicted)
+    return context.rows * 100
+
+def benchmarkBaseline(context):
+    baselineEngine = BaselineEngine()
+    baselineEngine.add(context.cohort)
+    baselineEngine.getCharacteristics()
+    return context.rows
+
+def benchmarkTriples(context):
+    tripleCount = 0
+    for repetition in range(20):
+        validationTriples = ValidationTriples({"id": {"value": "http://localhost/validation/request"}}, curvePointBudget=1000)
+        validationTriples.storeBaselineCharacteristics(context.baselineCharacteristics)
+        validationTriples.storeValidationMetrics(context.metrics)
+        tripleCount = tripleCount + len(validationTriples.retrieveTriples().splitlines())
+    return tripleCount
+
+# name: (function, unit of the returned count)
+benchmarks = {
+    "model_engine": (benchmarkModelEngine, "models"),
+    "score_per_row": (benchmarkScorePerRow, "rows"),
+    "score_bulk": (benchmarkScoreBulk, "rows"),
+    "decode_json": (benchmarkDecodeJson, "rows"),
+    "decode_tsv": (benchmarkDecodeTsv, "rows"),
+    "metrics": (benchmarkMetrics, "rows"),
+    "bootstrap": (benchmarkBootstrap, "rows"),
+    "baseline": (benchmarkBaseline, "rows"),
+    "triples": (benchmarkTriples, "triples")
+}
+
+def runBenchmark(function, context, repeat):
+    """
+    Return value: dictionary with the best duration, throughput (units per second) and peak traced memory
+    """
+    function(context)
+    durations = []
+    for repetition in range(repeat):
+        gc.collect()
+        startTime = time.perf_counter()
+        count = function(context)
+        durations.append(time.perf_counter() - startTime)
+
+    gc.collect()
+    tracemalloc.start()
+    function(context)
+    peakMemory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "seconds": min(durations),
+        "count": count,
+        "throughput": count / min(durations),
+        "peak_memory_mb": peakMemory / 2 ** 20
+    }
+
+def compareToBaseline(results, baseline, tolerance):
+    """
+    Return value: list of regression messages (empty when all benchmarks are within the tolerance)
+    """
+    regressions = []
+    for name, result in results["benchmarks"].items():
+        if name not in baseline["benchmarks"]:
+            continue
+        reference = baseline["benchmarks"][name]
+        if result["relative_throughput"] < reference["relative_throughput"] * (1 - tolerance):
+            regressions.append("%s: relative throughput %.3f is below baseline %.3f" % (name, result["relative_throughput"], reference["relative_throughput"]))
+        # small allocations vary between runs, hence memory regressions are only reported above 1 MB
+        if result["peak_memory_mb"] > reference["peak_memory_mb"] * (1 + tolerance) and result["peak_memory_mb"] - reference["peak_memory_mb"] > 1:
+            regressions.append("%s: peak memory %.1f MB is above baseline %.1f MB" % (name, result["peak_memory_mb"], reference["peak_memory_mb"]))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scoring, query decoding, metrics and publishing hot paths.")
+    parser.add_argument("--rows", type=int, default=100000, help="number of rows of the synthetic cohort")
+    parser.add_argument("--per-row-rows", type=int, default=2000, help="number of rows scored in the per-row benchmark")
+    parser.add_argument("--repeat", type=int, default=5, help="number of timed runs per benchmark (the best run is reported)")
+    parser.add_argument("--compare", action="store_true", help="compare the results against the baseline, and exit with status 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="relative regression tolerated against the baseline")
+    parser.add_argument("--only", nargs="*", choices=list(benchmarks.keys()), help="run only the given benchmarks")
+    parser.add_argument("--baseline", default=baselinePath, help="baseline file to compare against")
+    parser.add_argument("--update-baseline", action="store_true", help="store the results as new baseline")
+    parser.add_argument("--output", help="write the results to the given JSON file")
+    arguments = parser.parse_args()
+
+    context = BenchmarkContext(arguments.rows, min(arguments.per_row_rows, arguments.rows))
+    reference = runBenchmark(referenceDecode, context, arguments.repeat)
+    results = {
+        "rows": arguments.rows,
+        "per_row_rows": context.perRowCohort.shape[0],
+        "reference_throughput": reference["throughput"],
+        "benchmarks": {}
+    }
+    print("Reference decode: %.0f rows/s" % reference["throughput"])
+    print("%-14s %10s %22s %10s %12s" % ("benchmark", "seconds", "throughput", "relative", "peak memory"))
+    for name, (function, unit) in benchmarks.items():
+        if arguments.only and name not in arguments.only:
+            continue
+        result = runBenchmark(function, context, arguments.repeat)
+        result["relative_throughput"] = result["throughput"] / reference["throughput"]
+        results["benchmarks"][name] = result
+        print("%-14s %10.4f %12.0f %-9s %10.3f %9.1f MB" % (name, result["seconds"], result["throughput"], unit + "/s",
+            result["relative_throughput"], result["peak_memory_mb"]))
+    results["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print("Maximum resident set size: %.1f MB" % results["max_rss_mb"])
+
+    if arguments.output is not None:
+        with open(arguments.output, "w") as f:
+            json.dump(results, f, indent=4)
+
+    if arguments.update_baseline:
+        with open(arguments.baseline, "w") as f:
+            json.dump(results, f, indent=4)
+        print("Stored baseline in " + arguments.baseline)
+        return 0
+
+    if not arguments.compare:
+        return 0
+    if not os.path.exists(arguments.baseline):
+        print("No baseline found at %s, run with --update-baseline to create it" % arguments.baseline)
+        return 1
+    with open(arguments.baseline) as f:
+        baseline = json.load(f)
+    if baseline["rows"] != results["rows"] or baseline.get("per_row_rows") != results["per_row_rows"]:
+        print("Baseline was measured with --rows %d --per-row-rows %s; run with the same cohort size, or record a new baseline"
+            % (baseline["rows"], baseline.get("per_row_rows")))
+        return 2
+    if "reference_throughput" not in baseline:
+        print("Baseline has no relative throughputs, record a new baseline with --update-baseline")
+        return 2
+    regressions = compareToBaseline(results, baseline, arguments.tolerance)
+    for regression in regressions:
+        print("REGRESSION " + regression)
+    if len(regressions) > 0:
+        return 1
+    print("No regressions against the baseline (tolerance %d%%)" % (arguments.tolerance * 100))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,14 @@
 from flask import Flask, Response, request
+import io
 import json
 import signal
 import math
 import sys
 import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc
+
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
 
 app = Flask('TaskMaster')
 
@@ -42,14 +47,24 @@ def calculate(data):
     probability = 1 / (1 + math.exp(-1 * linearPredictor))
     return probability
 
+def calculate_or_none(row):
+    try:
+        return calculate(row)
+    except Exception as ex:
+        print(ex)
+        return None
+
 @app.route('/bulk', methods=["POST"])
 def calculate_bulk():
+    if request.mimetype == ARROW_STREAM:
+        return calculate_bulk_arrow()
+
     try:
         data = request.get_json()
     except:
         return Response(json.dumps({"success": False, 'message': "Could not parse input as JSON"}), mimetype="application/json")
     
-    myDf = pd.read_json(data)
+    myDf = pd.read_json(io.StringIO(data))
     for index, row in myDf.iterrows():
             # convert short column name to long version
             try:
@@ -58,4 +73,21 @@ def calculate_bulk():
                 print(ex)
     return json.dumps(myDf.to_json())
 
+def calculate_bulk_arrow():
+    """
+    Bulk calculation using Arrow IPC streams: the request holds one column per input feature,
+    the response holds the probability column (in the order of the request rows).
+    """
+    try:
+        myDf = pa.ipc.open_stream(request.get_data()).read_all().to_pandas()
+    except Exception:
+        return Response(json.dumps({"success": False, 'message': "Could not parse input as Arrow IPC stream"}), status=400, mimetype="application/json")
+
+    probabilities = [calculate_or_none(row) for index, row in myDf.iterrows()]
+    result = pa.table({"probability": pa.array(probabilities, type=pa.float64())})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, result.schema) as writer:
+        writer.write_table(result)
+    return Response(sink.getvalue().to_pybytes(), mimetype=ARROW_STREAM)
+
 app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,34 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+repositoryDirectory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+appDirectory = os.path.join(repositoryDirectory, "app")
+stiphoutModelPath = os.path.join(repositoryDirectory, "benchmarks", "fixtures", "stiphout_2011_logistic.ttl")
+
+# the application modules are imported as top-level modules (as in app/validate.py)
+sys.path.insert(0, appDirectory)
+
+NCIT = "http://ncicb.nci.nih.gov/xml/owl/EVS/Thesaurus.owl#"
+cTStages = [NCIT + code for code in ["C48719", "C48720", "C48724", "C48728", "C48732"]]
+cNStages = [NCIT + code for code in ["C48705", "C48706", "C48786", "C48714"]]
+
+@pytest.fixture
+def stiphoutModelEngine():
+    from ModelEngine import ModelEngine
+    return ModelEngine(stiphoutModelPath, libraryLocation=appDirectory)
+
+@pytest.fixture
+def stiphoutCohort():
+    """
+    Synthetic cohort with the input columns of the stiphout_2011_logistic model (as in benchmarks/benchmark.py).
+    """
+    rng = np.random.default_rng(2011)
+    rows = 500
+    return pd.DataFrame({
+        "cT": np.array(cTStages, dtype=object)[rng.integers(0, len(cTStages), rows)],
+        "cN": np.array(cNStages, dtype=object)[rng.integers(0, len(cNStages), rows)],
+        "tLength": np.round(rng.uniform(1, 15, rows), 1)
+    })
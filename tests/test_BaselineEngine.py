@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+from BaselineEngine import BaselineEngine
+
+@pytest.fixture
+def cohort(stiphoutCohort):
+    cohort = stiphoutCohort.copy()
+    cohort["tLength"] = cohort["tLength"].where(np.arange(cohort.shape[0]) % 17 != 0)
+    cohort["cT"] = cohort["cT"].astype("category")
+    cohort["age"] = np.arange(cohort.shape[0]) % 40 + 40
+    return cohort
+
+def getCharacteristics(*chunks):
+    baselineEngine = BaselineEngine()
+    for chunk in chunks:
+        baselineEngine.add(chunk)
+    return baselineEngine.getCharacteristics()
+
+def test_chunks_merge_to_the_whole_cohort(cohort):
+    # pages decoded separately have their own categories, which only overlap partly
+    chunks = [cohort.iloc[start:start + 120].copy() for start in range(0, cohort.shape[0], 120)]
+    for chunk in chunks:
+        chunk["cT"] = chunk["cT"].cat.remove_unused_categories()
+    assert getCharacteristics(*chunks) == getCharacteristics(cohort)
+
+def test_numeric_summaries_equal_describe(cohort):
+    characteristics = getCharacteristics(cohort)["characteristics"]
+    for columnName in ["tLength", "age"]:
+        described = cohort[columnName].describe()
+        assert characteristics[columnName]["count"] == described["count"]
+        assert characteristics[columnName]["missing"] == cohort[columnName].isna().sum()
+        for name in ["mean", "std", "min", "25%", "50%", "75%", "max"]:
+            assert characteristics[columnName][name] == pytest.approx(described[name], rel=1e-12)
+
+def test_category_counts(cohort):
+    characteristics = getCharacteristics(cohort)["characteristics"]["cN"]
+    valueCounts = cohort["cN"].value_counts()
+    assert characteristics["unique"] == valueCounts.shape[0]
+    assert characteristics["value_counts"] == {value: int(count) for value, count in valueCounts.items()}
+    assert characteristics["freq"] == valueCounts.max()
+
+def test_inconsistent_chunk_types_become_categories():
+    characteristics = getCharacteristics(pd.DataFrame({"stage": [1, 2, 2]}), pd.DataFrame({"stage": ["2", "T3", None]}))
+    assert characteristics["rows"] == 6
+    assert characteristics["characteristics"]["stage"]["value_counts"] == {"1": 1, "2": 3, "T3": 1}
+    assert characteristics["characteristics"]["stage"]["missing"] == 1
+
+def test_identifier_columns_omit_category_counts():
+    characteristics = getCharacteristics(pd.DataFrame({"patient": ["p%d" % number for number in range(10)]}))
+    assert "value_counts" not in characteristics["characteristics"]["patient"]
+    assert characteristics["characteristics"]["patient"]["unique"] == 10
@@ -0,0 +1,44 @@
+import multiprocessing
+import numpy as np
+import pandas as pd
+import pytest
+
+pyarrow = pytest.importorskip("pyarrow")
+from CohortCache import CohortCache
+
+endpointUrl = "http://example.org/sparql"
+
+def storeCohorts(cacheDirectory, worker, count):
+    cohortCache = CohortCache(cacheDirectory)
+    for number in range(count):
+        cohortCache.storeDataFrame(endpointUrl, "SELECT %d %d" % (worker, number), pd.DataFrame({"age": [worker, number]}))
+
+def test_roundtrip_and_invalidation(tmp_path, stiphoutCohort):
+    cohortCache = CohortCache(str(tmp_path))
+    cohort = stiphoutCohort.astype({"cT": "category"})
+    cohortCache.storeDataFrame(endpointUrl, "SELECT *", cohort)
+    cached = cohortCache.getDataFrame(endpointUrl, "SELECT *")
+    pd.testing.assert_frame_equal(cached, cohort)
+    assert cohortCache.getDataFrame("http://example.org/other", "SELECT *") is None
+    cohortCache.invalidate(endpointUrl)
+    assert cohortCache.getDataFrame(endpointUrl, "SELECT *") is None
+
+def test_expired_entries_are_not_used(tmp_path):
+    cohortCache = CohortCache(str(tmp_path), ttl=-1)
+    cohortCache.storeDataFrame(endpointUrl, "SELECT *", pd.DataFrame({"age": [40]}))
+    assert cohortCache.getDataFrame(endpointUrl, "SELECT *") is None
+
+def test_concurrent_processes_keep_all_entries(tmp_path):
+    # every process has its own CohortCache, so only the lock file serializes the index updates
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=storeCohorts, args=(str(tmp_path), worker, 10)) for worker in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert [process.exitcode for process in processes] == [0] * 4
+    cohortCache = CohortCache(str(tmp_path))
+    for worker in range(4):
+        for number in range(10):
+            cached = cohortCache.getDataFrame(endpointUrl, "SELECT %d %d" % (worker, number))
+            assert cached["age"].tolist() == [worker, number]
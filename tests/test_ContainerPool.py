@@ -0,0 +1,143 @@
+import threading
+import time
+import http.server
+import pytest
+import requests
+import ContainerPool as containerPoolModule
+from ContainerPool import ContainerPool
+
+class FakeContainer:
+    def __init__(self, client, port):
+        self.__client = client
+        self.id = "container%d" % len(client.containers.started)
+        self.short_id = self.id
+        self.status = "running"
+        self.ports = {"80/tcp": [{"HostPort": str(port)}]}
+    def reload(self):
+        pass
+    def stop(self):
+        self.status = "exited"
+        self.__client.containers.stopped.append(self.id)
+    def remove(self):
+        pass
+    def logs(self, tail=20):
+        return b""
+
+class FakeContainers:
+    def __init__(self, client, port):
+        self.__client = client
+        self.__port = port
+        self.started = []
+        self.stopped = []
+        self.failing = False
+    def run(self, imageUrl, detach=True, ports=None):
+        if self.failing:
+            raise RuntimeError("cannot create container")
+        container = FakeContainer(self.__client, self.__port)
+        self.started.append(container.id)
+        return container
+
+class FakeImages:
+    def __init__(self):
+        self.pulled = []
+    def pull(self, imageUrl):
+        # slow pull, so concurrent startups overlap
+        time.sleep(0.1)
+        self.pulled.append(imageUrl)
+
+class FakeDockerClient:
+    """
+    Stand-in for the docker client: containers "run" the stub HTTP server of the test.
+    """
+    def __init__(self, port):
+        self.images = FakeImages()
+        self.containers = FakeContainers(self, port)
+
+@pytest.fixture
+def dockerClient(monkeypatch):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), http.server.BaseHTTPRequestHandler)
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    client = FakeDockerClient(server.server_port)
+    monkeypatch.setattr(containerPoolModule.docker, "from_env", lambda: client)
+    monkeypatch.setattr(ContainerPool, "maxContainersPerImage", 2)
+    yield client
+    server.shutdown()
+
+@pytest.fixture
+def pool(dockerClient):
+    pool = ContainerPool()
+    yield pool
+    pool.shutdown()
+
+def test_released_container_is_reused(dockerClient, pool):
+    with pool.container("image", 80) as firstUrl:
+        pass
+    with pool.container("image", 80) as secondUrl:
+        pass
+    assert firstUrl == secondUrl
+    assert len(dockerClient.containers.started) == 1
+
+def test_acquire_waits_for_a_release_at_the_limit(dockerClient, pool):
+    first = pool.acquire("image", 80)
+    second = pool.acquire("image", 80)
+    threading.Timer(0.2, pool.release, ("image", 80, second)).start()
+    assert pool.acquire("image", 80) is second
+    assert len(dockerClient.containers.started) == 2
+    pool.release("image", 80, first)
+
+def test_concurrent_startups_pull_the_image_once(dockerClient, pool):
+    threads = [threading.Thread(target=pool.acquire, args=("image", 80)) for number in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert dockerClient.images.pulled == ["image"]
+    assert len(dockerClient.containers.started) == 2
+
+def test_connection_error_removes_the_container(dockerClient, pool):
+    with pytest.raises(requests.exceptions.ConnectionError):
+        with pool.container("image", 80):
+            raise requests.exceptions.ConnectionError("container died")
+    assert dockerClient.containers.stopped == ["container0"]
+    with pool.container("image", 80):
+        pass
+    assert dockerClient.containers.started == ["container0", "container1"]
+
+class Interrupt(BaseException):
+    pass
+
+@pytest.mark.parametrize("errorType", [ValueError, Interrupt])
+def test_other_errors_release_the_container(dockerClient, pool, errorType):
+    with pytest.raises(errorType):
+        with pool.container("image", 80):
+            raise errorType("invocation failed")
+    with pool.container("image", 80):
+        pass
+    assert len(dockerClient.containers.started) == 1
+    assert dockerClient.containers.stopped == []
+
+def test_failed_startup_frees_the_slot(dockerClient, pool, monkeypatch):
+    monkeypatch.setattr(ContainerPool, "maxContainersPerImage", 1)
+    dockerClient.containers.failing = True
+    with pytest.raises(RuntimeError):
+        pool.acquire("image", 80)
+    dockerClient.containers.failing = False
+    pool.release("image", 80, pool.acquire("image", 80))
+
+def test_idle_containers_are_reaped(dockerClient, pool, monkeypatch):
+    pool.release("image", 80, pool.acquire("image", 80))
+    monkeypatch.setattr(ContainerPool, "idleTtl", 0)
+    time.sleep(0.01)
+    pool.reapIdleContainers()
+    assert dockerClient.containers.stopped == ["container0"]
+
+def test_shutdown_stops_containers_in_use(dockerClient, pool):
+    inUse = pool.acquire("image", 80)
+    pool.release("image", 80, pool.acquire("image", 80))
+    pool.shutdown()
+    assert sorted(dockerClient.containers.stopped) == ["container0", "container1"]
+    with pytest.raises(RuntimeError):
+        pool.acquire("image", 80)
+    # an invocation which ends after the shutdown does not stop its container again
+    pool.release("image", 80, inUse)
+    assert len(dockerClient.containers.stopped) == 2
@@ -0,0 +1,253 @@
+import io
+import json
+import time
+import types
+import socket
+import threading
+import contextlib
+import http.server
+import numpy as np
+import pandas as pd
+import pytest
+import requests
+import ModelEngine as modelEngineModule
+from ModelEngine import DockerExecutor
+from ContainerPool import ContainerPool
+
+prefix = "http://example.org/model#"
+ageParameter = prefix + "age"
+stageParameter = prefix + "stage"
+
+class FakePool:
+    """
+    Stand-in for the ContainerPool: every invocation uses the same (stub) model service.
+    """
+    @contextlib.contextmanager
+    def container(self, imageUrl, containerPort):
+        yield "http://model.invalid"
+
+class StubModelService:
+    """
+    Stub for requests.post on the bulk invocation URL: the probability of a row is age / 100 + stage / 10.
+    JSON responses list the rows in reverse order (they are matched by row number), and the first chunk responds last.
+    """
+    def __init__(self, failingAge=None):
+        self.failingAge = failingAge
+        self.requests = []
+
+    def post(self, url, json=None, data=None, timeout=None, headers=None):
+        if json is not None:
+            mediaType = "application/json"
+            chunk = pd.read_json(io.StringIO(json))
+        else:
+            mediaType = headers["Content-Type"]
+            chunk = modelEngineModule.pyarrow.ipc.open_stream(data).read_all().to_pandas()
+        self.requests.append((mediaType, chunk.shape[0]))
+        if self.failingAge in chunk[ageParameter].tolist():
+            raise requests.exceptions.HTTPError("500 Server Error")
+        if 0 in chunk[ageParameter].tolist():
+            time.sleep(0.1)
+
+        probabilities = pd.DataFrame({"probability": pd.to_numeric(chunk[ageParameter], errors="coerce") / 100
+            + pd.to_numeric(chunk[stageParameter], errors="coerce") / 10})
+        if mediaType == DockerExecutor.arrowMediaType:
+            table = modelEngineModule.pyarrow.Table.from_pandas(probabilities, preserve_index=False)
+            sink = modelEngineModule.pyarrow.BufferOutputStream()
+            with modelEngineModule.pyarrow.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+            return StubResponse(sink.getvalue().to_pybytes(), mediaType)
+        return StubResponse.fromJson(probabilities.iloc[::-1].to_json())
+
+class StubResponse:
+    def __init__(self, content, contentType):
+        self.content = content
+        self.headers = {"Content-Type": contentType}
+        self.request = types.SimpleNamespace(body=b"")
+
+    @classmethod
+    def fromJson(cls, value):
+        return cls(json.dumps(value).encode("utf8"), "application/json")
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return json.loads(self.content)
+
+@pytest.fixture
+def modelService(monkeypatch):
+    modelService = StubModelService()
+    monkeypatch.setattr(ContainerPool, "getPool", lambda: FakePool())
+    monkeypatch.setattr(modelEngineModule.requests, "post", modelService.post)
+    monkeypatch.setattr(DockerExecutor, "bulkChunkSize", 7)
+    monkeypatch.setattr(DockerExecutor, "maxConcurrentRequests", 4)
+    return modelService
+
+def createExecutor(acceptType=["application/json"], invocationUrlBulk="/predict_bulk"):
+    specification = {
+        "modelParameters": {
+            ageParameter: {"featureName": "age", "beta": None},
+            stageParameter: {"featureName": "stage", "beta": None}
+        },
+        "valueForTermLists": {stageParameter: {"http://example.org/T1": 1, "http://example.org/T2": 2}},
+        "dockerParams": {
+            "imageUrl": "image",
+            "containerPort": "80",
+            "invocationUrl": "/predict",
+            "invocationUrlBulk": "/predict_bulk",
+            "httpMethod": "POST",
+            "acceptType": acceptType
+        }
+    }
+    if invocationUrlBulk is None:
+        specification["dockerParams"]["invocationUrlBulk"] = None
+    return DockerExecutor(prefix + "model", None, specification)
+
+@pytest.fixture
+def cohort():
+    ages = np.arange(50)
+    return pd.DataFrame({
+        "age": ages,
+        "stage": np.where(ages % 2 == 0, "http://example.org/T1", "http://example.org/T2"),
+    }, index=pd.RangeIndex(100, 150))
+
+def getExpectedProbabilities(cohort):
+    return cohort["age"].to_numpy() / 100 + np.where(cohort["age"].to_numpy() % 2 == 0, 1, 2) / 10
+
+def test_chunks_are_reassembled_in_row_order(modelService, cohort):
+    result = createExecutor().executeModelOnDataFrame(cohort)
+    assert sorted(rows for mediaType, rows in modelService.requests) == [1] + [7] * 7
+    assert result.index.equals(cohort.index)
+    np.testing.assert_allclose(result["probability"].to_numpy(), getExpectedProbabilities(cohort))
+    assert "probability" not in cohort.columns
+
+def test_failed_chunks_are_recorded(modelService, cohort):
+    modelService.failingAge = 23
+    executor = createExecutor()
+    probabilities = executor.executeModelOnDataFrame(cohort)["probability"].to_numpy()
+    assert np.isnan(probabilities[21:28]).all()
+    expected = getExpectedProbabilities(cohort)
+    np.testing.assert_allclose(np.delete(probabilities, range(21, 28)), np.delete(expected, range(21, 28)))
+    failedChunks = executor.getFailedChunks()
+    assert [(failedChunk["offset"], failedChunk["rows"]) for failedChunk in failedChunks] == [(21, 7)]
+    assert "500 Server Error" in failedChunks[0]["error"]
+
+    # the failures of an earlier call are not kept
+    modelService.failingAge = None
+    executor.executeModelOnDataFrame(cohort)
+    assert executor.getFailedChunks() == []
+
+arrowAcceptTypes = ["application/json", DockerExecutor.arrowMediaType]
+
+def test_arrow_is_negotiated_when_declared():
+    assert createExecutor(arrowAcceptTypes).getBulkMediaType() == DockerExecutor.arrowMediaType
+    assert createExecutor(DockerExecutor.arrowMediaType).getBulkMediaType() == DockerExecutor.arrowMediaType
+    assert createExecutor(["application/json"]).getBulkMediaType() == "application/json"
+
+def test_json_is_used_without_pyarrow(monkeypatch):
+    monkeypatch.setattr(modelEngineModule, "pyarrow", None)
+    assert createExecutor(arrowAcceptTypes).getBulkMediaType() == "application/json"
+
+def test_arrow_invocation_equals_json_invocation(modelService, cohort):
+    arrowResult = createExecutor(arrowAcceptTypes).executeModelOnDataFrame(cohort)
+    assert set(mediaType for mediaType, rows in modelService.requests) == set([DockerExecutor.arrowMediaType])
+    jsonResult = createExecutor().executeModelOnDataFrame(cohort)
+    np.testing.assert_allclose(arrowResult["probability"].to_numpy(), getExpectedProbabilities(cohort))
+    # DataFrame.to_json rounds to 10 digits, Arrow keeps the exact values
+    np.testing.assert_allclose(arrowResult["probability"].to_numpy(), jsonResult["probability"].to_numpy(), rtol=1e-9)
+
+def test_chunks_which_cannot_be_encoded_as_arrow_are_sent_as_json(modelService, cohort):
+    # an untranslated stage is kept as-is, so the first chunk has a column with integers and a string
+    cohort.loc[cohort.index[3], "stage"] = "unknown stage"
+    executor = createExecutor(arrowAcceptTypes)
+    probabilities = executor.executeModelOnDataFrame(cohort)["probability"].to_numpy()
+    assert sorted(mediaType for mediaType, rows in modelService.requests) == ["application/json"] + [DockerExecutor.arrowMediaType] * 7
+    assert executor.getFailedChunks() == []
+    expected = getExpectedProbabilities(cohort)
+    assert np.isnan(probabilities[3])
+    np.testing.assert_allclose(np.delete(probabilities, 3), np.delete(expected, 3))
+
+class RecordingPool:
+    """
+    Stand-in for the ContainerPool with one model service at baseUrl, recording whether the container was removed
+    (invocation ended with a connection error) or released.
+    """
+    def __init__(self, baseUrl):
+        self.baseUrl = baseUrl
+        self.removed = 0
+        self.released = 0
+
+    @contextlib.contextmanager
+    def container(self, imageUrl, containerPort):
+        try:
+            yield self.baseUrl
+        except requests.exceptions.ConnectionError:
+            self.removed = self.removed + 1
+            raise
+        self.released = self.released + 1
+
+class RowModelHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Single-row model service: responds age / 100, and drops the connection for rows with an age from failingAge on
+    (as a container which crashed during the invocation).
+    """
+    failingAge = None
+
+    def do_POST(self):
+        record = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.failingAge is not None and record[ageParameter] >= self.failingAge:
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return
+        content = json.dumps({"probability": record[ageParameter] / 100}).encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def rowModelServer(monkeypatch):
+    monkeypatch.setattr(DockerExecutor, "rowRetries", 0)
+    monkeypatch.setattr(DockerExecutor, "maxConcurrentRowRequests", 4)
+    handler = type("Handler", (RowModelHandler,), {})
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield handler, "http://127.0.0.1:%d" % server.server_port
+    server.shutdown()
+    server.server_close()
+
+def executePerRow(monkeypatch, baseUrl, cohort):
+    pool = RecordingPool(baseUrl)
+    monkeypatch.setattr(ContainerPool, "getPool", lambda: pool)
+    executor = createExecutor(invocationUrlBulk=None)
+    probabilities = executor.executeModelOnDataFrame(cohort)["probability"].to_numpy()
+    return pool, executor, probabilities
+
+def test_rows_are_sent_to_the_single_row_invocation_url(monkeypatch, rowModelServer, cohort):
+    handler, baseUrl = rowModelServer
+    pool, executor, probabilities = executePerRow(monkeypatch, baseUrl, cohort)
+    np.testing.assert_allclose(probabilities, cohort["age"].to_numpy() / 100)
+    assert executor.getFailedRows() == {}
+    assert (pool.released, pool.removed) == (1, 0)
+
+def test_container_which_stops_responding_is_removed(monkeypatch, rowModelServer, cohort):
+    handler, baseUrl = rowModelServer
+    handler.failingAge = 40
+    pool, executor, probabilities = executePerRow(monkeypatch, baseUrl, cohort)
+    assert np.isnan(probabilities[40:]).all()
+    np.testing.assert_allclose(probabilities[:40], cohort["age"].to_numpy()[:40] / 100)
+    assert sorted(executor.getFailedRows().keys()) == list(range(40, 50))
+    assert (pool.released, pool.removed) == (0, 1)
+
+def test_unreachable_container_is_removed(monkeypatch, cohort):
+    with socket.socket() as unusedSocket:
+        unusedSocket.bind(("127.0.0.1", 0))
+        baseUrl = "http://127.0.0.1:%d" % unusedSocket.getsockname()[1]
+    pool, executor, probabilities = executePerRow(monkeypatch, baseUrl, cohort)
+    assert np.isnan(probabilities).all()
+    assert len(executor.getFailedRows()) == cohort.shape[0]
+    assert (pool.released, pool.removed) == (0, 1)
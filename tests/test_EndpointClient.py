@@ -0,0 +1,89 @@
+import pytest
+import rdflib
+from rdflib import RDF
+from EndpointClient import LocalEndpointClient, LocalTransaction
+from ValidationEngine import ValidationEndpoint
+
+fml = rdflib.Namespace("https://fairmodels.org/ontology.owl#")
+requestId = "http://example.org/request1"
+graphUri = "http://example.org/request1_results"
+triples = b"<http://example.org/request1_results> <http://example.org/auc> \"0.75\" .\n"
+
+@pytest.fixture
+def client():
+    client = LocalEndpointClient()
+    statusUri = rdflib.URIRef(requestId + "_status")
+    client.dataset.default_graph.add((rdflib.URIRef(requestId), RDF.type, fml.ValidationRequest))
+    client.dataset.default_graph.add((rdflib.URIRef(requestId), fml.has_status, statusUri))
+    client.dataset.default_graph.add((statusUri, RDF.type, fml.Requested))
+    return client
+
+def getStatusTypes(client):
+    return set(client.dataset.default_graph.objects(None, RDF.type)) & set([fml.Requested, fml.InProgress, fml.Done])
+
+def getResultTriples(client):
+    return list(client.dataset.graph(rdflib.URIRef(graphUri)).triples((None, None, None)))
+
+def test_publish_stores_results_and_marks_request_done(client):
+    ValidationEndpoint("http://example.org/sparql", client=client).publishValidationResults(requestId, graphUri, triples)
+    assert len(getResultTriples(client)) == 1
+    assert getStatusTypes(client) == set([fml.Done])
+
+def test_failing_publish_leaves_store_untouched(client):
+    with pytest.raises(Exception):
+        with client.transaction() as transaction:
+            transaction.add(triples, graphUri=graphUri)
+            transaction.update("this is not SPARQL")
+    assert getResultTriples(client) == []
+    assert getStatusTypes(client) == set([fml.Requested])
+
+def test_exception_in_block_rolls_back(client):
+    with pytest.raises(KeyError):
+        with client.transaction() as transaction:
+            transaction.add(triples, graphUri=graphUri)
+            raise KeyError("publish failed")
+    assert getResultTriples(client) == []
+
+def test_failing_rollback_keeps_original_error(client, monkeypatch):
+    def failingRollback(self):
+        raise RuntimeError("rollback failed")
+    monkeypatch.setattr(LocalTransaction, "rollback", failingRollback)
+    with pytest.raises(KeyError):
+        with client.transaction() as transaction:
+            transaction.add(triples, graphUri=graphUri)
+            raise KeyError("publish failed")
+    assert getResultTriples(client) == []
+
+def test_claim_is_exclusive(client):
+    endpoint = ValidationEndpoint("http://example.org/sparql", client=client)
+    assert endpoint.claimRequest(requestId, "worker1", 900)
+    assert not endpoint.claimRequest(requestId, "worker2", 900)
+    assert getStatusTypes(client) == set([fml.InProgress])
+    assert endpoint.getOpenValidationRequests() == []
+
+def test_expired_claim_is_recovered(client):
+    endpoint = ValidationEndpoint("http://example.org/sparql", client=client)
+    assert endpoint.claimRequest(requestId, "worker1", -60)
+    endpoint.recoverExpiredLeases()
+    assert getStatusTypes(client) == set([fml.Requested])
+    assert endpoint.claimRequest(requestId, "worker2", 900)
+
+def test_worker_identifier_is_escaped(client):
+    endpoint = ValidationEndpoint("http://example.org/sparql", client=client)
+    workerId = 'host "quoted" \\ worker'
+    assert endpoint.claimRequest(requestId, workerId, 900)
+    assert endpoint.renewLease(requestId, workerId, 900)
+
+def test_renewal_reports_a_lost_lease(client):
+    endpoint = ValidationEndpoint("http://example.org/sparql", client=client)
+    assert endpoint.claimRequest(requestId, "worker1", -60)
+    endpoint.recoverExpiredLeases()
+    assert endpoint.claimRequest(requestId, "worker2", 900)
+    assert not endpoint.renewLease(requestId, "worker1", 900)
+    assert endpoint.renewLease(requestId, "worker2", 900)
+
+def test_publish_after_claim_marks_request_done(client):
+    endpoint = ValidationEndpoint("http://example.org/sparql", client=client)
+    assert endpoint.claimRequest(requestId, "worker1", 900)
+    endpoint.publishValidationResults(requestId, graphUri, triples)
+    assert getStatusTypes(client) == set([fml.Done])
@@ -0,0 +1,105 @@
+import os
+import numpy as np
+import pytest
+import rdflib
+from ExpressionCompiler import ExpressionCompiler
+
+queryPath = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app", "queries", "operations.sparql")
+algorithmUri = rdflib.URIRef("http://example.org/algorithm")
+prefixes = """
+@prefix ex: <http://example.org/>.
+@prefix fml: <https://fairmodels.org/ontology.owl#>.
+@prefix rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>.
+@prefix xsd: <http://www.w3.org/2001/XMLSchema#>.
+
+ex:algorithm fml:contains_algorithm ex:linearPredictor.
+ex:age rdf:type fml:Algorithm_Input_Parameter.
+ex:size rdf:type fml:Algorithm_Input_Parameter.
+"""
+
+def compileOperations(operations):
+    graph = rdflib.Graph().parse(data=prefixes + "ex:linearPredictor rdf:type fml:linear_predictor;\n" + operations, format="turtle")
+    with open(queryPath) as f:
+        queryResults = graph.query(f.read(), initBindings={"modelUri": algorithmUri})
+    return ExpressionCompiler.compileAlgorithm(queryResults)
+
+def test_linear_predictor_is_evaluated_over_columns():
+    expression = compileOperations("""
+        fml:contains_operation [
+            rdf:type fml:Addition;
+            fml:Primary_operation_value_reference [ rdf:type fml:Intercept; fml:has_value "-0.5"^^xsd:double ];
+            fml:has_operation_value [
+                rdf:type fml:Multiplication;
+                fml:Primary_operation_value_reference ex:age;
+                fml:secondary_operation_value "0.02"^^xsd:double
+            ];
+            fml:has_operation_value [
+                rdf:type fml:Multiplication;
+                fml:Primary_operation_value_reference [ rdf:type fml:Logarithm; fml:Primary_operation_value_reference ex:size ];
+                fml:secondary_operation_value "-0.1"^^xsd:double
+            ]
+        ].
+    """)
+    age = np.array([40.0, 60.0, 80.0])
+    size = np.array([1.0, 5.0, -1.0])
+    columns = {"http://example.org/age": age, "http://example.org/size": size}
+    with np.errstate(invalid="ignore"):
+        expected = -0.5 + 0.02 * age - 0.1 * np.log(size)
+
+    assert expression.getParameterIds() == set(["http://example.org/age", "http://example.org/size"])
+    np.testing.assert_allclose(expression.evaluate(columns, 3), expected, equal_nan=True)
+    # the logarithm of a negative value results in NaN for that row only
+    assert np.isnan(expression.evaluate(columns, 3)[2])
+
+def test_operand_order_is_primary_then_secondary():
+    expression = compileOperations("""
+        fml:contains_operation [
+            rdf:type fml:Subtraction;
+            fml:secondary_operation_value "1.0"^^xsd:double;
+            fml:Primary_operation_value_reference ex:age
+        ].
+    """)
+    np.testing.assert_allclose(expression.evaluate({"http://example.org/age": np.array([10.0])}, 1), [9.0])
+
+def test_dictionary_round_trip():
+    expression = compileOperations("""
+        fml:contains_operation [
+            rdf:type fml:Power;
+            fml:Primary_operation_value_reference ex:age;
+            fml:secondary_operation_value "2"^^xsd:integer
+        ].
+    """)
+    columns = {"http://example.org/age": np.array([1.0, 2.0, 3.0])}
+    restored = ExpressionCompiler.fromDict(expression.toDict())
+    np.testing.assert_array_equal(restored.evaluate(columns, 3), expression.evaluate(columns, 3))
+
+def test_ambiguous_operation_type_is_rejected():
+    with pytest.raises(ValueError, match="Ambiguous"):
+        compileOperations("""
+            fml:contains_operation [
+                rdf:type fml:Addition, fml:Multiplication;
+                fml:Primary_operation_value_reference ex:age;
+                fml:secondary_operation_value "2.0"^^xsd:double
+            ].
+        """)
+
+def test_unsupported_operation_is_rejected():
+    with pytest.raises(ValueError, match="Unsupported"):
+        compileOperations("""
+            fml:contains_operation [
+                rdf:type ex:Modulo;
+                fml:Primary_operation_value_reference ex:age
+            ].
+        """)
+
+def test_cyclic_operations_are_rejected():
+    with pytest.raises(ValueError, match="Cyclic"):
+        compileOperations("""
+            fml:contains_operation ex:operation.
+            ex:operation rdf:type fml:Addition;
+                fml:Primary_operation_value_reference ex:operation.
+        """)
+
+def test_missing_linear_predictor_is_rejected():
+    with pytest.raises(ValueError):
+        ExpressionCompiler.compileAlgorithm([])
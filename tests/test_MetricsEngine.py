@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+from sklearn.calibration import calibration_curve
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import brier_score_loss, precision_recall_curve, roc_auc_score, roc_curve
+from MetricsEngine import MetricsEngine, MetricsAccumulator
+
+def createSample(rowCount=5000, seed=0, roundTo=None):
+    rng = np.random.default_rng(seed)
+    predicted = rng.uniform(0, 1, rowCount)
+    if roundTo is not None:
+        # ties in the predictions, as produced by models with categorical inputs
+        predicted = np.round(predicted, roundTo)
+    observed = (rng.uniform(0, 1, rowCount) < predicted).astype(int)
+    return (observed, predicted)
+
+@pytest.mark.parametrize("roundTo", [None, 2])
+def test_metrics_equal_sklearn(roundTo):
+    observed, predicted = createSample(roundTo=roundTo)
+    metrics = MetricsEngine.calculateMetrics(observed, predicted)
+
+    assert metrics["count"] == observed.shape[0]
+    assert metrics["auc"] == pytest.approx(roc_auc_score(observed, predicted), abs=1e-12)
+    assert metrics["brier"] == pytest.approx(brier_score_loss(observed, predicted), abs=1e-12)
+    fpr, tpr, thresholds = roc_curve(observed, predicted)
+    np.testing.assert_allclose(metrics["roc_curve"]["fpr"], fpr)
+    np.testing.assert_allclose(metrics["roc_curve"]["tpr"], tpr)
+    precision, recall, thresholds = precision_recall_curve(observed, predicted)
+    np.testing.assert_allclose(metrics["precision_recall_curve"]["precision"], precision)
+    np.testing.assert_allclose(metrics["precision_recall_curve"]["recall"], recall)
+    probTrue, probPred = calibration_curve(observed, predicted, n_bins=5)
+    np.testing.assert_allclose(metrics["calibration_curve"]["prob_true"], probTrue)
+    np.testing.assert_allclose(metrics["calibration_curve"]["prob_pred"], probPred)
+
+def test_calibration_slope_equals_logistic_fit():
+    observed, predicted = createSample()
+    metrics = MetricsEngine.calculateMetrics(observed, predicted)
+    # unpenalized logistic regression of the outcome on the logit of the predictions
+    reference = LogisticRegression(C=1e10, tol=1e-10, max_iter=1000).fit(MetricsEngine.logit(predicted)[:, np.newaxis], observed)
+    assert metrics["calibration_slope"] == pytest.approx(reference.coef_[0][0], abs=1e-5)
+
+def test_minus_one_outcomes_equal_zero_outcomes():
+    observed, predicted = createSample()
+    metrics = MetricsEngine.calculateMetrics(observed, predicted)
+    negativeMetrics = MetricsEngine.calculateMetrics(np.where(observed == 1, 1, -1), predicted)
+    assert negativeMetrics["auc"] == metrics["auc"]
+    assert negativeMetrics["brier"] == metrics["brier"]
+
+def test_non_binary_outcome_is_rejected():
+    with pytest.raises(ValueError):
+        MetricsEngine.calculateMetrics(np.array([0, 1, 2]), np.array([0.1, 0.5, 0.9]))
+
+def test_exact_accumulator_equals_complete_cohort():
+    observed, predicted = createSample(roundTo=3)
+    metrics = MetricsEngine.calculateMetrics(observed, predicted)
+    accumulator = MetricsAccumulator(mode="exact")
+    for start in range(0, observed.shape[0], 777):
+        accumulator.add(observed[start:start + 777], predicted[start:start + 777])
+    accumulatedMetrics = accumulator.getMetrics()
+
+    assert accumulatedMetrics["count"] == metrics["count"]
+    assert accumulatedMetrics["auc"] == metrics["auc"]
+    assert accumulatedMetrics["brier"] == metrics["brier"]
+    np.testing.assert_array_equal(accumulatedMetrics["roc_curve"]["tpr"], metrics["roc_curve"]["tpr"])
+    np.testing.assert_array_equal(accumulatedMetrics["calibration_curve"]["prob_true"], metrics["calibration_curve"]["prob_true"])
+
+def test_histogram_accumulator_approximates_complete_cohort():
+    observed, predicted = createSample()
+    metrics = MetricsEngine.calculateMetrics(observed, predicted)
+    accumulator = MetricsAccumulator(mode="histogram", histogramBins=10000)
+    for start in range(0, observed.shape[0], 777):
+        accumulator.add(observed[start:start + 777], predicted[start:start + 777])
+    accumulatedMetrics = accumulator.getMetrics()
+
+    assert accumulatedMetrics["count"] == metrics["count"]
+    assert accumulatedMetrics["auc"] == pytest.approx(metrics["auc"], abs=1e-4)
+    assert accumulatedMetrics["brier"] == pytest.approx(metrics["brier"], abs=1e-12)
+    np.testing.assert_allclose(accumulatedMetrics["calibration_curve"]["prob_true"], metrics["calibration_curve"]["prob_true"])
+    np.testing.assert_allclose(accumulatedMetrics["calibration_curve"]["prob_pred"], metrics["calibration_curve"]["prob_pred"])
+    assert accumulatedMetrics["calibration_slope"] == pytest.approx(metrics["calibration_slope"], abs=1e-2)
+
+def test_empty_accumulator_is_rejected():
+    with pytest.raises(ValueError):
+        MetricsAccumulator().getMetrics()
@@ -0,0 +1,34 @@
+import multiprocessing
+from ModelCache import ModelCache
+
+def test_ntriples_hash_ignores_order_and_blank_node_labels():
+    content = b'<http://example.org/model> <http://example.org/term> _:node1 .\n_:node1 <http://example.org/beta> "0.5" .\n'
+    reordered = b'_:genid-2f.b7 <http://example.org/beta> "0.5" .\n<http://example.org/model> <http://example.org/term> _:genid-2f.b7 .'
+    edited = b'_:node1 <http://example.org/beta> "0.6" .\n<http://example.org/model> <http://example.org/term> _:node1 .\n'
+    assert ModelCache.hashNTriples(content) == ModelCache.hashNTriples(reordered)
+    assert ModelCache.hashNTriples(content) != ModelCache.hashNTriples(edited)
+
+def storeSpecifications(cacheDirectory, worker, count):
+    modelCache = ModelCache(cacheDirectory)
+    for number in range(count):
+        modelCache.storeSpecification("http://example.org/model%d_%d" % (worker, number), "hash", {"intercept": number})
+
+def test_concurrent_processes_keep_all_entries(tmp_path):
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=storeSpecifications, args=(str(tmp_path), worker, 10)) for worker in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert [process.exitcode for process in processes] == [0] * 4
+    modelCache = ModelCache(str(tmp_path))
+    for worker in range(4):
+        for number in range(10):
+            assert modelCache.getSpecification("http://example.org/model%d_%d" % (worker, number), "hash") == {"intercept": number}
+
+def test_new_content_replaces_the_cached_specification(tmp_path):
+    modelCache = ModelCache(str(tmp_path))
+    modelCache.storeSpecification("http://example.org/model", "hash1", {"intercept": 1})
+    modelCache.storeSpecification("http://example.org/model", "hash2", {"intercept": 2})
+    assert modelCache.getSpecification("http://example.org/model", "hash1") is None
+    assert modelCache.getSpecification("http://example.org/model", "hash2") == {"intercept": 2}
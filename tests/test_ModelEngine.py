@@ -0,0 +1,40 @@
+import numpy as np
+from ModelEngine import ModelExecutor, LogisticRegression
+
+def test_vectorized_logistic_regression_equals_per_row(stiphoutModelEngine, stiphoutCohort):
+    modelExecutor = stiphoutModelEngine.getModelExecutor()
+    assert isinstance(modelExecutor, LogisticRegression)
+    vectorized = modelExecutor.executeModelOnDataFrame(stiphoutCohort)["probability"].to_numpy(dtype=float)
+    perRow = ModelExecutor.executeModelOnDataFrame(modelExecutor, stiphoutCohort.copy())["probability"].to_numpy(dtype=float)
+    assert not np.isnan(perRow).any()
+    # numpy.exp and math.exp may differ in the last bits (see LogisticRegression.executeModelOnDataFrame)
+    np.testing.assert_array_max_ulp(vectorized, perRow, maxulp=2)
+
+cTStageParameter = "https://fairmodels.org/models/radiotherapy/stiphout_2011_logistic#InputFeature_cTStage"
+
+def test_translated_column_equals_per_row_translation(stiphoutModelEngine, stiphoutCohort):
+    modelExecutor = stiphoutModelEngine.getModelExecutor()
+    column = stiphoutCohort["cT"].astype(object)
+    column.iloc[[3, 10]] = None
+    column.iloc[[5, 7, 11]] = "http://example.org/unknownStage"
+    column.iloc[8] = 2
+    translated = modelExecutor.translateColumn(cTStageParameter, column)
+    perRow = column.map(lambda value: modelExecutor.replaceParameterToLocalValue(cTStageParameter, value))
+    assert translated.index.equals(column.index)
+    assert translated.isna().tolist() == perRow.isna().tolist()
+    assert translated.dropna().tolist() == perRow.dropna().tolist()
+    # missing values and values which already are a local value are not reported
+    assert modelExecutor.getUntranslatedValues()[cTStageParameter] == {"http://example.org/unknownStage": 3}
+
+def test_translate_categorical_column(stiphoutModelEngine, stiphoutCohort):
+    modelExecutor = stiphoutModelEngine.getModelExecutor()
+    column = stiphoutCohort["cT"].astype("category")
+    translated = modelExecutor.translateColumn(cTStageParameter, column)
+    assert translated.tolist() == [modelExecutor.replaceParameterToLocalValue(cTStageParameter, value) for value in stiphoutCohort["cT"]]
+    assert modelExecutor.getUntranslatedValues()[cTStageParameter] == {}
+
+def test_parameter_without_translations_is_kept(stiphoutModelEngine, stiphoutCohort):
+    modelExecutor = stiphoutModelEngine.getModelExecutor()
+    parameterId = "https://fairmodels.org/models/radiotherapy/stiphout_2011_logistic#InputFeature_TLength"
+    column = stiphoutCohort["tLength"]
+    assert modelExecutor.translateColumn(parameterId, column) is column
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+import rdflib
+from EndpointClient import LocalEndpointClient
+from QueryEngine import QueryEngine
+
+ex = rdflib.Namespace("http://example.org/")
+
+def test_whitespace_and_comments_are_ignored():
+    query = """
+    PREFIX ex: <http://example.org/>   # prefix for the example data
+    SELECT ?patient ?age
+    WHERE {
+        ?patient ex:age ?age.   # age at diagnosis
+    }
+    """
+    assert QueryEngine.normalize_query(query) == "PREFIX ex: <http://example.org/> SELECT ?patient ?age WHERE { ?patient ex:age ?age. }"
+    assert QueryEngine.normalize_query(query) == QueryEngine.normalize_query("PREFIX ex: <http://example.org/>\tSELECT ?patient  ?age WHERE { ?patient ex:age ?age. }")
+
+def test_iris_with_hash_are_kept():
+    query = "SELECT ?s WHERE { ?s <http://ncicb.nci.nih.gov/xml/owl/EVS/Thesaurus.owl#C48705> ?o }"
+    assert QueryEngine.normalize_query(query) == query
+
+def test_string_literals_are_kept():
+    query = 'SELECT ?s WHERE { ?s ?p "a  # not a comment" . ?s ?q \'x\\\'  y\' }'
+    assert QueryEngine.normalize_query(query) == query
+
+def test_long_string_literals_are_kept():
+    query = 'SELECT ?s WHERE { ?s ?p """first line\n   # second "line" """ }'
+    assert QueryEngine.normalize_query(query) == query
+
+def test_different_literals_differ():
+    assert QueryEngine.normalize_query('SELECT * WHERE { ?s ?p "a b" }') != QueryEngine.normalize_query('SELECT * WHERE { ?s ?p "a  b" }')
+
+def createPagingEngine(patientCount):
+    """
+    QueryEngine over an in-memory store with patientCount patients; patients from number 12 on have no age, and a new stage.
+    """
+    dataset = rdflib.Dataset(default_union=True)
+    for number in range(patientCount):
+        patient = ex["patient%02d" % number]
+        dataset.default_graph.add((patient, ex.stage, rdflib.Literal("T1" if number < 12 else "T%d" % (number % 3 + 2), datatype=rdflib.XSD.string)))
+        if number < 12:
+            dataset.default_graph.add((patient, ex.age, rdflib.Literal(40 + number)))
+    return QueryEngine("http://example.org/sparql", client=LocalEndpointClient(dataset))
+
+pagingQuery = """
+PREFIX ex: <http://example.org/>
+SELECT ?patient ?stage ?age WHERE {
+    ?patient ex:stage ?stage.
+    OPTIONAL { ?patient ex:age ?age }
+}
+"""
+
+def test_pages_cover_all_rows_in_order():
+    engine = createPagingEngine(25)
+    pages = list(engine.iter_sparql_dataframe(pagingQuery, page_size=10, order_by="patient"))
+    assert [page.shape[0] for page in pages] == [10, 10, 5]
+    cohort = pd.concat(pages)
+    assert list(cohort.index) == list(range(25))
+    assert list(cohort["patient"]) == sorted(str(ex["patient%02d" % number]) for number in range(25))
+
+def test_page_size_dividing_the_result_size():
+    engine = createPagingEngine(20)
+    pages = list(engine.iter_sparql_dataframe(pagingQuery, page_size=10))
+    assert [page.shape[0] for page in pages] == [10, 10]
+
+def test_pages_share_the_schema():
+    engine = createPagingEngine(25)
+    pages = list(engine.iter_sparql_dataframe(pagingQuery, page_size=10, order_by="patient"))
+    # the first page only has integer ages, later pages have unbound ages: all pages are decoded as float64
+    assert all(page["age"].dtype == np.float64 for page in pages)
+    assert pages[0]["age"].tolist() == [float(40 + number) for number in range(10)]
+    assert pages[2]["age"].isna().all()
+    # categories only grow, so the categories of earlier pages keep their codes
+    firstCategories = list(pages[0]["stage"].cat.categories)
+    assert firstCategories == ["T1"]
+    for page in pages[1:]:
+        assert list(page["stage"].cat.categories[:len(firstCategories)]) == firstCategories
+    assert set(pages[-1]["stage"].cat.categories) == set(["T1", "T2", "T3", "T4"])
+
+def test_pages_equal_the_unpaged_result():
+    engine = createPagingEngine(25)
+    pages = list(engine.iter_sparql_dataframe(pagingQuery, page_size=7, order_by="patient"))
+    paged = pd.concat([page.astype({"stage": str}) for page in pages])
+    unpaged = engine.get_sparql_dataframe(pagingQuery).sort_values("patient").reset_index(drop=True)
+    assert paged["patient"].tolist() == unpaged["patient"].tolist()
+    assert paged["stage"].tolist() == unpaged["stage"].astype(str).tolist()
+    np.testing.assert_array_equal(paged["age"].to_numpy(dtype=float), unpaged["age"].to_numpy(dtype=float))
+
+def test_paging_a_query_ending_with_a_comment():
+    engine = createPagingEngine(25)
+    pages = list(engine.iter_sparql_dataframe(pagingQuery.replace("ex:stage ?stage.", "ex:stage ?stage. # staging") + "# end of cohort query", page_size=10))
+    assert sum(page.shape[0] for page in pages) == 25
@@ -0,0 +1,53 @@
+import rdflib
+from rdflib import XSD
+from TermTranslationIndex import TermTranslationIndex
+
+def test_convert_numeric_literals():
+    assert TermTranslationIndex.convertLiteral(rdflib.Literal("3", datatype=XSD.integer)) == 3
+    assert TermTranslationIndex.convertLiteral(rdflib.Literal("3", datatype=XSD.unsignedByte)) == 3
+    assert TermTranslationIndex.convertLiteral(rdflib.Literal("-2", datatype=XSD.long)) == -2
+    assert TermTranslationIndex.convertLiteral(rdflib.Literal("0.5", datatype=XSD.decimal)) == 0.5
+    assert TermTranslationIndex.convertLiteral(rdflib.Literal("1e-3", datatype=XSD.double)) == 0.001
+    assert type(TermTranslationIndex.convertLiteral(rdflib.Literal("2", datatype=XSD.float))) is float
+
+def test_convert_other_literals_to_strings():
+    assert TermTranslationIndex.convertLiteral(rdflib.Literal("T2")) == "T2"
+    assert TermTranslationIndex.convertLiteral(rdflib.Literal("T2", lang="en")) == "T2"
+    assert TermTranslationIndex.convertLiteral(rdflib.Literal("true", datatype=XSD.boolean)) == "true"
+    assert TermTranslationIndex.convertLiteral(rdflib.URIRef("http://example.org/T2")) == "http://example.org/T2"
+
+def test_invalid_numeric_literal_is_kept_as_string():
+    assert TermTranslationIndex.convertLiteral(rdflib.Literal("stage 2", datatype=XSD.integer)) == "stage 2"
+    assert TermTranslationIndex.convertLiteral(rdflib.Literal("n/a", datatype=XSD.double)) == "n/a"
+
+def getPerParameterTranslations(modelEngine):
+    """
+    Translation tables as built before TermTranslationIndex: only xsd:int, xsd:integer and xsd:double values are converted.
+    """
+    translations = {}
+    for row in modelEngine.performQueryFromFile("valueForTermList"):
+        value = str(row["value"])
+        if str(row["value"].datatype) in [str(XSD.int), str(XSD.integer)]:
+            value = int(value)
+        elif str(row["value"].datatype) == str(XSD.double):
+            value = float(value)
+        translations.setdefault(str(row["inputFeature"]), {})[str(row["term"])] = value
+    return translations
+
+def test_index_equals_the_per_parameter_translations(stiphoutModelEngine):
+    modelExecutor = stiphoutModelEngine.getModelExecutor()
+    index = modelExecutor.getTermTranslationIndex()
+    expected = getPerParameterTranslations(stiphoutModelEngine)
+    assert len(expected) == 2
+    assert index.toDict() == expected
+    for parameterId, translation in expected.items():
+        assert index.getTranslation(parameterId) == translation
+        assert index.getLocalValues(parameterId) == set(translation.values())
+    assert index.getTranslation("http://example.org/unknownParameter") is None
+    assert index.getLocalValues("http://example.org/unknownParameter") == set()
+
+def test_index_survives_serialization(stiphoutModelEngine):
+    index = stiphoutModelEngine.getModelExecutor().getTermTranslationIndex()
+    restored = TermTranslationIndex(index.toDict())
+    assert restored.toDict() == index.toDict()
+    assert sorted(restored.getParameterIds()) == sorted(index.getParameterIds())
@@ -0,0 +1,42 @@
+import threading
+import time
+import pytest
+from ValidationEngine import SharedCohort
+
+def test_shared_cohort_is_fetched_once():
+    fetches = []
+    def fetch():
+        fetches.append(1)
+        return "cohort"
+    sharedCohort = SharedCohort("SELECT * WHERE { ?s ?p ?o }", 2)
+    assert sharedCohort.get(fetch) == "cohort"
+    assert sharedCohort.get(fetch) == "cohort"
+    assert len(fetches) == 1
+
+def test_failed_fetch_is_not_repeated_by_waiting_requests():
+    fetches = []
+    errors = []
+    def fetch():
+        fetches.append(1)
+        time.sleep(0.2)
+        raise ConnectionError("data endpoint unavailable")
+    def processRequest():
+        try:
+            sharedCohort.get(fetch)
+        except ConnectionError as error:
+            errors.append(error)
+    sharedCohort = SharedCohort("SELECT * WHERE { ?s ?p ?o }", 3)
+    threads = [threading.Thread(target=processRequest) for index in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(fetches) == 1
+    assert len(errors) == 3
+
+def test_cohort_is_released_after_last_request():
+    sharedCohort = SharedCohort("SELECT * WHERE { ?s ?p ?o }", 1)
+    assert sharedCohort.get(lambda: "cohort") == "cohort"
+    sharedCohort.release()
+    with pytest.raises(ZeroDivisionError):
+        sharedCohort.get(lambda: 1 / 0)